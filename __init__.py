@@ -1,12 +1,13 @@
 """
-Initializing the SQL_PARAMS parameter to our json from our connections file.
+Exposes SQLConn, SQLQueue, their asyncio counterparts AsyncSQLConn and AsyncSQLQueue, AppendBuffer, SQLParams and
+BulkLoadError. The SQL_PARAMS dictionary of our connections file, and the modules that need pandas, SQLAlchemy or a
+database driver, are only loaded when first used so that importing the package stays cheap.
 """
-import json
-from pathlib import Path
-import os
+from .sqlparams import SQLParams
+from .bulkloaderror import BulkLoadError
 
 
-# The init will attempt to create a dictionary of SQL Parameters that can be accessed through SQLConn. The below text
+# On first use sqlconfig creates a dictionary of SQL Parameters that can be accessed through SQLConn. The below text
 # provides an example, including explanations, of what should be present in the JSON file.
 """
 {
@@ -30,7 +31,37 @@ import os
             "port": <mandatory int>,
             "type": "<mandatory string corresponding to python helper library for SQL engine connection>" 
             "username": "<optional string if not included must have corresponding username/password for this type>",
-            "password": "<optional string if not included must have corresponding username/password for this type>"
+            "password": "<optional string if not included must have corresponding username/password for this type>",
+            "compact": <optional bool, get_dataframe narrows dtypes and uses categoricals, default false>,
+            "prepared_statements": <optional bool, postgres prepares statements with bound parameters, default true>,
+            "metadata_ttl": <optional float, seconds table columns are cached, 0 turns caching off, default 300>,
+            "pool":
+            {
+                "pool_size": <optional int, connections kept open in the pool>,
+                "max_overflow": <optional int, connections allowed beyond pool_size>,
+                "pre_ping": <optional bool, test connections on checkout>,
+                "recycle": <optional int, seconds before a connection is replaced>,
+                "timeout": <optional int, seconds to wait for a connection from the pool>,
+                "prewarm": <optional int, connections opened by SQLConn.prewarm() when no count is passed>
+            },
+            "session":
+            {
+                "<setting name, e.g. work_mem, statement_timeout or application_name>": "<value applied on connect>"
+            },
+            "retry":
+            {
+                "max_retries": <optional int, retries of a transient or deadlock failure before raising>,
+                "base_delay": <optional float, seconds, upper bound of the first backoff>,
+                "max_delay": <optional float, seconds, largest backoff>,
+                "retry_deadlocks": <optional bool>
+            },
+            "cache":
+            {
+                "max_bytes": <optional int, memory used by cached get_dataframe results>,
+                "default_ttl": <optional float, seconds results are cached, by default only tables in table_ttls are>,
+                "table_ttls": {"<table name>": <float, seconds results reading from the table are cached>},
+                "spill_dir": "<optional string, directory shared by the processes of the host for Parquet copies>"
+            }
         },
         .
         .
@@ -40,68 +71,27 @@ import os
 """
 
 
-# We load the connection parameters from a json file to keep passwords hidden.
-# First set the search locations in order of priority (first is best).
-valid_locations = {1: Path('/data', 'code', 'config', 'connconfig.json'),
-                   2: Path(Path.home(), 'code', 'config', 'connconfig.json'),
-                   3: Path(Path(__file__).resolve().parent, 'connconfig.json')}
-
-# Loop through and load config files.
-found_configs = {}
-for key_ in valid_locations:
-    try:
-        with open(valid_locations[key_]) as fh:
-            found_configs[key_] = json.load(fh)
-    except:
-        pass
-
-# Break if none found.
-if len(found_configs.keys()) == 0:
-    raise RuntimeError('Not able to find the connconfig.json file for SQLConn')
-
-MASTER_CREDS = {}
-# Want to push credentials down from highest priority (lowest key value) file to lower levels. Sorted call for clarity.
-for key_ in sorted(found_configs.keys()):
-    config = found_configs[key_]
-    if 'credentials' in config.keys():
-        for type_ in config['credentials']:
-            if type_ not in MASTER_CREDS.keys():
-                uname_ = config['credentials'][type_]['username']
-                pword_ = config['credentials'][type_]['password']
-
-                if uname_ and pword_:
-                    MASTER_CREDS[type_] = {'username': uname_, 'password': pword_}
-
-
-if len(MASTER_CREDS.keys()) == 0:
-    raise RuntimeError('No config file has valid credentials')
-# Append overlap from highest priority (lowest key value) first.  Sorted call for clarity.
-SQL_PARAMS = {}
-for key_ in sorted(found_configs.keys()):
-    # We depend upon having a section of json at the outer level called databases
-    config = found_configs[key_]
-    if 'databases' in config.keys():
-        dbs = config['databases']
-        for db in dbs:
-            if db not in SQL_PARAMS:
-                SQL_PARAMS[db] = dbs[db]
-                # Now we have to check to make sure the username and password are present, if either one is not present
-                # then we will replace both. If we get here, we depend upon there being a section titled credentials
-                # in the outermost level of json. The keys in within credentials should be the same as the type present
-                # in the database descriptor.
-                if 'username' not in SQL_PARAMS[db].keys() or 'password' not in SQL_PARAMS[db].keys():
-                    SQL_PARAMS[db]['username'] = MASTER_CREDS[SQL_PARAMS[db]['type']]['username']
-                    SQL_PARAMS[db]['password'] = MASTER_CREDS[SQL_PARAMS[db]['type']]['password']
-                    if SQL_PARAMS[db]['username'] is None or SQL_PARAMS[db]['password'] is None:
-                        raise ConnectionError(f"The SQL connections do not have proper credentials, please copy the file "
-                                              f"from {Path(Path(__file__).resolve().parent, 'connconfig.json')}\n"
-                                              f"and place the file at /data/code/config/connconfig.json (Linux) or "
-                                              f"C:\\data\\code\\config\\connconfig.json (Windows). Then update the\n"
-                                              f"credentials section of the file to include the correct username/password "
-                                              f"combinations. If the file is already there, then just update the\n"
-                                              f"credentials and make sure nothings is null. Have a great day.")
-
-
-from .sqlconn import SQLConn
-from .sqlqueue import SQLQueue
-from .sqlparams import *
+def __getattr__(name):
+    """
+    Resolves the lazily loaded names of the package on first access.
+    """
+    if name in ['SQL_PARAMS', 'MASTER_CREDS']:
+        from .sqlconfig import load_config
+        master_creds, sql_params = load_config()
+        return sql_params if name == 'SQL_PARAMS' else master_creds
+    if name == 'SQLConn':
+        from .sqlconn import SQLConn
+        return SQLConn
+    if name == 'SQLQueue':
+        from .sqlqueue import SQLQueue
+        return SQLQueue
+    if name == 'AppendBuffer':
+        from .appendbuffer import AppendBuffer
+        return AppendBuffer
+    if name == 'AsyncSQLConn':
+        from .asyncsqlconn import AsyncSQLConn
+        return AsyncSQLConn
+    if name == 'AsyncSQLQueue':
+        from .asyncsqlqueue import AsyncSQLQueue
+        return AsyncSQLQueue
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
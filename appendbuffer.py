@@ -0,0 +1,215 @@
+import threading
+import time
+
+import pandas as pd
+
+
+class AppendBuffer(object):
+    """
+    Collects many small appends to one table in memory and writes them from a background thread as one bulk load, so
+    producers adding a few rows at a time do not each pay for a to_sql insert.
+
+    The buffer is flushed when it holds max_rows rows or max_bytes bytes, when its oldest rows have waited
+    max_latency_ms, on flush() and on close(). append() blocks while the buffer is full and the previous flush is
+    still running. A failed flush drops its rows and its error is raised once, by the next append, flush or close.
+    Should the background thread itself die, appends are refused and flush and close raise instead of waiting for it.
+
+        with AppendBuffer(sql_conn, 'tmp.events', max_latency_ms=500) as buffer:
+            for df in produce():
+                buffer.append(df)
+    """
+
+    DEFAULT_MAX_ROWS = 100000
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    DEFAULT_MAX_LATENCY_MS = 1000
+
+    def __init__(self, sql_conn, table, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                 max_latency_ms=DEFAULT_MAX_LATENCY_MS, **kwargs):
+        """
+        :param sql_conn: The connection to write with
+        :type sql_conn: SQLConn
+        :param table: The table to append to, may include the schema
+        :type table: str
+        :param max_rows: Rows held before the buffer is flushed
+        :type max_rows: int
+        :param max_bytes: Bytes held before the buffer is flushed
+        :type max_bytes: int
+        :param max_latency_ms: Longest time rows are held before they are flushed
+        :type max_latency_ms: float
+        :param kwargs: Key word arguments passed on to SQLConn.append_to_table, e.g. schema or constants. bulk_copy
+                       defaults to SQLConn.BULK_FORCE.
+        :type kwargs: dictionary
+        """
+        self.sql_conn = sql_conn
+        self.table = table
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency_ms / 1000
+        self.append_kwargs = dict(kwargs)
+        self.append_kwargs.setdefault('bulk_copy', sql_conn.BULK_FORCE)
+
+        self._condition = threading.Condition()
+        self._frames = []
+        self._rows = 0
+        self._bytes = 0
+        self._oldest = None
+        self._flushing = False
+        self._flush_requested = False
+        self._closed = False
+        self._stopped = False
+        self._error = None
+        self._stats = {'appends': 0, 'flushes': 0, 'rows': 0, 'failed_flushes': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, df):
+        """
+        Adds the rows to the buffer, waiting while it is full.
+
+        :param df: The rows to append, the dataframe must not be changed afterwards
+        :type df: pd.DataFrame or pd.Series
+        """
+        if type(df) == pd.Series:
+            df = pd.DataFrame(df).transpose()
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._condition:
+            self._raise_error()
+            if self._closed:
+                raise RuntimeError(f'We cannot append to the closed buffer of {self.table}')
+            self._raise_stopped()
+            # An empty buffer takes any dataframe, however large, so a big one cannot wait forever
+            while self._frames and (self._rows + len(df) > self.max_rows or self._bytes + size > self.max_bytes):
+                self._flush_requested = True
+                self._condition.notify_all()
+                self._condition.wait()
+                self._raise_error()
+                self._raise_stopped()
+            self._frames.append(df)
+            self._rows += len(df)
+            self._bytes += size
+            self._stats['appends'] += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._condition.notify_all()
+
+    def flush(self):
+        """
+        Writes everything appended so far and waits until it is written.
+        """
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while (self._frames or self._flushing) and not self._stopped:
+                self._condition.wait()
+            self._raise_error()
+            self._raise_stopped()
+
+    def close(self):
+        """
+        Flushes the buffer and stops the background thread. Appends are refused afterwards.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        with self._condition:
+            self._raise_error()
+            self._raise_stopped()
+
+    def stats(self):
+        """
+        :return: Returns the number of appends, flushes, rows written and failed flushes, and the rows held
+        :rtype: dict
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['buffered_rows'] = self._rows
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _raise_error(self):
+        """
+        Raises the error of a failed flush once. Called with the condition held.
+        """
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _raise_stopped(self):
+        """
+        Raises if the background thread died with rows still buffered. Called with the condition held.
+        """
+        if self._stopped and (self._frames or not self._closed):
+            raise RuntimeError(f'The background thread of the buffer of {self.table} stopped, '
+                               f'{self._rows} rows were not written')
+
+    def _due(self):
+        """
+        :return: Returns True if the buffer should be flushed now. Called with the condition held.
+        :rtype: bool
+        """
+        if not self._frames:
+            return False
+        return (self._closed or self._flush_requested or self._rows >= self.max_rows or self._bytes >= self.max_bytes
+                or time.monotonic() - self._oldest >= self.max_latency)
+
+    def _run(self):
+        """
+        The background thread, takes everything buffered whenever a flush is due and writes it. However it ends, we
+        mark it stopped and wake every waiting caller, so none of them waits on a thread that is gone.
+        """
+        try:
+            self._write_loop()
+        except BaseException as error:
+            with self._condition:
+                self._error = self._error or error
+        finally:
+            with self._condition:
+                self._stopped = True
+                self._flushing = False
+                self._condition.notify_all()
+
+    def _write_loop(self):
+        """
+        Waits until a flush is due and writes, until the buffer is closed and empty.
+        """
+        while True:
+            with self._condition:
+                while not self._due():
+                    if self._closed:
+                        return
+                    if not self._frames:
+                        self._flush_requested = False
+                    timeout = None if self._oldest is None else self._oldest + self.max_latency - time.monotonic()
+                    self._condition.wait(timeout)
+                frames, rows = self._frames, self._rows
+                self._frames, self._rows, self._bytes, self._oldest = [], 0, 0, None
+                self._flushing = True
+                # Appends waiting on a full buffer can go on while we write
+                self._condition.notify_all()
+
+            error = None
+            try:
+                self.sql_conn.append_to_table(table_name=self.table,
+                                              data_to_append=pd.concat(frames, ignore_index=True, sort=False),
+                                              **self.append_kwargs)
+            except BaseException as flush_error:
+                error = flush_error
+
+            with self._condition:
+                self._flushing = False
+                self._stats['flushes'] += 1
+                if error is None:
+                    self._stats['rows'] += rows
+                else:
+                    self._stats['failed_flushes'] += 1
+                    # We keep the first error until a caller sees it
+                    self._error = self._error or error
+                if not self._frames:
+                    self._flush_requested = False
+                self._condition.notify_all()
@@ -0,0 +1,241 @@
+import asyncio
+import functools
+
+import pandas as pd
+import sqlalchemy
+
+from sqlconn.sqlconn import SQLConn
+from sqlconn.sqlparams import SQLParams
+from sqlconn.retrypolicy import RetryPolicy
+
+
+class AsyncSQLConn(object):
+    """
+    The asyncio counterpart of SQLConn. Postgres and SQLite run on SQLAlchemy's async engine with asyncpg and aiosqlite,
+    so awaiting a call never blocks the event loop and one process can keep many queries in flight. SQL types without
+    an async driver (SQL Server, Snowflake) run the SQLConn methods in the loop's default executor instead.
+
+    The async engine belongs to the event loop it was first used on, so create one object per loop (e.g. at service
+    start up) and share it between tasks. Requires SQLAlchemy 1.4 or later.
+    """
+
+    # SQLAlchemy drivers for the SQL types that have an asyncio driver.
+    ASYNC_DRIVERS = {SQLConn.POSTGRES: 'postgresql+asyncpg',
+                     SQLConn.SQLITE: 'sqlite+aiosqlite'}
+
+    def __init__(self, _sql_params, retry_policy=None):
+        """
+        :param _sql_params: An SQLParams object that contains the necessary information to connect to any of our
+                            database types.
+        :param retry_policy: Decides which failed calls are retried. Defaults to the policy shared by the database
+                             target.
+        :type retry_policy: RetryPolicy
+        """
+        self.sql_params = _sql_params
+        self.sql_bridge = SQLConn.bridge_class(self.sql_params.type)(sql_conn=self)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy.for_params(self.sql_params)
+        self.async_engine = self._create_async_engine() if self.is_native() else None
+        self._sql_conn = None
+
+    @classmethod
+    def get_connection(cls, sql_nickname):
+        """
+        The preferred method of obtaining an async SQL connection.
+
+        :param sql_nickname: A nickname representing sql parameters for a connection.
+        :return: Returns an AsyncSQLConn object.
+        """
+        return cls(SQLParams.from_json(sql_nickname=sql_nickname))
+
+    @classmethod
+    def change_database(cls, sql_nickname, database_name):
+        """
+        Gets the SQL parameters for the provided nickname, but connects to the database passed.
+
+        :param sql_nickname: A nickname representing SQL parameters for a connection.
+        :type sql_nickname: str
+        :param database_name: Database name that replaces default databse name.
+        :type database_name: str
+        :return: An AsyncSQLConn object
+        :rtype: AsyncSQLConn
+        """
+        params = SQLParams.from_json(sql_nickname=sql_nickname)
+        params.database = database_name
+        params.diff_database = True
+        return cls(params)
+
+    def is_native(self):
+        """
+        :return: Returns True if calls run on an asyncio driver, False if they run in the executor
+        :rtype: bool
+        """
+        return self.sql_params.type in self.ASYNC_DRIVERS
+
+    @property
+    def sql_conn(self):
+        """
+        The synchronous SQLConn used for the SQL types without an asyncio driver. Created on first use.
+
+        :rtype: SQLConn
+        """
+        if self._sql_conn is None:
+            self._sql_conn = SQLConn(self.sql_params, retry_policy=self.retry_policy)
+        return self._sql_conn
+
+    def _create_async_engine(self):
+        """
+        :return: Returns the async engine, with the pool and session settings of the nickname applied
+        :rtype: sqlalchemy AsyncEngine
+        """
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        driver = self.ASYNC_DRIVERS[self.sql_params.type]
+        pool_kwargs = self.sql_bridge.pool_kwargs(self.sql_params.options.get('pool', {}))
+        session = self.sql_params.options.get('session', {})
+        if self.sql_params.type == SQLConn.SQLITE:
+            engine = create_async_engine(f'{driver}:///{self.sql_params.database}', **pool_kwargs)
+        else:
+            engine = create_async_engine(f'{driver}://{self.sql_params.username}:{self.sql_params.password}@'
+                                         f'{self.sql_params.host}:{self.sql_params.port}/{self.sql_params.database}',
+                                         connect_args={'server_settings': {key: str(value)
+                                                                           for key, value in session.items()}},
+                                         **pool_kwargs)
+            session = {}
+
+        statements = self.sql_bridge.session_statements(session)
+        if statements:
+            @sqlalchemy.event.listens_for(engine.sync_engine, 'connect')
+            def apply_session(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.close()
+        return engine
+
+    async def _run(self, operation):
+        """
+        Runs the coroutine function on a pooled async connection, retrying according to the retry policy.
+
+        :param operation: Coroutine function taking a sqlalchemy AsyncConnection
+        :type operation: callable
+        :return: Returns whatever the operation returns
+        """
+        return await self.retry_policy.run_async(self.async_engine, operation, self.sql_bridge.classify_error)
+
+    async def _in_executor(self, function, *args, **kwargs):
+        """
+        Runs a blocking SQLConn call in the loop's default executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    def get_nickname(self):
+        return self.sql_params.get_nickname()
+
+    async def get_dataframe(self, sql, params=None, **kwargs):
+        """
+        Simply execute the provided sql and return a dataframe with the results
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :param params: Values of the bound parameters in the sql, written as :name
+        :type params: dict
+        :return: Returns the results of the sql query as a pandas dataframe
+        """
+        assert 'select'.upper() in sql.upper()
+        if not self.is_native():
+            return await self._in_executor(self.sql_conn.get_dataframe, sql, params=params, **kwargs)
+
+        # The connections of the async engine only execute statement objects, not plain strings
+        statement = sqlalchemy.text(sql)
+
+        async def read(connection):
+            return await connection.run_sync(lambda sync_connection: pd.read_sql(statement, sync_connection,
+                                                                                 params=params, **kwargs))
+        return await self._run(read)
+
+    async def execute_sql(self, sql, params=None):
+        """
+        Simply execute the query
+
+        :param sql: The sql query that needs to be executed
+        :param params: Values of the bound parameters in the sql, written as :name
+        :type params: dict
+        """
+        if not self.is_native():
+            return await self._in_executor(self.sql_conn.execute_sql, sql, params=params)
+
+        async def execute(connection):
+            if params is None:
+                await connection.exec_driver_sql(sql)
+            else:
+                await connection.execute(sqlalchemy.text(sql), params)
+            await connection.commit()
+        await self._run(execute)
+
+    async def append_to_table(self, table_name, data_to_append, if_exists='append', schema=None, **kwargs):
+        """
+        Appends the provided dataframe to the provided sql table name, first removing any columns in the dataframe
+        that are not in the table. For the SQL types without an asyncio driver this is SQLConn.append_to_table,
+        including its bulk copy options.
+
+        :param table_name: The name of the sql table to append the dataframe.
+        :param data_to_append: Either a dataframe or pandas series object.
+        :param if_exists: Provides an option to override the to_sql parameter for how we treat a possible existing table
+        :param schema: Provides option to override the to_sql schema parameter.
+        """
+        if not self.is_native():
+            return await self._in_executor(self.sql_conn.append_to_table, table_name, data_to_append,
+                                           if_exists=if_exists, schema=schema, **kwargs)
+
+        if type(data_to_append) == pd.Series:
+            data_to_append = pd.DataFrame(data_to_append).transpose()
+        table_name, schema_name = self.get_names(table=table_name, schema=schema)
+
+        def append(sync_connection):
+            inspector = sqlalchemy.inspect(sync_connection)
+            sql_columns = [column['name'] for column in inspector.get_columns(table_name, schema=schema_name)] \
+                if inspector.has_table(table_name, schema=schema_name) else []
+            load_df = self.sql_bridge.get_df_interesection(data_to_append, sql_columns) \
+                if sql_columns else data_to_append
+            load_df.to_sql(table_name, sync_connection, if_exists=if_exists, index=False, schema=schema_name,
+                           **kwargs)
+
+        async def load(connection):
+            await connection.run_sync(append)
+            await connection.commit()
+        await self._run(load)
+
+    def get_names(self, table, schema=None):
+        """
+        Parses out the names of our table and our schema, see SQLConn.get_names.
+
+        :param table: Table name. Could include schema could not include schema.
+        :type table: str
+        :param schema: Name of the schema
+        :type schema: str
+        :return: table name, schema name
+        :rtype: str, str
+        """
+        return SQLConn.get_names(self, table=table, schema=schema)
+
+    def retry_stats(self):
+        """
+        :return: Returns the retry counters of the retry policy, see RetryPolicy.stats
+        :rtype: dict
+        """
+        return self.retry_policy.stats()
+
+    async def close(self):
+        """
+        Closes the connections of the async engine and releases the synchronous SQLConn, if one was created.
+        """
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        if self._sql_conn is not None:
+            self._sql_conn.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
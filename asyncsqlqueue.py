@@ -0,0 +1,127 @@
+import socket
+
+import sqlalchemy
+
+from sqlconn.sqlqueue import SQLQueue
+
+
+class AsyncSQLQueue(object):
+    """
+    The asyncio counterpart of the claim, get, finish and get_status calls of SQLQueue. Like SQLQueue it expects the
+    queue table to live in Postgres, and it needs an AsyncSQLConn running on an asyncio driver.
+    """
+
+    def __init__(self, sql_conn, squeue_name):
+        """
+        Use AsyncSQLQueue.open to also check that the squeue exists.
+
+        :param sql_conn: An AsyncSQLConn connection object that will be used to access the queue.
+        :type sql_conn: AsyncSQLConn
+        :param squeue_name: The name squeue (Really the name of the table)
+        :type squeue_name: str
+        """
+        if not sql_conn.is_native():
+            raise TypeError('We do not support {0:s} type for an asyncio SQL queue'.format(sql_conn.sql_params.type))
+        self.sql_conn = sql_conn
+        self.squeue = squeue_name
+
+    @classmethod
+    async def open(cls, sql_conn, squeue_name):
+        """
+        Creates the queue object after making sure the squeue exists.
+
+        :param sql_conn: An AsyncSQLConn connection object that will be used to access the queue.
+        :type sql_conn: AsyncSQLConn
+        :param squeue_name: The name squeue (Really the name of the table)
+        :type squeue_name: str
+        :return: Returns the queue
+        :rtype: AsyncSQLQueue
+        """
+        squeue = cls(sql_conn, squeue_name)
+        try:
+            await sql_conn.execute_sql('SELECT sq_priority, sq_status, sq_id FROM {0:s} LIMIT 1'.format(squeue_name))
+        except:
+            raise RuntimeError('Trouble selecting from {0:s}'.format(squeue_name))
+        return squeue
+
+    async def claim(self, conditional_claim=None, join_text=''):
+        """
+        Claims the next highest priority available row. The select and the update run in one transaction so the
+        row lock taken by FOR UPDATE holds until the row is marked as claimed.
+
+        :return: Returns the squeue ID for the row, -1 if nothing is available.
+        """
+        if not conditional_claim:
+            conditional_claim = ''
+        else:
+            conditional_claim = 'and ' + conditional_claim
+        sql_select = sqlalchemy.text(f"""SELECT {SQLQueue.SQ_ID} FROM {self.squeue}
+                                         {join_text}
+                                         WHERE {SQLQueue.SQ_STATUS} = :status {conditional_claim}
+                                         ORDER BY {SQLQueue.SQ_PRIORITY} DESC, {SQLQueue.SQ_ID} ASC
+                                         LIMIT 1 FOR UPDATE OF {self.squeue}""")
+        sql_update = sqlalchemy.text(f"""UPDATE {self.squeue} SET {SQLQueue.SQ_STATUS} = :status,
+                                                                  {SQLQueue.SQ_CLAIM_TIME} = now(),
+                                                                  {SQLQueue.SQ_CLAIM_HOSTNAME} = :hostname
+                                         WHERE {SQLQueue.SQ_ID} = :sq_id""")
+
+        async def claim_row(connection):
+            async with connection.begin():
+                row = (await connection.execute(sql_select, {'status': SQLQueue.STATUS_AVAILABLE})).first()
+                if row is None:
+                    return -1
+                await connection.execute(sql_update, {'status': SQLQueue.STATUS_CLAIMED,
+                                                      'hostname': socket.gethostname(),
+                                                      'sq_id': row[0]})
+                return row[0]
+        return await self.sql_conn._run(claim_row)
+
+    async def get(self, row_id, join_text=''):
+        """
+        Returns the row that needs work.
+
+        :param row_id: The squeue ID that was returned from the claim function.
+        :return: Returns the corresponding dataframe row.
+        """
+        sql_update = sqlalchemy.text(f"""UPDATE {self.squeue} SET {SQLQueue.SQ_GET_TIME} = now(),
+                                                                  {SQLQueue.SQ_STATUS} = :status,
+                                                                  {SQLQueue.SQ_GET_HOSTNAME} = :hostname
+                                         WHERE {SQLQueue.SQ_ID} = :sq_id""")
+
+        async def mark_in_progress(connection):
+            await connection.execute(sql_update, {'status': SQLQueue.STATUS_PROGRESS,
+                                                  'hostname': socket.gethostname(),
+                                                  'sq_id': int(row_id)})
+            await connection.commit()
+        await self.sql_conn._run(mark_in_progress)
+        sql_select = f"""SELECT * FROM {self.squeue} {join_text} WHERE {SQLQueue.SQ_ID} = :sq_id"""
+        return await self.sql_conn.get_dataframe(sql_select, params={'sq_id': int(row_id)})
+
+    async def finish(self, row_id, finish_status=SQLQueue.STATUS_COMPLETED):
+        """
+        Sets the status to complete to let the queue know the work has been completed.
+
+        :param row_id: The squeue ID that was returned from the claim function
+        :param finish_status: Whether the row from the queue finished without exception or not.
+        """
+        sql_update = sqlalchemy.text(f"""UPDATE {self.squeue} SET {SQLQueue.SQ_FINISH_TIME} = now(),
+                                                                  {SQLQueue.SQ_STATUS} = :status
+                                         WHERE {SQLQueue.SQ_ID} = :sq_id""")
+
+        async def mark_finished(connection):
+            await connection.execute(sql_update, {'status': finish_status, 'sq_id': int(row_id)})
+            await connection.commit()
+        await self.sql_conn._run(mark_finished)
+
+    async def get_status(self, row_id):
+        """
+        :param row_id: The squeue ID that was returned from the claim function
+        :return: Returns the status corresponding to the row ID.
+        """
+        sql_select = sqlalchemy.text(f"""SELECT {SQLQueue.SQ_STATUS} FROM {self.squeue}
+                                         WHERE {SQLQueue.SQ_ID} = :sq_id""")
+
+        async def read_status(connection):
+            return (await connection.execute(sql_select, {'sq_id': int(row_id)})).scalar()
+        status = await self.sql_conn._run(read_status)
+        return status if status is not None else SQLQueue.STATUS_NOEXIST
@@ -1,9 +1,11 @@
-import os
-from subprocess import call
 from abc import abstractmethod
-from pathlib import Path
+from contextlib import contextmanager
+
+import pandas as pd
 
 from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.dataframesource import DataFrameSource
+from sqlconn.retrypolicy import RetryPolicy
 
 
 class BaseMsSQLBridge(BaseSQLBridge):
@@ -32,6 +34,63 @@ class BaseMsSQLBridge(BaseSQLBridge):
         """
         pass
 
+    @contextmanager
+    def transaction(self, connection):
+        """
+        Our SQL Server connections run in autocommit mode, where the driver ignores commit and rollback, so we open
+        and close the transaction on the server ourselves. See BaseSQLBridge.transaction.
+        """
+        connection.execute('BEGIN TRANSACTION')
+        try:
+            yield
+        except BaseException:
+            connection.execute('IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION')
+            raise
+        connection.execute('COMMIT TRANSACTION')
+
+    def hash_predicate(self, column, num_partitions, partition):
+        """
+        Partitions on CHECKSUM, so any column type works. See BaseSQLBridge.hash_predicate.
+        """
+        predicate = f'ABS(CAST(CHECKSUM({column}) AS BIGINT)) % {num_partitions:d} = {partition:d}'
+        return f'({predicate} OR {column} IS NULL)' if partition == 0 else predicate
+
+    # pytds type ids of tinyint, smallint, int, bigint and nullable int
+    INTEGER_TYPE_IDS = [48, 52, 56, 127, 38]
+
+    def integer_columns(self, description):
+        """
+        See BaseSQLBridge.integer_columns, the type codes are pytds type ids.
+        """
+        return [column[0] for column in description if column[1] in self.INTEGER_TYPE_IDS]
+
+    # SQL Server error numbers we retry: 1205 is the deadlock victim, the others are lost or refused connections
+    # and Azure SQL failovers.
+    DEADLOCK_NUMBERS = [1205]
+    TRANSIENT_NUMBERS = [64, 233, 4060, 10053, 10054, 10060, 40197, 40501, 40613, 49918, 49919, 49920]
+
+    def classify_driver_error(self, error):
+        """
+        Classifies pytds errors by the SQL Server error number.
+
+        :param error: The exception raised by the driver
+        :type error: Exception
+        :return: Returns RetryPolicy.TRANSIENT, RetryPolicy.DEADLOCK or RetryPolicy.PERMANENT
+        :rtype: str
+        """
+        number = getattr(error, 'msg_no', getattr(error, 'number', None))
+        if number in self.DEADLOCK_NUMBERS:
+            return RetryPolicy.DEADLOCK
+        if number in self.TRANSIENT_NUMBERS or type(error).__name__ == 'ClosedConnectionError':
+            return RetryPolicy.TRANSIENT
+        return super(BaseMsSQLBridge, self).classify_driver_error(error)
+
+    def upsert_sql(self, table_name, schema_name, staging_name, columns, key_columns):
+        """
+        SQL Server has no ON CONFLICT, we MERGE instead. See BaseSQLBridge.upsert_sql.
+        """
+        return self.merge_sql(table_name, schema_name, staging_name, columns, key_columns)
+
     @staticmethod
     def default_schema():
         """
@@ -40,12 +99,26 @@ class BaseMsSQLBridge(BaseSQLBridge):
         """
         return 'dbo'
 
+    def session_statements(self, session):
+        """
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns the T-SQL SET statements run on every new connection, e.g. SET LOCK_TIMEOUT 5000
+        :rtype: list
+        """
+        return [f'SET {key} {value}' for key, value in session.items()]
+
+    # Rows sent per INSERT BULK batch of a bulk load
+    BULK_LOAD_BATCH_ROWS = 50000
+
     def bulk_load(self, bulk_df, table_name, schema_name, table_state=BaseSQLBridge.TABLE_STATE_UNKNOWN, if_exists='append', **kwargs):
         """
-        Perform a bulk copy into the table.
+        Perform a bulk copy into the table. The rows are streamed over a pooled pytds connection with its bulk copy
+        (INSERT BULK), one batch at a time, all in one transaction. Nothing is written to disk and a failed batch
+        raises and rolls the load back.
 
-        :param bulk_df: Dataframe values to copy into the table
-        :type bulk_df: pd.DataFrame
+        :param bulk_df: Dataframe values to copy into the table, an iterator of dataframes or a DataFrameSource
+        :type bulk_df: pd.DataFrame or iterable or DataFrameSource
         :param table_name: Name of the table
         :type table_name: str
         :param schema_name: Name of the schema
@@ -54,81 +127,56 @@ class BaseMsSQLBridge(BaseSQLBridge):
         :type table_state: int
         :param if_exists: Follows the pandas SQL functions if exists
         :type if_exists: str
-        :param kwargs: Key word arguments if needed for the bulk load
+        :param kwargs: Key word arguments if needed for the bulk load, batch_rows sets the rows sent per batch
         :type kwargs: dictionary
         """
-        if os.name != 'nt':
-            full_script_name = Path(kwargs['tmp_dir'], table_name + '_loader_script.sh')
-            full_csv_name = Path(kwargs['tmp_dir'], table_name + '.csv')
-            self.file_cleanup(full_csv_name=full_csv_name,
-                              full_script_name=full_script_name)
-            self._determine_table(bulk_df=bulk_df,
-                                  table_name=table_name,
-                                  schema_name=schema_name,
-                                  table_state=table_state,
-                                  if_exists=if_exists)
-            self.save_to_csv(bulk_df=bulk_df,
-                             full_csv_name=full_csv_name)
-            self._push_to_table(table_name=table_name,
-                                schema_name=schema_name,
-                                full_csv_name=full_csv_name,
-                                full_script_name=full_script_name)
-            self.file_cleanup(full_csv_name=full_csv_name,
-                              full_script_name=full_script_name)
-        else:
-            raise RuntimeError('We cannot do SQL Server bulk load on Windows systems')
-
-    def _push_to_table(self, table_name, schema_name, full_csv_name, full_script_name):
-        """
-        Creates the shell script that moves the CSV file contents into the database table
-
-        :param table_name: Name of the table
-        :type table_name: str
-        :param schema_name: Name of the schema
-        :type schema_name: str
-        :param full_csv_name: Full path name to the CSV
-        :type full_csv_name: Path
-        :param full_script_name: The full path the shell script
-        :type full_script_name: Path
-        """
-        bcp_load_string = "{0} {1}.{2} in '{3}' -U SONIC.COM\\\{4} " \
-                          "-P {5} -S '{6}' -c -b 50000".format('freebcp',
-                                                               self.sql_connection.sql_params.database,
-                                                               schema_name + '.' + table_name,
-                                                               full_csv_name,
-                                                               self.sql_connection.sql_params.username.split('\\')[-1],
-                                                               self.sql_connection.sql_params.password,
-                                                               self.sql_connection.sql_params.host)
-        with open(full_script_name, 'w') as f:
-            f.write('#!/bin/bash\n')
-            f.write('export TDSVER=7.2\n')
-            f.write('export TDSPORT={0}\n'.format(self.sql_connection.sql_params.port))
-            f.write(bcp_load_string)
-        self.make_executable(full_script_name)
-        call(['sh', full_script_name])
+        source = DataFrameSource.wrap(bulk_df)
+        first_df = source.schema_frame()
+        if first_df is None:
+            return
+        batch_rows = kwargs.get('batch_rows', self.BULK_LOAD_BATCH_ROWS)
+
+        self._determine_table(bulk_df=first_df,
+                              table_name=table_name,
+                              schema_name=schema_name,
+                              table_state=table_state,
+                              if_exists=if_exists)
+
+        columns = list(first_df.columns)
+        with self.sql_connection.get_engine().connect() as connection:
+            with self.transaction(connection):
+                cursor = connection.connection.cursor()
+                try:
+                    for chunk_df in source.iter_chunks(batch_rows):
+                        # keep_nulls loads NULL instead of the column defaults
+                        cursor.copy_to(table_or_view=table_name, schema=schema_name, columns=columns,
+                                       data=self._rows(chunk_df[columns]), keep_nulls=True)
+                finally:
+                    cursor.close()
 
     @staticmethod
-    def make_executable(file_name):
-        """
-        Used on unix systems for giving permissions so the script can actually be run
-
-        :param file_name: Name of the file that needs the permissions.
-        :type file_name: Path
-        """
-        st = os.stat(file_name).st_mode
-        st |= (st & 0o444) >> 2
-        os.chmod(file_name, st)
-
-    def file_cleanup(self, full_csv_name, full_script_name):
+    def _rows(chunk_df):
         """
-        Removes the csv file from the file system and removes the file from the user's staging area
+        pytds sends the values of a bulk copy as text when only the column names are given, like freebcp's character
+        mode, and the server converts them to the column types.
 
-        :param full_csv_name: Full path name to the CSV
-        :type full_csv_name: Path
-        :param full_script_name: Full path name to the CSV
-        :type full_script_name: Path
+        :param chunk_df: One batch of the load
+        :type chunk_df: pd.DataFrame
+        :return: Returns the rows as tuples of strings, None for nulls
+        :rtype: list
         """
-        if os.path.exists(full_csv_name):
-            os.remove(full_csv_name)
-        if os.path.exists(full_script_name):
-            os.remove(full_script_name)
+        columns = []
+        for _, series in chunk_df.items():
+            nulls = series.isna().to_numpy()
+            if pd.api.types.is_datetime64_any_dtype(series.dtype):
+                if getattr(series.dt, 'tz', None) is not None:
+                    series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+                # datetime columns only take milliseconds, datetime2 takes either
+                values = series.dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
+            else:
+                values = series.astype(str)
+            values = values.to_numpy(dtype=object)
+            if nulls.any():
+                values[nulls] = None
+            columns.append(values)
+        return list(zip(*columns))
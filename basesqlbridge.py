@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
 import pandas as pd
+import sqlalchemy
+import socket
+import threading
 import os
 
+from sqlconn.retrypolicy import RetryPolicy
+from sqlconn.dataframesource import DataFrameSource
+
 
 class BaseSQLBridge(ABC):
     """
@@ -14,6 +20,16 @@ class BaseSQLBridge(ABC):
     TABLE_STATE_EXISTS = 1
     TABLE_STATE_NO_EXISTS = 2
 
+    # Whether several bulk_load calls may append to the same table at once, see SQLConn.append_to_table parallelism
+    SUPPORTS_PARALLEL_LOAD = True
+
+    # Maps the keys of the connconfig.json pool block to the SQLAlchemy create_engine arguments.
+    POOL_ARGUMENTS = {'pool_size': 'pool_size',
+                      'max_overflow': 'max_overflow',
+                      'pre_ping': 'pool_pre_ping',
+                      'recycle': 'pool_recycle',
+                      'timeout': 'pool_timeout'}
+
     def __init__(self, sql_conn):
         """
         Save off any parameters passed to the function
@@ -22,6 +38,7 @@ class BaseSQLBridge(ABC):
         :type sql_conn: SQLConn
         """
         self.sql_connection = sql_conn
+        self._ddl_lock = threading.Lock()
 
     @abstractmethod
     def get_engine(self, sql_params):
@@ -35,6 +52,174 @@ class BaseSQLBridge(ABC):
         """
         pass
 
+    def _build_engine(self, url, sql_params, connect_args=None):
+        """
+        Creates the engine for the url, applying the pool and session settings of the SQL parameters.
+
+        :param url: SQLAlchemy database url
+        :type url: str
+        :param sql_params: Parameters needed to create the engine
+        :type sql_params: SQLParams
+        :param connect_args: Driver specific connection arguments
+        :type connect_args: dict
+        :return: Returns the engine
+        :rtype: sqlalchemy engine
+        """
+        session = sql_params.options.get('session', {})
+        connect_args = dict(connect_args) if connect_args else {}
+        connect_args.update(self.session_connect_args(session))
+        engine = sqlalchemy.create_engine(url,
+                                          connect_args=connect_args,
+                                          **self.pool_kwargs(sql_params.options.get('pool', {})))
+
+        statements = self.session_statements(session)
+        if statements:
+            @sqlalchemy.event.listens_for(engine, 'connect')
+            def apply_session(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.close()
+        return engine
+
+    def pool_kwargs(self, pool):
+        """
+        :param pool: The pool block from connconfig.json
+        :type pool: dict
+        :return: Returns the create_engine keyword arguments for the pool settings
+        :rtype: dict
+        """
+        return {self.POOL_ARGUMENTS[key]: value for key, value in pool.items() if key in self.POOL_ARGUMENTS}
+
+    def session_connect_args(self, session):
+        """
+        Session settings the driver can take as connection arguments, saving a round trip on every new connection.
+
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns the connection arguments for the session settings
+        :rtype: dict
+        """
+        return {}
+
+    def session_statements(self, session):
+        """
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns the statements run on every new connection to apply the session settings
+        :rtype: list
+        """
+        return [f'SET {key} = {value}' for key, value in session.items()]
+
+    def stream_options(self, chunk_rows):
+        """
+        :param chunk_rows: Number of rows the caller fetches at a time
+        :type chunk_rows: int
+        :return: Returns the execution options that make the driver stream a result instead of buffering all of it
+        :rtype: dict
+        """
+        return {'stream_results': True}
+
+    def integer_columns(self, description):
+        """
+        :param description: DBAPI cursor description of a query
+        :type description: list
+        :return: Returns the names of the columns the database types as integers. Empty when the driver does not say,
+                 e.g. sqlite3 leaves the type codes out.
+        :rtype: list
+        """
+        return []
+
+    def bind_statement(self, connection, sql, params, prepared=True):
+        """
+        Turns sql with :name bound parameters into a statement that can be executed on the connection. Bridges with
+        prepared statements override this to reuse the server side plan.
+
+        :param connection: The connection the statement will run on
+        :type connection: sqlalchemy connection
+        :param sql: The sql, with bound parameters written as :name
+        :type sql: str
+        :param params: Values of the bound parameters by name
+        :type params: dict
+        :param prepared: Whether a prepared statement may be used. Server-side cursors cannot run one.
+        :type prepared: bool
+        :return: Returns the statement and the parameters to execute it with
+        :rtype: sqlalchemy TextClause, dict
+        """
+        return sqlalchemy.text(sql), params
+
+    def transaction(self, connection):
+        """
+        :param connection: The connection the statements will run on
+        :type connection: sqlalchemy connection
+        :return: Returns a context manager that commits the statements run on the connection inside it together, or
+                 rolls them all back if one fails
+        """
+        return connection.begin()
+
+    def execute_many(self, connection, sql, param_rows):
+        """
+        Runs one statement for many sets of bound parameters with the driver's executemany.
+
+        :param connection: The connection the statement will run on, inside a transaction
+        :type connection: sqlalchemy connection
+        :param sql: The sql, with bound parameters written as :name
+        :type sql: str
+        :param param_rows: Values of the bound parameters by name, one dictionary per execution
+        :type param_rows: list
+        """
+        connection.execute(sqlalchemy.text(sql), param_rows)
+
+    def hash_predicate(self, column, num_partitions, partition):
+        """
+        Used by SQLConn.get_dataframe_partitioned to split a query on a hash of the column. Every row must fall in
+        exactly one partition, rows where the column is null go to the first.
+
+        :param column: The column or expression to partition on
+        :type column: str
+        :param num_partitions: Number of partitions
+        :type num_partitions: int
+        :param partition: The partition, from 0 to num_partitions - 1
+        :type partition: int
+        :return: Returns the where clause selecting the rows of the partition
+        :rtype: str
+        """
+        # We have no portable hash function, so here the column must be an integer.
+        predicate = f'MOD(ABS({column}), {num_partitions:d}) = {partition:d}'
+        return f'({predicate} OR {column} IS NULL)' if partition == 0 else predicate
+
+    def classify_error(self, error):
+        """
+        Sorts an exception raised while talking to the database into the categories of the RetryPolicy.
+
+        :param error: The exception that was raised
+        :type error: Exception
+        :return: Returns RetryPolicy.TRANSIENT, RetryPolicy.DEADLOCK or RetryPolicy.PERMANENT
+        :rtype: str
+        """
+        if isinstance(error, sqlalchemy.exc.DBAPIError):
+            if error.connection_invalidated:
+                return RetryPolicy.TRANSIENT
+            return self.classify_driver_error(error.orig)
+        if isinstance(error, (sqlalchemy.exc.DisconnectionError, sqlalchemy.exc.TimeoutError)):
+            # A broken connection found on checkout, or no connection free in the pool in time
+            return RetryPolicy.TRANSIENT
+        return self.classify_driver_error(error)
+
+    def classify_driver_error(self, error):
+        """
+        Classifies the exception raised by the database driver. Bridges override this with the error codes of their
+        server.
+
+        :param error: The exception raised by the driver
+        :type error: Exception
+        :return: Returns RetryPolicy.TRANSIENT, RetryPolicy.DEADLOCK or RetryPolicy.PERMANENT
+        :rtype: str
+        """
+        if isinstance(error, (ConnectionError, socket.timeout)):
+            return RetryPolicy.TRANSIENT
+        return RetryPolicy.PERMANENT
+
     @staticmethod
     @abstractmethod
     def default_schema():
@@ -55,11 +240,28 @@ class BaseSQLBridge(ABC):
         :return: Returns a list of the columns. If empty list then the table does not exist.
         :rtype: list
         """
-        columns_df = self.sql_connection.get_dataframe(self.columns_sql(table_name, schema_name))
-        if len(columns_df) > 0:
-            return list(columns_df['column_name'])
-        else:
-            return []
+        return [column_name for column_name, data_type in self.get_column_types(table_name, schema_name)]
+
+    def get_column_types(self, table_name, schema_name):
+        """
+        Returns the columns of the table and their types as the catalog names them. Served from the metadata cache of
+        the connection when the table was looked up recently.
+
+        :param table_name: Name of the table
+        :type table_name: str
+        :param schema_name: Name of the schema
+        :type schema_name: str
+        :return: Returns a list of (column name, data type). If empty list then the table does not exist.
+        :rtype: list
+        """
+        table_name, schema_name = self.alter_names(table_name, schema_name)
+
+        def read():
+            columns_df = self.sql_connection.get_dataframe(self.column_types_sql(), cache_ttl=0,
+                                                           params={'table_name': table_name,
+                                                                   'schema_name': schema_name})
+            return list(zip(columns_df['column_name'], columns_df['data_type']))
+        return self.sql_connection.metadata_cache.get_or_read(table_name, schema_name, read)
 
     @classmethod
     def columns_sql(cls, table_name, schema_name):
@@ -77,6 +279,19 @@ class BaseSQLBridge(ABC):
                     WHERE table_name = '{table_name}'
                     AND   table_schema = '{schema_name}'"""
 
+    @classmethod
+    def column_types_sql(cls):
+        """
+        :return: Returns the SQL for retrieving the column names and types, with the table_name and schema_name bound
+                 parameters
+        :rtype: str
+        """
+        return """SELECT column_name, data_type 
+                  FROM information_schema.columns 
+                  WHERE table_name = :table_name
+                  AND   table_schema = :schema_name
+                  ORDER BY ordinal_position"""
+
     @classmethod
     def alter_names(cls, table_name, schema_name):
         """
@@ -89,9 +304,34 @@ class BaseSQLBridge(ABC):
         """
         return table_name, schema_name
 
+    def bulk_read(self, sql):
+        """
+        Reads the results of a query using the fastest path the SQL type offers. Without a dedicated path this is a
+        regular read.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :return: Returns the results of the sql query
+        :rtype: pd.DataFrame
+        """
+        return self.sql_connection.get_dataframe(sql)
+
+    def bulk_read_arrow(self, sql):
+        """
+        Reads the results of a query into a pyarrow Table with a columnar path of the SQL type, without building
+        Python objects per row.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :return: Returns the results of the sql query, None if the SQL type has no columnar path
+        :rtype: pyarrow.Table
+        """
+        return None
+
     def get_df_interesection(self, df, sql_columns):
         """
-        We need to remove any columns that are in the df but not in the sql_columns
+        We need to remove any columns that are in the df but not in the sql_columns. The df is not changed, and is
+        returned as is when every column is in the table.
 
         :param df: Dataframe to remove from
         :type df: pd.DataFrame
@@ -100,9 +340,60 @@ class BaseSQLBridge(ABC):
         :return: Return the dataframe with columns removed.
         :rtype: pd.DataFrame
         """
-        df_columns = list(df.columns)
-        bad_columns = list(set(df_columns).difference(set(sql_columns)))
-        return df.drop(bad_columns, axis=1)
+        columns = self.intersect_columns(list(df.columns), sql_columns)
+        return df if len(columns) == len(df.columns) else df[columns]
+
+    def intersect_columns(self, df_columns, sql_columns):
+        """
+        :param df_columns: Columns of the dataframe
+        :type df_columns: list
+        :param sql_columns: List of columns from the sql database that we are adding the df to.
+        :type sql_columns: list
+        :return: Returns the dataframe columns that are in the table, in the order of the dataframe
+        :rtype: list
+        """
+        sql_columns = set(sql_columns)
+        return [column for column in df_columns if column in sql_columns]
+
+    def upsert_sql(self, table_name, schema_name, staging_name, columns, key_columns):
+        """
+        Builds the one statement that moves the rows of a staging table into the table, updating the rows whose key
+        is already there and inserting the others. Postgres and SQLite use INSERT ... ON CONFLICT, which needs a
+        primary key or unique index on exactly the key columns.
+
+        :param table_name: Name of the table
+        :type table_name: str
+        :param schema_name: Name of the schema of both tables
+        :type schema_name: str
+        :param staging_name: Name of the staging table holding the rows
+        :type staging_name: str
+        :param columns: The columns of the staging table, in the table
+        :type columns: list
+        :param key_columns: The columns identifying a row
+        :type key_columns: list
+        :return: Returns the upsert statement
+        :rtype: str
+        """
+        updates = [f'{column} = excluded.{column}' for column in columns if column not in key_columns]
+        action = 'DO UPDATE SET ' + ', '.join(updates) if updates else 'DO NOTHING'
+        # SQLite needs the WHERE to tell the ON CONFLICT of the upsert from a join constraint
+        return f"""INSERT INTO {schema_name}.{table_name} ({', '.join(columns)})
+                   SELECT {', '.join(columns)} FROM {schema_name}.{staging_name} WHERE 1 = 1
+                   ON CONFLICT ({', '.join(key_columns)}) {action}"""
+
+    @staticmethod
+    def merge_sql(table_name, schema_name, staging_name, columns, key_columns):
+        """
+        The MERGE form of upsert_sql, for the databases without ON CONFLICT. See upsert_sql.
+        """
+        matches = ' AND '.join(f'target.{column} = staging.{column}' for column in key_columns)
+        updates = [f'{column} = staging.{column}' for column in columns if column not in key_columns]
+        update = 'WHEN MATCHED THEN UPDATE SET ' + ', '.join(updates) if updates else ''
+        return f"""MERGE INTO {schema_name}.{table_name} AS target
+                   USING {schema_name}.{staging_name} AS staging ON {matches}
+                   {update}
+                   WHEN NOT MATCHED THEN INSERT ({', '.join(columns)})
+                   VALUES ({', '.join('staging.' + column for column in columns)});"""
 
     @abstractmethod
     def bulk_load(self, bulk_df, table_name, schema_name, table_exists=TABLE_STATE_UNKNOWN, if_exists='append', **kwargs):
@@ -147,36 +438,44 @@ class BaseSQLBridge(ABC):
 
         assert if_exists in ['replace', 'append'], 'We only support replace and append values for if_exists!'
 
-        if table_state == BaseSQLBridge.TABLE_STATE_UNKNOWN:
-            if self.get_columns(table_name, schema_name):
-                table_state = BaseSQLBridge.TABLE_STATE_EXISTS
-            else:
-                table_state = BaseSQLBridge.TABLE_STATE_NO_EXISTS
+        # Threads sharing the connection must not interleave checking, dropping and creating the table
+        with self._ddl_lock:
+            if table_state == BaseSQLBridge.TABLE_STATE_UNKNOWN:
+                if self.get_columns(table_name, schema_name):
+                    table_state = BaseSQLBridge.TABLE_STATE_EXISTS
+                else:
+                    table_state = BaseSQLBridge.TABLE_STATE_NO_EXISTS
 
-        pd_sql_engine = pd.io.sql.pandasSQL_builder(self.sql_connection.get_engine(),
-                                                    schema=schema_name)
+            pd_sql_engine = pd.io.sql.pandasSQL_builder(self.sql_connection.get_engine(),
+                                                        schema=schema_name)
 
-        # First thing need to decide if we should drop the table.
-        if table_state == BaseSQLBridge.TABLE_STATE_EXISTS and if_exists == 'replace':
-            self.sql_connection.execute_sql(f"""DROP TABLE {schema_name}.{table_name};""")
-            table_state = BaseSQLBridge.TABLE_STATE_NO_EXISTS
+            # First thing need to decide if we should drop the table.
+            if table_state == BaseSQLBridge.TABLE_STATE_EXISTS and if_exists == 'replace':
+                self.sql_connection.execute_sql(f"""DROP TABLE {schema_name}.{table_name};""")
+                table_state = BaseSQLBridge.TABLE_STATE_NO_EXISTS
 
-        if table_state == BaseSQLBridge.TABLE_STATE_NO_EXISTS:
-            table = pd.io.sql.SQLTable(table_name, pd_sql_engine, frame=bulk_df,
-                                       index=False, schema=schema_name)
-            table.create()
+            if table_state == BaseSQLBridge.TABLE_STATE_NO_EXISTS:
+                table = pd.io.sql.SQLTable(table_name, pd_sql_engine, frame=bulk_df,
+                                           index=False, schema=schema_name)
+                table.create()
+                self.sql_connection.invalidate_metadata(table_name, schema_name)
 
-    @staticmethod
-    def save_to_csv(bulk_df, full_csv_name):
+    # Rows written to the CSV per chunk by save_to_csv
+    CSV_CHUNK_ROWS = 50000
+
+    @classmethod
+    def save_to_csv(cls, bulk_df, full_csv_name):
         """
-        Save off the dataframe into the provided CSV file name.
+        Save off the dataframe into the provided CSV file name, chunk by chunk.
 
-        :param bulk_df: Dataframe we are saving off to CSV
-        :type bulk_df: pd.DataFrame
+        :param bulk_df: Dataframe we are saving off to CSV, or a DataFrameSource
+        :type bulk_df: pd.DataFrame or DataFrameSource
         :param full_csv_name: Full path name to the CSV
         :type full_csv_name: Path
         """
-        bulk_df.to_csv(full_csv_name, header=False, index=False, sep='\t', encoding='ascii')
+        with open(full_csv_name, 'w', encoding='ascii', newline='') as fh:
+            for chunk_df in DataFrameSource.wrap(bulk_df).iter_chunks(cls.CSV_CHUNK_ROWS):
+                chunk_df.to_csv(fh, header=False, index=False, sep='\t')
 
     @staticmethod
     def _remove_csv(full_csv_name):
@@ -0,0 +1,96 @@
+"""
+Measures the cost of `import sqlconn` in a fresh interpreter, and of the first nickname lookup after it, for the
+working tree and optionally for an older git revision.
+
+    python benchmarks/bench_import.py --runs 20 --compare <git revision>
+
+Both trees are copied into a temporary directory as a package named sqlconn and given the same connconfig.json, which
+describes a single SQLite nickname, so the numbers do not depend on the config files of the machine.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent
+
+BENCH_CONFIG = {
+    'credentials': {'sqlite': {'username': 'bench', 'password': 'bench'}},
+    'databases': {'bench': {'host': '', 'database': ':memory:', 'port': 0, 'type': 'sqlite'}}
+}
+
+TIMING_CODE = """
+import sys, time
+start = time.perf_counter()
+import sqlconn
+imported = time.perf_counter()
+sqlconn.SQLParams.from_json('bench')
+looked_up = time.perf_counter()
+print(imported - start, looked_up - imported, len(sys.modules))
+"""
+
+
+def copy_tree(destination, revision=None):
+    """
+    Copies the package into destination/sqlconn, either from the working tree or from a git revision.
+
+    :param destination: Directory that receives the sqlconn package
+    :type destination: Path
+    :param revision: Git revision to copy, None for the working tree
+    :type revision: str
+    """
+    package = Path(destination, 'sqlconn')
+    if revision is None:
+        shutil.copytree(PACKAGE_DIR, package, ignore=shutil.ignore_patterns('.git', '__pycache__'))
+    else:
+        package.mkdir(parents=True)
+        archive = subprocess.run(['git', '-C', str(PACKAGE_DIR), 'archive', revision],
+                                 check=True, stdout=subprocess.PIPE).stdout
+        subprocess.run(['tar', '-x', '-C', str(package)], input=archive, check=True)
+    with open(Path(package, 'connconfig.json'), 'w') as fh:
+        json.dump(BENCH_CONFIG, fh)
+
+
+def time_imports(tree_parent, runs):
+    """
+    :param tree_parent: Directory containing the sqlconn package
+    :type tree_parent: Path
+    :param runs: Number of fresh interpreters to time
+    :type runs: int
+    :return: Returns the median import seconds, median lookup seconds and the number of loaded modules
+    :rtype: float, float, int
+    """
+    import_times, lookup_times, module_count = [], [], 0
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', TIMING_CODE], cwd=str(tree_parent), check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+        import_times.append(float(output[0]))
+        lookup_times.append(float(output[1]))
+        module_count = int(output[2])
+    return statistics.median(import_times), statistics.median(lookup_times), module_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--compare', default=None, help='git revision to compare the working tree against')
+    args = parser.parse_args()
+
+    trees = [('working tree', None)]
+    if args.compare:
+        trees.append((args.compare, args.compare))
+
+    print(f"{'tree':<20}{'import ms':>12}{'lookup ms':>12}{'modules':>10}")
+    for label, revision in trees:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            copy_tree(Path(tmp_dir), revision)
+            import_s, lookup_s, modules = time_imports(Path(tmp_dir), args.runs)
+        print(f'{label:<20}{import_s * 1000:>12.1f}{lookup_s * 1000:>12.1f}{modules:>10d}')
+
+
+if __name__ == '__main__':
+    main()
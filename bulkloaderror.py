@@ -0,0 +1,21 @@
+class BulkLoadError(RuntimeError):
+    """
+    Raised when partitions of a parallel bulk load failed. Every partition is loaded in a transaction of its own, so
+    the partitions that did not fail stay loaded.
+    """
+
+    def __init__(self, table_name, errors, stats):
+        """
+        :param table_name: The schema qualified table of the load
+        :type table_name: str
+        :param errors: The exception of every failed partition, by partition number
+        :type errors: dict
+        :param stats: The statistics of the load, see SQLConn.append_to_table
+        :type stats: dict
+        """
+        self.errors = errors
+        self.stats = stats
+        first_partition = min(errors)
+        super(BulkLoadError, self).__init__(f'{len(errors)} of {len(stats["partitions"])} partitions of the load into '
+                                            f'{table_name} failed, partition {first_partition}: '
+                                            f'{errors[first_partition]!r}')
@@ -0,0 +1,110 @@
+import queue
+import threading
+
+
+class CopyStream(object):
+    """
+    A read-only file object over chunks serialized in a background thread, for drivers that pull a bulk load from a
+    file (e.g. psycopg2's copy_expert). The next chunks are serialized while the driver is still sending the earlier
+    ones, and at most max_pending serialized chunks are held at a time, so memory is bounded by the chunk size rather
+    than by the size of the load.
+    """
+
+    # Chunks serialized ahead of the reader
+    DEFAULT_MAX_PENDING = 4
+
+    # Marks the end of the chunks in the queue
+    _END = object()
+
+    def __init__(self, chunks, serialize, max_pending=DEFAULT_MAX_PENDING):
+        """
+        :param chunks: The chunks to load, e.g. DataFrameSource.iter_chunks
+        :type chunks: iterable
+        :param serialize: Callable turning one chunk into bytes
+        :type serialize: callable
+        :param max_pending: Largest number of serialized chunks waiting for the reader
+        :type max_pending: int
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._buffer = b''
+        self._position = 0
+        self._done = False
+        self._error = None
+        self._closed = threading.Event()
+        self._producer = threading.Thread(target=self._produce, args=(chunks, serialize), daemon=True)
+        self._producer.start()
+
+    def _produce(self, chunks, serialize):
+        try:
+            for chunk in chunks:
+                if not self._put(serialize(chunk)):
+                    return
+        except BaseException as error:
+            self._error = error
+        self._put(self._END)
+
+    def _put(self, item):
+        """
+        Waits for room in the queue, giving up once the reader closed the stream.
+
+        :return: Returns False if the stream was closed
+        :rtype: bool
+        """
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _next_chunk(self):
+        """
+        Moves on to the next serialized chunk, re-raising any error of the background thread at the end.
+
+        :return: Returns False once every chunk has been read
+        :rtype: bool
+        """
+        if self._done:
+            return False
+        item = self._queue.get()
+        if item is self._END:
+            self._done = True
+            if self._error is not None:
+                raise self._error
+            return False
+        self._buffer, self._position = item, 0
+        return True
+
+    def read(self, size=-1):
+        """
+        :param size: Largest number of bytes to return, all remaining bytes if negative
+        :type size: int
+        :return: Returns the next bytes of the stream, b'' once it is exhausted
+        :rtype: bytes
+        """
+        # We slice from a position instead of trimming the buffer, drivers read a few kilobytes at a time and
+        # trimming would copy the rest of the chunk on every read.
+        parts = []
+        while size != 0:
+            if self._position >= len(self._buffer) and not self._next_chunk():
+                break
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._position + size)
+            parts.append(self._buffer[self._position:end])
+            if size > 0:
+                size -= end - self._position
+            self._position = end
+        return b''.join(parts)
+
+    def close(self):
+        """
+        Stops the background thread, e.g. when the load failed before reading everything.
+        """
+        self._closed.set()
+        self._producer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,108 @@
+import pandas as pd
+
+
+class DataFrameSource(object):
+    """
+    The rows of a bulk load, given either as one dataframe or as an iterator of dataframes that all have the same
+    columns. Loads walk the rows in chunks, so an iterator is consumed one dataframe at a time and a large dataframe
+    is never serialized in one piece.
+
+    The caller's dataframes are never changed or copied as a whole. Selecting a subset of the columns and adding
+    constant columns is done chunk by chunk, so only one chunk of the reshaped rows exists at a time.
+    """
+
+    # Rows used to infer the column types when the table has to be created
+    SCHEMA_ROWS = 1000
+
+    def __init__(self, data, columns=None, constants=None):
+        """
+        :param data: A dataframe, or an iterable of dataframes (e.g. a generator reading a file in chunks)
+        :type data: pd.DataFrame or iterable
+        :param columns: The columns to load, in order. None loads every column.
+        :type columns: list
+        :param constants: Columns added to every row, by name
+        :type constants: dict
+        """
+        self._data = data if isinstance(data, pd.DataFrame) else None
+        self._frames = None if self._data is not None else iter(data)
+        self._first = None
+        self.columns = columns
+        self.constants = constants or {}
+
+    @classmethod
+    def wrap(cls, data):
+        """
+        :param data: A DataFrameSource, a dataframe or an iterable of dataframes
+        :return: Returns the source of the data
+        :rtype: DataFrameSource
+        """
+        return data if isinstance(data, cls) else cls(data)
+
+    def is_iterator(self):
+        """
+        :return: Returns True if the rows come from an iterator, which can only be walked once
+        :rtype: bool
+        """
+        return self._data is None
+
+    def first(self):
+        """
+        Looks at the first dataframe without consuming it, e.g. to create the table from its dtypes.
+
+        :return: Returns the first dataframe as given, None if there are none
+        :rtype: pd.DataFrame
+        """
+        if self._data is not None:
+            return self._data
+        if self._first is None:
+            self._first = next(self._frames, None)
+        return self._first
+
+    def schema_frame(self):
+        """
+        :return: Returns the first rows of the load with the loaded columns, to create the table from. None if there
+                 are no dataframes.
+        :rtype: pd.DataFrame
+        """
+        first = self.first()
+        if first is None:
+            return None
+        return self._shape(first.iloc[:self.SCHEMA_ROWS])
+
+    def frames(self):
+        """
+        :return: Yields the dataframes in order, as given
+        :rtype: generator
+        """
+        if self._data is not None:
+            yield self._data
+            return
+        first = self.first()
+        if first is None:
+            return
+        self._first = None
+        yield first
+        for frame in self._frames:
+            yield frame
+
+    def iter_chunks(self, chunk_rows):
+        """
+        :param chunk_rows: Largest number of rows per chunk
+        :type chunk_rows: int
+        :return: Yields the rows in dataframes of at most chunk_rows rows, with the loaded columns. Slices of a larger
+                 dataframe are views, not copies, unless columns have to be dropped or added.
+        :rtype: generator
+        """
+        for frame in self.frames():
+            for start in range(0, len(frame), chunk_rows):
+                yield self._shape(frame.iloc[start:start + chunk_rows])
+
+    def _shape(self, frame):
+        """
+        :return: Returns the frame with only the loaded columns and the constants added
+        """
+        if self.columns is not None and list(frame.columns) != list(self.columns):
+            frame = frame[self.columns]
+        if self.constants:
+            frame = frame.assign(**self.constants)
+        return frame
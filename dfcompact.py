@@ -0,0 +1,126 @@
+"""
+Shrinks the dataframes built from query results. Integers get the narrowest dtype that holds their values, integer
+columns holding nulls become nullable integers instead of float64 when the cursor types them as integers, floats
+become float32 when that loses nothing, and text columns with few distinct values become categoricals. Used by
+SQLConn.get_dataframe(compact=True) on every chunk as it is fetched, so the full width result is never held in memory.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Text columns with at most this share of distinct values become categoricals
+MAX_CATEGORY_RATIO = 0.5
+
+
+def compact_dataframe(df, max_category_ratio=MAX_CATEGORY_RATIO, integer_columns=()):
+    """
+    :param df: A dataframe, e.g. one chunk of a query result. It is changed in place.
+    :type df: pd.DataFrame
+    :param max_category_ratio: Text columns whose distinct values are at most this share of the rows become
+                               categoricals
+    :type max_category_ratio: float
+    :param integer_columns: Columns the database types as integers, see BaseSQLBridge.integer_columns. Only these
+                            become nullable integers when they come back as floats because they hold nulls.
+    :type integer_columns: iterable
+    :return: Returns the dataframe with its columns narrowed
+    :rtype: pd.DataFrame
+    """
+    integer_columns = set(integer_columns)
+    for column in df.columns:
+        df[column] = compact_series(df[column], max_category_ratio, integer=column in integer_columns)
+    return df
+
+
+def compact_series(series, max_category_ratio=MAX_CATEGORY_RATIO, integer=False):
+    """
+    :param series: A column of a query result
+    :type series: pd.Series
+    :param max_category_ratio: See compact_dataframe
+    :type max_category_ratio: float
+    :param integer: The database types the column as an integer
+    :type integer: bool
+    :return: Returns the column in the narrowest dtype that holds all of its values
+    :rtype: pd.Series
+    """
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return series
+    if pd.api.types.is_integer_dtype(dtype):
+        if pd.api.types.is_extension_array_dtype(dtype):
+            return _narrow_nullable_int(series)
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(dtype):
+        return _compact_float(series, integer)
+    if dtype == object:
+        return _compact_object(series, max_category_ratio)
+    return series
+
+
+def _narrow_nullable_int(series):
+    """
+    :return: Returns the nullable integer column in the narrowest nullable integer dtype
+    """
+    values = series.dropna()
+    if values.empty:
+        return series.astype('Int8')
+    low, high = int(values.min()), int(values.max())
+    for dtype in ['Int8', 'Int16', 'Int32']:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return series.astype(dtype)
+    return series.astype('Int64')
+
+
+def _compact_float(series, integer):
+    """
+    Floats come back for integer columns that hold nulls. We turn those into nullable integers, and keep real floats
+    as float32 when every value survives the round trip. A float column whose values happen to be whole stays float.
+    """
+    values = series.dropna()
+    if values.empty:
+        return series
+    if integer and np.isfinite(values).all() and (values == np.floor(values)).all() and values.abs().max() < 2 ** 53:
+        return _narrow_nullable_int(series.astype('Int64'))
+    as_float32 = values.astype(np.float32)
+    if (as_float32.astype(series.dtype) == values).all():
+        return series.astype(np.float32)
+    return series
+
+
+def _compact_object(series, max_category_ratio):
+    """
+    Text columns with few distinct values become categoricals. Columns of other Python objects (decimals, dates,
+    bytes) are left as they are.
+    """
+    values = series.dropna()
+    if values.empty or not all(isinstance(value, str) for value in values):
+        return series
+    if values.nunique() <= max_category_ratio * len(series):
+        return series.astype('category')
+    return series
+
+
+def concat_compact(frames):
+    """
+    Concatenates compacted chunks of one result. Numeric columns widen to the widest chunk. A column that is
+    categorical in the first chunk stays categorical, with the categories of all chunks combined, so pandas does not
+    fall back to object columns for categoricals with different categories.
+
+    :param frames: The compacted chunks, all with the same columns
+    :type frames: iterable
+    :return: Returns the concatenated dataframe
+    :rtype: pd.DataFrame
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+
+    columns = frames[0].columns
+    categorical = [column for column in columns if isinstance(frames[0][column].dtype, pd.CategoricalDtype)]
+    combined = pd.concat([frame.drop(columns=categorical) for frame in frames], ignore_index=True)
+    for column in categorical:
+        combined[column] = union_categoricals([frame[column].astype('category') for frame in frames],
+                                              ignore_order=True)
+    return combined[columns]
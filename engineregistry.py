@@ -0,0 +1,125 @@
+import os
+import threading
+
+import sqlalchemy
+
+
+class EngineRegistry(object):
+    """
+    Process-wide registry of SQLAlchemy engines. Every SQLConn that resolves to the same database target shares one
+    engine, and therefore one connection pool, instead of building a new engine (and new connections) per object.
+
+    Engines are reference counted. SQLConn.close releases a reference and the engine is disposed once the last holder
+    has released it. Objects that are never closed keep the engine (and its warm pool) alive until close_all is called.
+
+    Engines are fork safe. A child process gets a fresh, empty pool for every registered engine, and any connection
+    opened by another process is refused on checkout, so parent and children never share a socket. Connections left
+    behind by the parent are kept referenced in the child and never closed there, because closing them would also end
+    the parent's sessions on the server.
+    """
+
+    _lock = threading.RLock()
+    _engines = {}
+    _ref_counts = {}
+
+    # Pools and connections a child inherited from its parent. They must stay referenced, as garbage collecting them
+    # would close the parent's connections.
+    _orphans = []
+
+    @classmethod
+    def acquire(cls, key, engine_builder):
+        """
+        Returns the shared engine for the key, building it the first time the key is requested.
+
+        :param key: Hashable description of the database target, see SQLParams.engine_key
+        :type key: tuple
+        :param engine_builder: Callable taking no arguments that creates the engine for the key
+        :type engine_builder: callable
+        :return: Returns the shared engine
+        :rtype: sqlalchemy engine
+        """
+        with cls._lock:
+            if key not in cls._engines:
+                cls._engines[key] = engine_builder()
+                cls._ref_counts[key] = 0
+                cls._guard_pid(cls._engines[key])
+            cls._ref_counts[key] += 1
+            return cls._engines[key]
+
+    @classmethod
+    def release(cls, key, engine):
+        """
+        Releases one reference to the engine for the key. The engine is disposed when no references remain.
+
+        :param key: Hashable description of the database target, see SQLParams.engine_key
+        :type key: tuple
+        :param engine: The engine acquire returned. After dispose_all the key may have a newer engine, which the
+                       holders of the disposed one must not release.
+        :type engine: sqlalchemy engine
+        """
+        with cls._lock:
+            if cls._engines.get(key) is not engine:
+                return
+            cls._ref_counts[key] -= 1
+            if cls._ref_counts[key] <= 0:
+                engine = cls._engines.pop(key)
+                del cls._ref_counts[key]
+                engine.dispose()
+
+    @classmethod
+    def dispose_all(cls):
+        """
+        Disposes every registered engine regardless of how many references are still held and empties the registry.
+        """
+        with cls._lock:
+            engines = list(cls._engines.values())
+            cls._engines.clear()
+            cls._ref_counts.clear()
+        for engine in engines:
+            engine.dispose()
+
+    @classmethod
+    def ref_count(cls, key):
+        """
+        :param key: Hashable description of the database target, see SQLParams.engine_key
+        :type key: tuple
+        :return: Returns the number of references held for the key, 0 if no engine is registered.
+        :rtype: int
+        """
+        with cls._lock:
+            return cls._ref_counts.get(key, 0)
+
+    @classmethod
+    def _guard_pid(cls, engine):
+        """
+        Makes the engine refuse pooled connections that were opened by another process.
+
+        :param engine: The engine to guard
+        :type engine: sqlalchemy engine
+        """
+        @sqlalchemy.event.listens_for(engine, 'connect')
+        def record_pid(dbapi_connection, connection_record):
+            connection_record.info['pid'] = os.getpid()
+
+        @sqlalchemy.event.listens_for(engine, 'checkout')
+        def check_pid(dbapi_connection, connection_record, connection_proxy):
+            if connection_record.info.get('pid', os.getpid()) != os.getpid():
+                # Detach the connection without closing it and let the pool connect again for this process
+                cls._orphans.append(dbapi_connection)
+                connection_record.connection = connection_proxy.connection = None
+                raise sqlalchemy.exc.DisconnectionError('Connection belongs to another process')
+
+    @classmethod
+    def _after_fork_in_child(cls):
+        """
+        Gives every registered engine a new pool in a freshly forked child, leaving the parent's pools untouched.
+        """
+        # Another thread of the parent may have held the lock while forking, and it is never released in the child
+        cls._lock = threading.RLock()
+        for engine in cls._engines.values():
+            cls._orphans.append(engine.pool)
+            engine.pool = engine.pool.recreate()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=EngineRegistry._after_fork_in_child)
@@ -0,0 +1,107 @@
+import threading
+import time
+
+from sqlconn import sqltext
+
+
+class MetadataCache(object):
+    """
+    Remembers the columns and column types of the tables a database target has been asked about, so repeated appends
+    to a known table skip the catalog query. A table without columns is remembered as not existing. Entries expire
+    after a time to live, which bounds how long DDL run by other processes can go unnoticed. DDL run through our own
+    SQLConn and bridges invalidates the entries it touches right away.
+
+    One cache is shared by every SQLConn of a database target.
+    """
+
+    # Seconds entries are kept unless the nickname sets "metadata_ttl"
+    DEFAULT_TTL = 300
+
+    # Shared caches keyed by SQLParams.engine_key
+    _caches = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        """
+        :param ttl: Seconds entries are kept, 0 turns the cache off
+        :type ttl: float
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (schema name, table name) -> (expires_at, [(column name, data type), ...])
+        self._entries = {}
+        self._counts = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @classmethod
+    def for_params(cls, sql_params):
+        """
+        Returns the cache shared by every connection to the target of the SQL parameters.
+
+        :param sql_params: Parameters of the connection
+        :type sql_params: SQLParams
+        :return: Returns the shared cache
+        :rtype: MetadataCache
+        """
+        key = sql_params.engine_key()
+        with cls._caches_lock:
+            if key not in cls._caches:
+                cls._caches[key] = cls(ttl=sql_params.options.get('metadata_ttl', cls.DEFAULT_TTL))
+            return cls._caches[key]
+
+    def get_or_read(self, table_name, schema_name, read):
+        """
+        :param table_name: Name of the table
+        :type table_name: str
+        :param schema_name: Name of the schema
+        :type schema_name: str
+        :param read: Callable taking no arguments that queries the catalog for the [(column name, data type), ...]
+                     of the table
+        :type read: callable
+        :return: Returns the columns and their types, an empty list if the table does not exist
+        :rtype: list
+        """
+        key = (schema_name, table_name)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._counts['hits'] += 1
+                return list(entry[1])
+            self._counts['misses'] += 1
+
+        columns = read()
+        if self.ttl:
+            with self._lock:
+                self._entries[key] = (time.time() + self.ttl, list(columns))
+        return columns
+
+    def invalidate(self, table_name=None, schema_name=None):
+        """
+        Forgets what we know about a table. Without a schema the table is forgotten in every schema, and without a
+        table everything is forgotten.
+
+        :param table_name: Name of the table, possibly quoted
+        :type table_name: str
+        :param schema_name: Name of the schema
+        :type schema_name: str
+        """
+        with self._lock:
+            if table_name is None:
+                keys = list(self._entries)
+            else:
+                table_name = sqltext.table_name(table_name)
+                keys = [key for key in self._entries if key[1].lower() == table_name and
+                        (schema_name is None or key[0].lower() == schema_name.lower())]
+            for key in keys:
+                del self._entries[key]
+            self._counts['invalidations'] += len(keys)
+
+    def stats(self):
+        """
+        :return: Returns the hit, miss and invalidation counters and the number of tables held
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            stats['entries'] = len(self._entries)
+        return stats
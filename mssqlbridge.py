@@ -1,5 +1,4 @@
-import pytds
-import sqlalchemy
+import pytds.login  # SQL Servers need an authentication method (ntlm)
 
 from sqlconn.basemssqlbridge import BaseMsSQLBridge
 
@@ -30,19 +29,21 @@ class MsSQLBridge(BaseMsSQLBridge):
         # MSSQLServer requires a certain type of authorization called nltm. Pass that as an argument to SQL Alchemy
         nltm_auth = pytds.login.NtlmAuth(sql_params.username, sql_params.password)
         if '\\' in sql_params.host:
-            return sqlalchemy.create_engine('{0}+pytds://{1}:{2}@{3}/{4}'.format(sql_params.type,
-                                                                                 sql_params.username,
-                                                                                 sql_params.password,
-                                                                                 sql_params.host,
-                                                                                 sql_params.database),
-                                            connect_args={'auth': nltm_auth,
-                                                          'autocommit': True})
+            return self._build_engine('{0}+pytds://{1}:{2}@{3}/{4}'.format(sql_params.type,
+                                                                           sql_params.username,
+                                                                           sql_params.password,
+                                                                           sql_params.host,
+                                                                           sql_params.database),
+                                      sql_params,
+                                      connect_args={'auth': nltm_auth,
+                                                    'autocommit': True})
         else:
-            return sqlalchemy.create_engine('{0}+pytds://{1}:{2}@{3}:{4}/{5}'.format(sql_params.type,
-                                                                                     sql_params.username,
-                                                                                     sql_params.password,
-                                                                                     sql_params.host,
-                                                                                     sql_params.port,
-                                                                                     sql_params.database),
-                                            connect_args={'auth': nltm_auth,
-                                                          'autocommit': True})
+            return self._build_engine('{0}+pytds://{1}:{2}@{3}:{4}/{5}'.format(sql_params.type,
+                                                                               sql_params.username,
+                                                                               sql_params.password,
+                                                                               sql_params.host,
+                                                                               sql_params.port,
+                                                                               sql_params.database),
+                                      sql_params,
+                                      connect_args={'auth': nltm_auth,
+                                                    'autocommit': True})
@@ -1,5 +1,3 @@
-import sqlalchemy
-
 from sqlconn.basemssqlbridge import BaseMsSQLBridge
 
 
@@ -28,17 +26,19 @@ class MsSQLNoauthBridge(BaseMsSQLBridge):
         """
         # The NOAUTH version uses pytds, but does not pass the 'auth' connection argument
         if '\\' in sql_params.host:
-            return sqlalchemy.create_engine('{0}+pytds://{1}:{2}@{3}/{4}'.format(sql_params.type,
-                                                                                 sql_params.username,
-                                                                                 sql_params.password,
-                                                                                 sql_params.host,
-                                                                                 sql_params.database),
-                                            connect_args={'autocommit': True})
+            return self._build_engine('{0}+pytds://{1}:{2}@{3}/{4}'.format(sql_params.type,
+                                                                           sql_params.username,
+                                                                           sql_params.password,
+                                                                           sql_params.host,
+                                                                           sql_params.database),
+                                      sql_params,
+                                      connect_args={'autocommit': True})
         else:
-            return sqlalchemy.create_engine('{0}+pytds://{1}:{2}@{3}:{4}/{5}'.format(sql_params.type,
-                                                                                     sql_params.username,
-                                                                                     sql_params.password,
-                                                                                     sql_params.host,
-                                                                                     sql_params.port,
-                                                                                     sql_params.database),
-                                            connect_args={'autocommit': True})
+            return self._build_engine('{0}+pytds://{1}:{2}@{3}:{4}/{5}'.format(sql_params.type,
+                                                                               sql_params.username,
+                                                                               sql_params.password,
+                                                                               sql_params.host,
+                                                                               sql_params.port,
+                                                                               sql_params.database),
+                                      sql_params,
+                                      connect_args={'autocommit': True})
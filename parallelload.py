@@ -0,0 +1,171 @@
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.bulkloaderror import BulkLoadError
+from sqlconn.dataframesource import DataFrameSource
+
+
+class ParallelLoad(object):
+    """
+    Loads the rows of one DataFrameSource into a table over several pooled connections at once, each partition
+    through a bulk_load of its own. Postgres runs every COPY in one server backend, so a single stream is limited by
+    one CPU of the server however fast we serialize.
+
+    A dataframe is split into equal ranges of rows. The dataframes of an iterator are handed out as they come to
+    whichever partition is ready for more, so a slow partition does not hold up the others.
+    """
+
+    # Dataframes of an iterator waiting for a partition, per partition
+    PENDING_PER_PARTITION = 2
+
+    # Ends the dataframes of a partition
+    _END = object()
+
+    # Makes a partition fail and roll back, because reading the source failed
+    _ABORT = object()
+
+    def __init__(self, sql_bridge, table_name, schema_name, parallelism, **kwargs):
+        """
+        :param sql_bridge: The bridge of the connection to load with
+        :type sql_bridge: BaseSQLBridge
+        :param table_name: Name of the table
+        :type table_name: str
+        :param schema_name: Name of the schema
+        :type schema_name: str
+        :param parallelism: Number of partitions loaded at once
+        :type parallelism: int
+        :param kwargs: Key word arguments passed on to every bulk_load
+        :type kwargs: dictionary
+        """
+        self.sql_bridge = sql_bridge
+        self.table_name = table_name
+        self.schema_name = schema_name
+        self.parallelism = parallelism
+        self.kwargs = kwargs
+
+    def run(self, source, table_state, if_exists):
+        """
+        Creates or replaces the table once, then loads the partitions into it concurrently.
+
+        :param source: The rows to load
+        :type source: DataFrameSource
+        :param table_state: Tells whether the table exists or not
+        :type table_state: int
+        :param if_exists: Follows the pandas SQL functions if exists
+        :type if_exists: str
+        :return: Returns the statistics of the load, see SQLConn.append_to_table
+        :rtype: dict
+        """
+        started = time.perf_counter()
+        self.sql_bridge._determine_table(bulk_df=source.schema_frame(),
+                                         table_name=self.table_name,
+                                         schema_name=self.schema_name,
+                                         table_state=table_state,
+                                         if_exists=if_exists)
+
+        row_counts = [0] * self.parallelism
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            if source.is_iterator():
+                chunks = queue.Queue(maxsize=self.PENDING_PER_PARTITION * self.parallelism)
+                futures = [executor.submit(self._load, self._partition_source(source, chunks, row_counts, partition))
+                           for partition in range(self.parallelism)]
+                self._feed(source, chunks, futures)
+            else:
+                futures = [executor.submit(self._load, partition_source)
+                           for partition_source in self._split(source, row_counts)]
+
+        errors, partitions = {}, []
+        for partition, future in enumerate(futures):
+            if future.exception() is not None:
+                errors[partition] = future.exception()
+            partitions.append({'rows': 0 if partition in errors else row_counts[partition],
+                               'seconds': None if partition in errors else future.result()})
+        seconds = time.perf_counter() - started
+        rows = sum(partition['rows'] for partition in partitions)
+        stats = {'rows': rows,
+                 'seconds': seconds,
+                 'rows_per_second': rows / seconds if seconds > 0 else float('inf'),
+                 'partitions': partitions}
+        if errors:
+            raise BulkLoadError(f'{self.schema_name}.{self.table_name}', errors, stats) from errors[min(errors)]
+        return stats
+
+    def _load(self, partition_source):
+        """
+        :return: Returns the seconds the bulk load of the partition took
+        :rtype: float
+        """
+        started = time.perf_counter()
+        self.sql_bridge.bulk_load(bulk_df=partition_source,
+                                  table_name=self.table_name,
+                                  schema_name=self.schema_name,
+                                  table_state=BaseSQLBridge.TABLE_STATE_EXISTS,
+                                  if_exists='append',
+                                  **self.kwargs)
+        return time.perf_counter() - started
+
+    def _split(self, source, row_counts):
+        """
+        :return: Returns a source for each of parallelism equal ranges of the rows of a dataframe. The ranges are
+                 views of the dataframe, not copies.
+        :rtype: list
+        """
+        df = source.first()
+        bounds = [len(df) * partition // self.parallelism for partition in range(self.parallelism + 1)]
+        partition_sources = []
+        for partition, (start, stop) in enumerate(zip(bounds, bounds[1:])):
+            row_counts[partition] = stop - start
+            partition_sources.append(DataFrameSource(df.iloc[start:stop], columns=source.columns,
+                                                     constants=source.constants))
+        return partition_sources
+
+    def _partition_source(self, source, chunks, row_counts, partition):
+        """
+        :return: Returns a source over the dataframes of the queue that the partition takes
+        :rtype: DataFrameSource
+        """
+        def frames():
+            while True:
+                frame = chunks.get()
+                if frame is self._END:
+                    return
+                if frame is self._ABORT:
+                    raise RuntimeError('We stopped the load, reading the dataframes to load failed')
+                row_counts[partition] += len(frame)
+                yield frame
+        return DataFrameSource(frames(), columns=source.columns, constants=source.constants)
+
+    def _feed(self, source, chunks, futures):
+        """
+        Hands the dataframes of the source to the partitions, then tells each partition to finish. If reading the
+        source fails the partitions are told to fail instead, so none of them commits part of the load.
+        """
+        end = self._END
+        try:
+            for frame in source.frames():
+                if not self._put(chunks, frame, futures):
+                    break
+        except BaseException:
+            end = self._ABORT
+            raise
+        finally:
+            for _ in futures:
+                self._put(chunks, end, futures)
+
+    @staticmethod
+    def _put(chunks, item, futures):
+        """
+        Waits for room in the queue, giving up once every partition has stopped.
+
+        :return: Returns False if no partition is left to take the item
+        :rtype: bool
+        """
+        while not all(future.done() for future in futures):
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
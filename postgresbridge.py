@@ -1,7 +1,16 @@
-import io
+import hashlib
+import itertools
+import re
+import tempfile
+from collections import OrderedDict
+import pandas as pd
 import sqlalchemy
 
+from sqlconn import pgbinary
 from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.copystream import CopyStream
+from sqlconn.dataframesource import DataFrameSource
+from sqlconn.retrypolicy import RetryPolicy
 
 
 class PostgresBridge(BaseSQLBridge):
@@ -27,12 +36,170 @@ class PostgresBridge(BaseSQLBridge):
         :return: Returns the engine
         :rtype: sqlalchemy engine
         """
-        return sqlalchemy.create_engine('{0}://{1}:{2}@{3}:{4}/{5}'.format(sql_params.type,
-                                                                           sql_params.username,
-                                                                           sql_params.password,
-                                                                           sql_params.host,
-                                                                           sql_params.port,
-                                                                           sql_params.database))
+        return self._build_engine('{0}://{1}:{2}@{3}:{4}/{5}'.format(sql_params.type,
+                                                                     sql_params.username,
+                                                                     sql_params.password,
+                                                                     sql_params.host,
+                                                                     sql_params.port,
+                                                                     sql_params.database),
+                                  sql_params)
+
+    def session_connect_args(self, session):
+        """
+        Postgres takes session settings as libpq options, so they are applied while connecting instead of costing an
+        extra round trip per connection.
+
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns the psycopg2 connection arguments for the session settings
+        :rtype: dict
+        """
+        connect_args = {}
+        options = []
+        for key, value in session.items():
+            if key == 'application_name':
+                connect_args['application_name'] = value
+            else:
+                # Spaces inside a libpq option value must be escaped
+                escaped_value = str(value).replace(' ', '\\ ')
+                options.append(f'-c {key}={escaped_value}')
+        if options:
+            connect_args['options'] = ' '.join(options)
+        return connect_args
+
+    def session_statements(self, session):
+        """
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns an empty list, everything is applied through session_connect_args
+        :rtype: list
+        """
+        return []
+
+    def stream_options(self, chunk_rows):
+        """
+        Streams through a psycopg2 named cursor, fetching chunk_rows rows per round trip.
+
+        :param chunk_rows: Number of rows the caller fetches at a time
+        :type chunk_rows: int
+        :return: Returns the execution options for a server-side cursor
+        :rtype: dict
+        """
+        return {'stream_results': True, 'max_row_buffer': chunk_rows}
+
+    def integer_columns(self, description):
+        """
+        See BaseSQLBridge.integer_columns, the type codes are type OIDs.
+        """
+        return [column.name for column in description if column.type_code in self.INTEGER_OIDS]
+
+    def hash_predicate(self, column, num_partitions, partition):
+        """
+        Partitions on hashtext, so any column type works. See BaseSQLBridge.hash_predicate.
+        """
+        predicate = f'MOD(ABS(hashtext(({column})::text)::bigint), {num_partitions:d}) = {partition:d}'
+        return f'({predicate} OR {column} IS NULL)' if partition == 0 else predicate
+
+    # Parameter sets sent per round trip by execute_many
+    EXECUTE_MANY_PAGE_SIZE = 1000
+
+    def execute_many(self, connection, sql, param_rows):
+        """
+        psycopg2's executemany makes a round trip per parameter set. We send them through execute_batch instead,
+        which joins EXECUTE_MANY_PAGE_SIZE statements into one round trip. See BaseSQLBridge.execute_many.
+        """
+        from psycopg2.extras import execute_batch
+
+        # Compiling for the dialect turns the :name parameters into psycopg2's %(name)s and escapes any literal %
+        pyformat_sql = str(sqlalchemy.text(sql).compile(dialect=connection.dialect))
+        cursor = connection.connection.cursor()
+        try:
+            execute_batch(cursor, pyformat_sql, param_rows, page_size=self.EXECUTE_MANY_PAGE_SIZE)
+        finally:
+            cursor.close()
+
+    # Bound parameters as sqlalchemy.text finds them, skipping :: casts and escaped colons.
+    BIND_PATTERN = re.compile(r'(?<![:\w\\]):(\w+)(?!:)')
+
+    # Prepared statements kept per connection. The least recently used one is deallocated to make room for a new one,
+    # so ad hoc statements with parameters do not pile up in long lived sessions.
+    MAX_PREPARED_STATEMENTS = 100
+
+    def bind_statement(self, connection, sql, params, prepared=True):
+        """
+        Prepares the statement on the server the first time a connection runs it and executes the prepared statement
+        from then on, so the hot statements of e.g. SQLQueue are parsed and planned once per connection instead of on
+        every call. The prepared names are tracked per DBAPI connection in the pool's connection info, at most
+        MAX_PREPARED_STATEMENTS of them.
+
+        Set "prepared_statements": false on nicknames that go through a transaction pooling proxy (e.g. pgbouncer),
+        where the next statement may land on a server session that never saw the PREPARE.
+
+        :param connection: The connection the statement will run on
+        :type connection: sqlalchemy connection
+        :param sql: The sql, with bound parameters written as :name
+        :type sql: str
+        :param params: Values of the bound parameters by name
+        :type params: dict
+        :param prepared: Whether a prepared statement may be used. Server-side cursors cannot run one.
+        :type prepared: bool
+        :return: Returns the statement and the parameters to execute it with
+        :rtype: sqlalchemy TextClause, dict
+        """
+        if not prepared or not self.sql_connection.sql_params.options.get('prepared_statements', True):
+            return sqlalchemy.text(sql), params
+
+        names = []
+        for name in self.BIND_PATTERN.findall(sql):
+            if name not in names:
+                names.append(name)
+        statement_name = 'sqlconn_' + hashlib.sha1(sql.encode('utf-8')).hexdigest()[:24]
+
+        # The info dictionary outlives a reconnect of the pooled connection in some SQLAlchemy versions, so we also
+        # check that the statements were prepared on this DBAPI connection.
+        fairy = connection.connection
+        dbapi_id = id(getattr(fairy, 'dbapi_connection', None) or fairy.connection)
+        prepared = connection.info.get('sqlconn_prepared')
+        if prepared is None or prepared[0] != dbapi_id:
+            prepared = connection.info['sqlconn_prepared'] = (dbapi_id, OrderedDict())
+
+        statements = prepared[1]
+        if statement_name in statements:
+            statements.move_to_end(statement_name)
+        else:
+            if len(statements) >= self.MAX_PREPARED_STATEMENTS:
+                evicted_name, _ = statements.popitem(last=False)
+                connection.execute(sqlalchemy.text(f'DEALLOCATE {evicted_name}'))
+            positional_sql = self.BIND_PATTERN.sub(lambda match: f'${names.index(match.group(1)) + 1:d}', sql)
+            connection.execute(sqlalchemy.text(f'PREPARE {statement_name} AS {positional_sql}'))
+            statements[statement_name] = None
+
+        arguments = f"({', '.join(':' + name for name in names)})" if names else ''
+        statement = sqlalchemy.text(f'EXECUTE {statement_name}{arguments}').execution_options(autocommit=True)
+        return statement, params
+
+    # SQLSTATE codes we retry. Class 08 (connection exception) is matched on its prefix.
+    DEADLOCK_CODES = ['40001', '40P01']
+    TRANSIENT_CODES = ['57P01', '57P02', '57P03', '53300']
+
+    def classify_driver_error(self, error):
+        """
+        Classifies psycopg2 and asyncpg errors by their SQLSTATE code.
+
+        :param error: The exception raised by the driver
+        :type error: Exception
+        :return: Returns RetryPolicy.TRANSIENT, RetryPolicy.DEADLOCK or RetryPolicy.PERMANENT
+        :rtype: str
+        """
+        code = getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None)
+        if code in self.DEADLOCK_CODES:
+            return RetryPolicy.DEADLOCK
+        if code in self.TRANSIENT_CODES or (code is not None and code.startswith('08')):
+            return RetryPolicy.TRANSIENT
+        # Failing to connect, or losing the server mid query, raises an OperationalError without a SQLSTATE
+        if code is None and type(error).__name__ in ['OperationalError', 'InterfaceError']:
+            return RetryPolicy.TRANSIENT
+        return super(PostgresBridge, self).classify_driver_error(error)
 
     @staticmethod
     def default_schema():
@@ -42,12 +209,18 @@ class PostgresBridge(BaseSQLBridge):
         """
         return 'public'
 
+    # Rows serialized per chunk of a bulk load
+    BULK_LOAD_CHUNK_ROWS = 50000
+
     def bulk_load(self, bulk_df, table_name, schema_name, table_state=BaseSQLBridge.TABLE_STATE_UNKNOWN, if_exists='append', **kwargs):
         """
-        Perform a bulk copy into the table.
+        Perform a bulk copy into the table. The rows are serialized to CSV in chunks on a background thread while
+        COPY sends the earlier chunks, so memory stays bounded by the chunk size and the transfer starts right away.
 
-        :param bulk_df: Dataframe values to copy into the table
-        :type bulk_df: pd.DataFrame
+        :param bulk_df: Dataframe values to copy into the table, or an iterator of dataframes with the same columns to
+                        stream a load that does not fit in memory, or a DataFrameSource. The table is created from the
+                        first one.
+        :type bulk_df: pd.DataFrame or iterable or DataFrameSource
         :param table_name: Name of the table
         :type table_name: str
         :param schema_name: Name of the schema
@@ -56,31 +229,173 @@ class PostgresBridge(BaseSQLBridge):
         :type table_state: int
         :param if_exists: Follows the pandas SQL functions if exists
         :type if_exists: str
-        :param kwargs: Key word arguments if needed for the bulk load
+        :param kwargs: Key word arguments if needed for the bulk load, chunk_rows sets the rows serialized per chunk
+                       and format='binary' sends the binary COPY format instead of csv, see pgbinary
         :type kwargs: dictionary
         """
-        # load_df, table_existence = self._align_df(true_table_name, df, schema=schema)
-        load_df = bulk_df.copy(deep=True)
-        string_data_io = io.StringIO()
-        load_df.to_csv(string_data_io, sep='|', index=False)
+        source = DataFrameSource.wrap(bulk_df)
+        first_df = source.schema_frame()
+        if first_df is None:
+            return
+        chunk_rows = kwargs.get('chunk_rows', self.BULK_LOAD_CHUNK_ROWS)
 
-        self._determine_table(bulk_df=bulk_df,
+        self._determine_table(bulk_df=first_df,
                               table_name=table_name,
                               schema_name=schema_name,
                               table_state=table_state,
                               if_exists=if_exists)
 
-        string_data_io.seek(0)
-        columns = string_data_io.readline()  # remove header
-        columns = columns.replace("|", ",")
+        columns = list(first_df.columns)
+        if kwargs.get('format', 'csv') == 'binary':
+            column_types = self._binary_column_types(columns, table_name, schema_name)
+
+            def serialize(chunk):
+                # The header and trailer are passed through as they are
+                return chunk if isinstance(chunk, bytes) else pgbinary.encode_rows(chunk[columns], column_types)
+            chunks = itertools.chain([pgbinary.HEADER], source.iter_chunks(chunk_rows), [pgbinary.TRAILER])
+            copy_cmd = "COPY %s.%s (%s) FROM STDIN WITH (FORMAT BINARY)" % (schema_name, table_name, ','.join(columns))
+        else:
+            def serialize(chunk_df):
+                # Every chunk is written in the column order of the COPY command
+                return chunk_df.to_csv(sep='|', index=False, header=False, columns=columns).encode('utf-8')
+            chunks = source.iter_chunks(chunk_rows)
+            copy_cmd = "COPY %s.%s (%s) FROM STDIN DELIMITER '|' CSV ENCODING 'UTF8'" % (schema_name,
+                                                                                         table_name,
+                                                                                         ','.join(columns))
+
         with self.sql_connection.get_engine().connect() as connection:
-            with connection.connection.cursor() as cursor:
-                copy_cmd = "COPY %s.%s (%s) FROM STDIN DELIMITER '|' CSV" % (schema_name,
-                                                                             table_name,
-                                                                             columns)
-                cursor.copy_expert(copy_cmd, string_data_io)
+            with connection.connection.cursor() as cursor, CopyStream(chunks, serialize) as copy_stream:
+                cursor.copy_expert(copy_cmd, copy_stream)
             connection.connection.commit()
 
+    def _binary_column_types(self, columns, table_name, schema_name):
+        """
+        :return: Returns the Postgres type of each column, which decides how the binary format encodes it
+        :rtype: list
+        """
+        table_types = dict(self.get_column_types(table_name, schema_name))
+        column_types = []
+        for column in columns:
+            # Unquoted names in the COPY command fold to lower case
+            column_type = table_types.get(column, table_types.get(column.lower()))
+            if column_type is None:
+                raise KeyError(f'{column} is not a column of {schema_name}.{table_name}')
+            column_types.append(column_type)
+        return column_types
+
+    # Bytes of COPY output kept in memory before bulk_read spools it to a temporary file
+    BULK_READ_SPOOL_BYTES = 256 * 1024 * 1024
+
+    # Postgres type OIDs of the columns bulk_read parses as something other than inferred numbers
+    FLOAT_OIDS = [700, 701, 1700]
+    BOOL_OIDS = [16]
+    DATETIME_OIDS = [1082, 1114, 1184]
+    INTEGER_OIDS = [20, 21, 23, 26]
+    NUMBER_OIDS = INTEGER_OIDS + FLOAT_OIDS
+
+    def bulk_read(self, sql):
+        """
+        Reads the results of a query through COPY (sql) TO STDOUT and parses the CSV stream with the pandas C reader,
+        which is far faster than building the dataframe row by row. The stream is spooled to disk once it outgrows
+        BULK_READ_SPOOL_BYTES.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :return: Returns the results of the sql query
+        :rtype: pd.DataFrame
+        """
+        return self._read_copy(sql, self._parse_copy)
+
+    def bulk_read_arrow(self, sql):
+        """
+        Reads the results of a query through COPY (sql) TO STDOUT and parses the CSV stream with pyarrow's
+        multithreaded CSV reader, straight into arrow columns typed from the result description. No Python object is
+        built per row or per value. See BaseSQLBridge.bulk_read_arrow.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :return: Returns the results of the sql query
+        :rtype: pyarrow.Table
+        """
+        return self._read_copy(sql, self._parse_copy_arrow)
+
+    def _read_copy(self, sql, parse):
+        """
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :param parse: Callable taking the file object holding the CSV output of the COPY and the cursor description
+        :type parse: callable
+        :return: Returns what parse returns
+        """
+        sql = sql.strip().rstrip(';')
+
+        def read(connection):
+            with connection.connection.cursor() as cursor:
+                # Describe the result without running the query, so each column can be parsed as its type
+                cursor.execute(f'SELECT * FROM ({sql}) copy_source LIMIT 0')
+                description = cursor.description
+                with tempfile.SpooledTemporaryFile(max_size=self.BULK_READ_SPOOL_BYTES, mode='w+b') as copy_io:
+                    cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT CSV, NULL '\\N')", copy_io)
+                    copy_io.seek(0)
+                    return parse(copy_io, description)
+        return self.sql_connection._run(read)
+
+    def _parse_copy(self, copy_io, description):
+        """
+        :param copy_io: File object holding the CSV output of the COPY
+        :param description: DBAPI cursor description of the query
+        :type description: list
+        :return: Returns the parsed dataframe
+        :rtype: pd.DataFrame
+        """
+        columns = [column.name for column in description]
+        dtypes = {}
+        parse_dates = []
+        bool_columns = []
+        for column in description:
+            if column.type_code in self.FLOAT_OIDS:
+                dtypes[column.name] = 'float64'
+            elif column.type_code in self.DATETIME_OIDS:
+                parse_dates.append(column.name)
+            elif column.type_code in self.BOOL_OIDS:
+                bool_columns.append(column.name)
+                dtypes[column.name] = str
+            elif column.type_code not in self.NUMBER_OIDS:
+                # Text has to stay text, e.g. '007' must not turn into 7
+                dtypes[column.name] = str
+        # NULL is written as \N, so an empty string survives as an empty string
+        df = pd.read_csv(copy_io, header=None, names=columns, dtype=dtypes, parse_dates=parse_dates,
+                         na_values=['\\N'], keep_default_na=False)
+        for column in bool_columns:
+            df[column] = df[column].map({'t': True, 'f': False})
+        return df
+
+    @staticmethod
+    def _parse_copy_arrow(copy_io, description):
+        """
+        :param copy_io: File object holding the CSV output of the COPY
+        :param description: DBAPI cursor description of the query
+        :type description: list
+        :return: Returns the parsed table
+        :rtype: pyarrow.Table
+        """
+        import pyarrow as pa
+        from pyarrow import csv
+
+        # Arrow types by Postgres type OID, anything else is read as text. numeric is read as float64 like bulk_read.
+        oid_types = {16: pa.bool_(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 26: pa.int64(),
+                     700: pa.float32(), 701: pa.float64(), 1700: pa.float64(), 1082: pa.date32(),
+                     1114: pa.timestamp('us'), 1184: pa.timestamp('us', tz='UTC')}
+        columns = [column.name for column in description]
+        column_types = {column.name: oid_types.get(column.type_code, pa.string()) for column in description}
+        # NULL is written as \N and an empty string as "", which must stay an empty string
+        return csv.read_csv(copy_io,
+                            read_options=csv.ReadOptions(column_names=columns),
+                            convert_options=csv.ConvertOptions(column_types=column_types, null_values=['\\N'],
+                                                               strings_can_be_null=True,
+                                                               quoted_strings_can_be_null=False,
+                                                               true_values=['t'], false_values=['f']))
+
     def table_cleanup(self, table_name, schema_name):
         """
         Drops the table
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from sqlconn import sqltext
+
+
+class QueryCache(object):
+    """
+    Opt-in cache of get_dataframe results. Entries are keyed by the database target, the normalized sql and the read
+    arguments, and expire after a per-call, per-table or default time to live. The in-memory part is an LRU bounded by
+    the bytes of the cached dataframes. With a spill directory, entries are also written as Parquet files, so they
+    survive restarts and are shared by every process on the host that uses the same directory.
+
+    Writes made through SQLConn.append_to_table and SQLConn.execute_sql invalidate the entries reading from the
+    written table, in memory and on disk. Another process only sees an invalidation once the entry leaves its memory,
+    so keep the time to live of tables written from several processes short.
+    """
+
+    # Shared caches keyed by their json configuration
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, default_ttl=None, table_ttls=None, spill_dir=None):
+        """
+        :param max_bytes: Upper bound of the memory used by the cached dataframes
+        :type max_bytes: int
+        :param default_ttl: Seconds results are kept when neither the call nor its tables give a time to live. None
+                            caches only the calls and tables that do.
+        :type default_ttl: float
+        :param table_ttls: Seconds results reading from a table are kept, by table name. A query reading several of
+                           them is kept for the shortest.
+        :type table_ttls: dict
+        :param spill_dir: Directory for the Parquet copies of the entries, None keeps entries in memory only
+        :type spill_dir: str
+        """
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.table_ttls = {sqltext.table_name(table): ttl for table, ttl in (table_ttls or {}).items()}
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # key -> (expires_at, dataframe, bytes, tables)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counts = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @classmethod
+    def shared(cls, config):
+        """
+        Returns the cache shared by every connection configured with the same cache block.
+
+        :param config: The cache block of a nickname in connconfig.json, the keys are the arguments of the constructor
+        :type config: dict
+        :return: Returns the shared cache
+        :rtype: QueryCache
+        """
+        key = json.dumps(config, sort_keys=True)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(**config)
+            return cls._shared[key]
+
+    @staticmethod
+    def make_key(scope, sql, read_args):
+        """
+        :param scope: Describes the database the query runs against, e.g. SQLParams.engine_key
+        :type scope: tuple
+        :param sql: The sql query
+        :type sql: str
+        :param read_args: The arguments that change the result of the read, e.g. query parameters
+        :type read_args: dict
+        :return: Returns the cache key
+        :rtype: str
+        """
+        description = json.dumps([list(scope), sqltext.normalize_sql(sql), read_args], sort_keys=True, default=repr)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, sql, ttl=None):
+        """
+        :param sql: The sql query
+        :type sql: str
+        :param ttl: Time to live asked for by the caller, takes precedence
+        :type ttl: float
+        :return: Returns the seconds the result of the query should be kept, None if it should not be cached
+        :rtype: float
+        """
+        if ttl is not None:
+            return ttl
+        table_ttls = [self.table_ttls[table] for table in sqltext.referenced_tables(sql) if table in self.table_ttls]
+        if table_ttls:
+            return min(table_ttls)
+        return self.default_ttl
+
+    def get_or_read(self, key, sql, ttl, read):
+        """
+        Returns the cached result for the key, calling read and caching its result on a miss. The caller gets its own
+        copy of the dataframe and may change it freely.
+
+        :param key: Key from make_key
+        :type key: str
+        :param sql: The sql query, used to find the tables it reads from
+        :type sql: str
+        :param ttl: Seconds to keep the result
+        :type ttl: float
+        :param read: Callable taking no arguments that runs the query
+        :type read: callable
+        :return: Returns the result of the query
+        :rtype: pd.DataFrame
+        """
+        df = self._get(key)
+        if df is None:
+            df = read()
+            self._put(key, df.copy(), time.time() + ttl, sqltext.referenced_tables(sql))
+            return df
+        return df.copy()
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                expires_at, df, nbytes, tables = self._entries[key]
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counts['hits'] += 1
+                    return df
+                self._drop(key)
+
+        df, expires_at, tables = self._read_spill(key, now)
+        with self._lock:
+            if df is None:
+                self._counts['misses'] += 1
+                return None
+            self._counts['hits'] += 1
+            self._counts['disk_hits'] += 1
+        self._remember(key, df, expires_at, tables)
+        return df
+
+    def _put(self, key, df, expires_at, tables):
+        self._remember(key, df, expires_at, tables)
+        self._write_spill(key, df, expires_at, tables)
+
+    def _remember(self, key, df, expires_at, tables):
+        """
+        Keeps the dataframe in memory, evicting the least recently used entries to stay within max_bytes.
+        """
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, df, nbytes, tables)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counts['evictions'] += 1
+
+    def _drop(self, key):
+        """
+        Removes an entry from memory. The lock must be held.
+        """
+        self._bytes -= self._entries.pop(key)[2]
+
+    def invalidate_tables(self, tables):
+        """
+        Drops every entry, in memory and on disk, that reads from one of the tables.
+
+        :param tables: Possibly schema qualified table names
+        :type tables: iterable
+        """
+        tables = {sqltext.table_name(table) for table in tables}
+        if not tables:
+            return
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[3] & tables]:
+                self._drop(key)
+                self._counts['invalidations'] += 1
+        if self.spill_dir is not None:
+            for meta_path in self.spill_dir.glob('*.json'):
+                meta = self._read_meta(meta_path)
+                if meta is not None and tables & set(meta['tables']):
+                    self._remove_spill(meta_path.stem)
+
+    def clear(self):
+        """
+        Drops every entry, in memory and on disk.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.spill_dir is not None:
+            for meta_path in self.spill_dir.glob('*.json'):
+                self._remove_spill(meta_path.stem)
+
+    def stats(self):
+        """
+        :return: Returns the hit, disk hit, miss, eviction and invalidation counters, and the entries and bytes held
+                 in memory
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        return stats
+
+    def _spill_paths(self, key):
+        return Path(self.spill_dir, key + '.parquet'), Path(self.spill_dir, key + '.json')
+
+    @staticmethod
+    def _read_meta(meta_path):
+        try:
+            with open(meta_path) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _read_spill(self, key, now):
+        """
+        :return: Returns the dataframe, expiry and tables of the spilled entry, or Nones if there is no live entry
+        """
+        if self.spill_dir is None:
+            return None, None, None
+        parquet_path, meta_path = self._spill_paths(key)
+        meta = self._read_meta(meta_path)
+        if meta is None:
+            return None, None, None
+        if meta['expires_at'] <= now:
+            self._remove_spill(key)
+            return None, None, None
+        try:
+            df = pd.read_parquet(parquet_path)
+        except Exception:
+            return None, None, None
+        return df, meta['expires_at'], set(meta['tables'])
+
+    def _write_spill(self, key, df, expires_at, tables):
+        """
+        Writes the entry to the spill directory. The files are written under temporary names and renamed, so other
+        processes never read half a file. Dataframes Parquet cannot hold are only cached in memory.
+        """
+        if self.spill_dir is None:
+            return
+        parquet_path, meta_path = self._spill_paths(key)
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            df.to_parquet(str(parquet_path) + suffix)
+            os.replace(str(parquet_path) + suffix, parquet_path)
+            with open(str(meta_path) + suffix, 'w') as fh:
+                json.dump({'expires_at': expires_at, 'tables': sorted(tables)}, fh)
+            os.replace(str(meta_path) + suffix, meta_path)
+        except Exception:
+            for path in [str(parquet_path) + suffix, str(meta_path) + suffix]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _remove_spill(self, key):
+        # The meta file goes first, an entry without it is never read
+        for path in reversed(self._spill_paths(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
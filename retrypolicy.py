@@ -0,0 +1,182 @@
+import asyncio
+import random
+import threading
+import time
+
+from sqlconn.sqlparams import SQLParams
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed database call is worth repeating and how long to wait before doing so. Errors are
+    classified by the SQL bridge of the connection into one of three categories:
+
+        TRANSIENT   The connection broke (server restart, network blip, pool timeout). The broken connection is
+                    invalidated and the call is retried on a fresh one.
+        DEADLOCK    The server chose our transaction as a deadlock or serialization victim. Retried as is.
+        PERMANENT   Anything else, e.g. a syntax error or a constraint violation. Raised immediately.
+
+    Retries back off exponentially with full jitter. One policy is shared by every SQLConn of a database target, so
+    its counters show what retrying costs for that target.
+    """
+    TRANSIENT = 'transient'
+    DEADLOCK = 'deadlock'
+    PERMANENT = 'permanent'
+
+    # Shared policies keyed by SQLParams.engine_key
+    _policies = {}
+    _policies_lock = threading.Lock()
+
+    def __init__(self, max_retries=3, base_delay=0.1, max_delay=5.0, retry_deadlocks=True):
+        """
+        :param max_retries: Number of times a call is repeated before the error is raised
+        :type max_retries: int
+        :param base_delay: Upper bound in seconds of the wait before the first retry. Doubles with every attempt.
+        :type base_delay: float
+        :param max_delay: Largest upper bound in seconds of the wait between attempts
+        :type max_delay: float
+        :param retry_deadlocks: Whether deadlock and serialization failures are retried
+        :type retry_deadlocks: bool
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_deadlocks = retry_deadlocks
+
+        self._lock = threading.Lock()
+        self._counts = {self.TRANSIENT: 0, self.DEADLOCK: 0, 'gave_up': 0}
+
+    @classmethod
+    def for_params(cls, sql_params):
+        """
+        Returns the policy shared by every connection to the target of the SQL parameters. The first call builds it
+        from the optional retry block of the nickname in connconfig.json.
+
+        :param sql_params: Parameters of the connection
+        :type sql_params: SQLParams
+        :return: Returns the shared policy
+        :rtype: RetryPolicy
+        """
+        key = sql_params.engine_key()
+        with cls._policies_lock:
+            if key not in cls._policies:
+                cls._policies[key] = cls(**sql_params.options.get('retry', {}))
+            return cls._policies[key]
+
+    @classmethod
+    def register(cls, sql_params, policy):
+        """
+        Replaces the shared policy of a database target, e.g. with a subclass that backs off differently. Only
+        SQLConn objects created afterwards pick it up.
+
+        :param sql_params: Parameters of the connection, or a sql nickname
+        :type sql_params: SQLParams or str
+        :param policy: The policy to use for the target
+        :type policy: RetryPolicy
+        """
+        if isinstance(sql_params, str):
+            sql_params = SQLParams.from_json(sql_nickname=sql_params)
+        with cls._policies_lock:
+            cls._policies[sql_params.engine_key()] = policy
+
+    def should_retry(self, category, attempt):
+        """
+        :param category: One of TRANSIENT, DEADLOCK or PERMANENT
+        :type category: str
+        :param attempt: Number of retries already made for the call
+        :type attempt: int
+        :return: Returns True if the call should be made again
+        :rtype: bool
+        """
+        if attempt >= self.max_retries:
+            return False
+        if category == self.TRANSIENT:
+            return True
+        return category == self.DEADLOCK and self.retry_deadlocks
+
+    def backoff(self, attempt):
+        """
+        :param attempt: Number of retries already made for the call
+        :type attempt: int
+        :return: Returns the number of seconds to wait before the next attempt
+        :rtype: float
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def run(self, engine, operation, classify):
+        """
+        Checks a connection out of the engine's pool and calls the operation with it, retrying according to the
+        policy. Only the connection the error happened on is invalidated, the rest of the pool is left alone.
+
+        :param engine: The engine to check connections out of
+        :type engine: sqlalchemy engine
+        :param operation: Callable taking a sqlalchemy connection
+        :type operation: callable
+        :param classify: Callable mapping an exception to TRANSIENT, DEADLOCK or PERMANENT
+        :type classify: callable
+        :return: Returns whatever the operation returns
+        """
+        attempt = 0
+        while True:
+            try:
+                with engine.connect() as connection:
+                    try:
+                        return operation(connection)
+                    except Exception as e:
+                        if classify(e) == self.TRANSIENT and not connection.invalidated:
+                            connection.invalidate()
+                        raise
+            except Exception as e:
+                category = classify(e)
+                if not self.should_retry(category, attempt):
+                    if category != self.PERMANENT:
+                        self._count('gave_up')
+                    raise
+                self._count(category)
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def run_async(self, engine, operation, classify):
+        """
+        The asyncio version of run.
+
+        :param engine: The engine to check connections out of
+        :type engine: sqlalchemy AsyncEngine
+        :param operation: Coroutine function taking a sqlalchemy AsyncConnection
+        :type operation: callable
+        :param classify: Callable mapping an exception to TRANSIENT, DEADLOCK or PERMANENT
+        :type classify: callable
+        :return: Returns whatever the operation returns
+        """
+        attempt = 0
+        while True:
+            try:
+                async with engine.connect() as connection:
+                    try:
+                        return await operation(connection)
+                    except Exception as e:
+                        if classify(e) == self.TRANSIENT and not connection.invalidated:
+                            await connection.invalidate()
+                        raise
+            except Exception as e:
+                category = classify(e)
+                if not self.should_retry(category, attempt):
+                    if category != self.PERMANENT:
+                        self._count('gave_up')
+                    raise
+                self._count(category)
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        """
+        :return: Returns the number of transient and deadlock retries made and the number of retryable errors that
+                 were raised because the retries ran out.
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._counts)
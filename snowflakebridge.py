@@ -1,8 +1,17 @@
+import logging
 import os
-import sqlalchemy
-from pathlib import Path
+import shutil
+import tempfile
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.dataframesource import DataFrameSource
+from sqlconn.retrypolicy import RetryPolicy
+from sqlconn.snowflakestage import SnowflakeStage
+
+logger = logging.getLogger(__name__)
 
 
 class SnowflakeBridge(BaseSQLBridge):
@@ -18,6 +27,7 @@ class SnowflakeBridge(BaseSQLBridge):
         :type sql_conn: SQLConn
         """
         super(SnowflakeBridge, self).__init__(sql_conn)
+        self.stage = SnowflakeStage(sql_conn)
 
     def get_engine(self, sql_params):
         """
@@ -28,9 +38,68 @@ class SnowflakeBridge(BaseSQLBridge):
         :return: Returns the engine
         :rtype: sqlalchemy engine
         """
-        return sqlalchemy.create_engine(f'{sql_params.type}://{sql_params.username}:'
-                                        f'{sql_params.password}@{sql_params.host}/'
-                                        f'{sql_params.database}')
+        return self._build_engine(f'{sql_params.type}://{sql_params.username}:'
+                                  f'{sql_params.password}@{sql_params.host}/'
+                                  f'{sql_params.database}',
+                                  sql_params)
+
+    def session_connect_args(self, session):
+        """
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns the session settings as Snowflake session parameters
+        :rtype: dict
+        """
+        if session:
+            return {'session_parameters': {key.upper(): value for key, value in session.items()}}
+        return {}
+
+    def session_statements(self, session):
+        """
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns an empty list, everything is applied through session_connect_args
+        :rtype: list
+        """
+        return []
+
+    def hash_predicate(self, column, num_partitions, partition):
+        """
+        Partitions on HASH, so any column type works. See BaseSQLBridge.hash_predicate.
+        """
+        predicate = f'MOD(ABS(HASH({column})), {num_partitions:d}) = {partition:d}'
+        return f'({predicate} OR {column} IS NULL)' if partition == 0 else predicate
+
+    # Type code of NUMBER, an integer when its scale is 0
+    FIXED_TYPE_CODE = 0
+
+    def integer_columns(self, description):
+        """
+        See BaseSQLBridge.integer_columns.
+        """
+        return [column[0] for column in description if column[1] == self.FIXED_TYPE_CODE and column[5] == 0]
+
+    # Snowflake connector error numbers for failing to reach the service or losing the request on the way
+    TRANSIENT_ERRNOS = [250001, 250003, 251005]
+
+    def classify_driver_error(self, error):
+        """
+        Classifies Snowflake connector errors by their error number.
+
+        :param error: The exception raised by the driver
+        :type error: Exception
+        :return: Returns RetryPolicy.TRANSIENT or RetryPolicy.PERMANENT
+        :rtype: str
+        """
+        if getattr(error, 'errno', None) in self.TRANSIENT_ERRNOS:
+            return RetryPolicy.TRANSIENT
+        return super(SnowflakeBridge, self).classify_driver_error(error)
+
+    def upsert_sql(self, table_name, schema_name, staging_name, columns, key_columns):
+        """
+        Snowflake has no ON CONFLICT, we MERGE instead. See BaseSQLBridge.upsert_sql.
+        """
+        return self.merge_sql(table_name, schema_name, staging_name, columns, key_columns)
 
     @staticmethod
     def default_schema():
@@ -54,36 +123,35 @@ class SnowflakeBridge(BaseSQLBridge):
         """
         return table_name.upper(), schema_name.upper()
 
-    def get_df_interesection(self, df, sql_columns):
+    def intersect_columns(self, df_columns, sql_columns):
         """
-        We need to remove any columns that are in the df but not in the sql_columns. We have to make a function for
-        the snowflake class because the sql columns are returned all caps.
+        We have to make a function for the snowflake class because the sql columns are returned all caps.
 
-        :param df: Dataframe to remove from
-        :type df: pd.DataFrame
+        :param df_columns: Columns of the dataframe
+        :type df_columns: list
         :param sql_columns: List of columns from the sql database that we are adding the df to.
         :type sql_columns: list
-        :return: Return the dataframe with columns removed.
-        :rtype: pd.DataFrame
-        """
-        sql_columns_upper = [x.upper() for x in sql_columns]
-        df_columns = list(df.columns)
-        df_columns_upper = [x.upper() for x in df_columns]
-        bad_columns = list(set(df_columns_upper).difference(set(sql_columns_upper)))
-        bad_indices = []
-        for col in bad_columns:
-            if col in df_columns_upper:
-                bad_indices.append(df_columns.index(col))
-        for idx in bad_indices:
-            df.drop(df_columns[idx], axis=1, inplace=True)
-        return df
+        :return: Returns the dataframe columns that are in the table, in the order of the dataframe
+        :rtype: list
+        """
+        sql_columns_upper = set(x.upper() for x in sql_columns)
+        return [column for column in df_columns if column.upper() in sql_columns_upper]
+
+    # Rows per gzipped file of a bulk load. Snowflake loads the files of one COPY INTO in parallel, so a large load
+    # should be many files of tens of megabytes rather than one big one.
+    STAGE_FILE_ROWS = 500000
+
+    # Format of the files written by bulk_load, as pandas.to_csv writes them
+    STAGE_FILE_FORMAT = "TYPE = CSV, FIELD_DELIMITER = '\\t', FIELD_OPTIONALLY_ENCLOSED_BY = '\"', COMPRESSION = GZIP"
 
     def bulk_load(self, bulk_df, table_name, schema_name, table_state=BaseSQLBridge.TABLE_STATE_UNKNOWN, if_exists='append', **kwargs):
         """
-        Perform a bulk copy into the table.
+        Perform a bulk copy into the table. The rows are written to gzipped CSV files by several threads, the files
+        are uploaded to the stage with one PUT and loaded with one COPY INTO. The local and staged files of every load
+        are named after a unique load id, so concurrent loads into the same table do not touch each other's files.
 
-        :param bulk_df: Dataframe values to copy into the table
-        :type bulk_df: pd.DataFrame
+        :param bulk_df: Dataframe values to copy into the table, an iterator of dataframes or a DataFrameSource
+        :type bulk_df: pd.DataFrame or iterable or DataFrameSource
         :param table_name: Name of the table
         :type table_name: str
         :param schema_name: Name of the schema
@@ -92,52 +160,70 @@ class SnowflakeBridge(BaseSQLBridge):
         :type table_state: int
         :param if_exists: Follows the pandas SQL functions if exists
         :type if_exists: str
-        :param kwargs: Key word arguments if needed for the bulk load
+        :param kwargs: Key word arguments if needed for the bulk load, tmp_dir is where the files are written,
+                       file_rows sets the rows per file and max_workers the threads writing and uploading files
         :type kwargs: dictionary
         """
-        full_csv_name = Path(kwargs['tmp_dir'], table_name + '.csv')
-        self.file_cleanup(full_csv_name=full_csv_name,
-                          table_name=table_name)
-        self._determine_table(bulk_df=bulk_df,
+        source = DataFrameSource.wrap(bulk_df)
+        first_df = source.schema_frame()
+        if first_df is None:
+            return
+        file_rows = kwargs.get('file_rows', self.STAGE_FILE_ROWS)
+        max_workers = kwargs.get('max_workers', os.cpu_count() or 1)
+
+        self._determine_table(bulk_df=first_df,
                               table_name=table_name,
                               schema_name=schema_name,
                               table_state=table_state,
                               if_exists=if_exists)
-        self.save_to_csv(bulk_df=bulk_df,
-                         full_csv_name=full_csv_name)
-        self._push_to_table(table_name=table_name,
-                            schema_name=schema_name,
-                            full_csv_name=full_csv_name)
-        self.file_cleanup(full_csv_name=full_csv_name,
-                          table_name=table_name)
-
-    def _push_to_table(self, table_name, schema_name, full_csv_name):
-        """
-        Writes the CSV file into the user's snowflake staging area and then performs a COPY INTO into the table
-
-        :param table_name: Name of the table
-        :type table_name: str
-        :param schema_name: Name of the schema
-        :type schema_name: str
-        :param full_csv_name: Full path name to the CSV
-        :type full_csv_name: str
-        """
-        self.sql_connection.execute_sql(f"""PUT file://{full_csv_name} @~/tmp/{table_name}.csv;""")
-        # Need to create the table in between, but it will handle everything after we
-        self.sql_connection.execute_sql(f"""COPY INTO {schema_name}.{table_name} 
-                                            FROM '@~/tmp/{table_name}.csv' 
-                                            FILE_FORMAT= (TYPE=CSV, FIELD_DELIMITER = "\t")""")
 
-    def file_cleanup(self, full_csv_name, table_name):
-        """
-        Removes the csv file from the file system and removes the file from the user's staging area
+        load_id = f'{table_name}_{uuid.uuid4().hex}'
+        stage_path = f'tmp/{load_id}'
+        local_dir = tempfile.mkdtemp(prefix=load_id + '_', dir=kwargs.get('tmp_dir'))
+        try:
+            # A load without rows only creates the table, PUT fails when no file matches
+            if self._write_files(source, local_dir, file_rows, max_workers):
+                self.stage.put(os.path.join(local_dir, '*.csv.gz'), stage_path, parallel=max_workers)
+                self.stage.copy_into(table_name, schema_name, list(first_df.columns), stage_path,
+                                     self.STAGE_FILE_FORMAT)
+        finally:
+            shutil.rmtree(local_dir, ignore_errors=True)
+            try:
+                self.stage.remove(stage_path)
+            except Exception:
+                # A failed cleanup must not hide the error of the load, leftover staged files only take space
+                logger.exception(f'We could not remove {self.stage.stage}/{stage_path}/ from the stage')
 
-        :param table_name: Name of the table
-        :type table_name: str
-        :param full_csv_name: Full path name to the CSV
-        :type full_csv_name: str
-        """
-        if os.path.exists(full_csv_name):
-            os.remove(full_csv_name)
-        # We must try and drop the table as well as anything in the staging
-        self.sql_connection.execute_sql(f"""REMOVE @~/tmp/{table_name}.csv""")
+    @staticmethod
+    def _write_files(source, local_dir, file_rows, max_workers):
+        """
+        Writes the rows into gzipped CSV files of at most file_rows rows, max_workers files at a time. Compression
+        runs outside of the GIL, so the threads do overlap.
+
+        :param source: The rows to write
+        :type source: DataFrameSource
+        :param local_dir: Directory the files are written to
+        :type local_dir: str
+        :param file_rows: Largest number of rows per file
+        :type file_rows: int
+        :param max_workers: Number of files written at once
+        :type max_workers: int
+        :return: Returns the number of files written
+        :rtype: int
+        """
+        def write(file_number, chunk_df):
+            chunk_df.to_csv(os.path.join(local_dir, f'part_{file_number:05d}.csv.gz'), sep='\t', header=False,
+                            index=False, compression='gzip')
+
+        file_count = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # We hold at most max_workers chunks, an iterator source is not read ahead of the writers
+            pending = deque()
+            for chunk_df in source.iter_chunks(file_rows):
+                pending.append(executor.submit(write, file_count, chunk_df))
+                file_count += 1
+                if len(pending) >= max_workers:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+        return file_count
@@ -0,0 +1,61 @@
+class SnowflakeStage(object):
+    """
+    The Snowflake stage bulk loads upload their files to before COPY INTO reads them, by default the user's stage @~.
+    SnowflakeBridge.bulk_load makes every call on the stage through this class, so a test can stand a local directory
+    in for the stage by overriding put, copy_into and remove.
+    """
+
+    # PUT takes PARALLEL from 1 to 99
+    MAX_PARALLEL = 99
+
+    def __init__(self, sql_conn, stage='@~'):
+        """
+        :param sql_conn: A SQLConnection to Snowflake
+        :type sql_conn: SQLConn
+        :param stage: The stage to upload to, e.g. @~ or @my_schema.my_stage
+        :type stage: str
+        """
+        self.sql_connection = sql_conn
+        self.stage = stage
+
+    def put(self, local_pattern, stage_path, parallel):
+        """
+        Uploads the already gzipped local files into a directory of the stage.
+
+        :param local_pattern: Path of the local files, may use * and ? wildcards
+        :type local_pattern: str
+        :param stage_path: Directory of the stage the files go to
+        :type stage_path: str
+        :param parallel: Number of threads uploading the files, clamped to the 1 to 99 PUT accepts
+        :type parallel: int
+        """
+        parallel = min(max(parallel, 1), self.MAX_PARALLEL)
+        self.sql_connection.execute_sql(f"PUT 'file://{local_pattern}' {self.stage}/{stage_path}/ "
+                                        f"PARALLEL = {parallel:d} AUTO_COMPRESS = FALSE SOURCE_COMPRESSION = GZIP")
+
+    def copy_into(self, table_name, schema_name, columns, stage_path, file_format):
+        """
+        Loads every file of a directory of the stage into the table with one COPY INTO.
+
+        :param table_name: Name of the table
+        :type table_name: str
+        :param schema_name: Name of the schema
+        :type schema_name: str
+        :param columns: The table columns the fields of the files go to, in order
+        :type columns: list
+        :param stage_path: Directory of the stage holding the files
+        :type stage_path: str
+        :param file_format: The FILE_FORMAT options of the files
+        :type file_format: str
+        """
+        self.sql_connection.execute_sql(f"COPY INTO {schema_name}.{table_name} ({', '.join(columns)}) "
+                                        f"FROM {self.stage}/{stage_path}/ FILE_FORMAT = ({file_format})")
+
+    def remove(self, stage_path):
+        """
+        Removes a directory of the stage and the files in it.
+
+        :param stage_path: Directory of the stage
+        :type stage_path: str
+        """
+        self.sql_connection.execute_sql(f"REMOVE {self.stage}/{stage_path}/")
@@ -0,0 +1,111 @@
+"""
+Loads the SQL parameters from our connconfig.json files. Nothing is read until the first nickname lookup, so importing
+the package stays cheap for code that never connects.
+"""
+import json
+import threading
+from pathlib import Path
+
+
+# We load the connection parameters from a json file to keep passwords hidden.
+# First set the search locations in order of priority (first is best).
+VALID_LOCATIONS = {1: Path('/data', 'code', 'config', 'connconfig.json'),
+                   2: Path(Path.home(), 'code', 'config', 'connconfig.json'),
+                   3: Path(Path(__file__).resolve().parent, 'connconfig.json')}
+
+VALID_POOL_KEYS = ['pool_size', 'max_overflow', 'pre_ping', 'recycle', 'timeout', 'prewarm']
+VALID_CACHE_KEYS = ['max_bytes', 'default_ttl', 'table_ttls', 'spill_dir']
+
+_load_lock = threading.Lock()
+_loaded = None
+
+
+def load_config():
+    """
+    Reads and merges the connconfig.json files the first time it is called and returns the cached result afterwards.
+
+    :return: Returns the credentials by SQL type and the connection parameters by sql nickname
+    :rtype: dict, dict
+    """
+    global _loaded
+    with _load_lock:
+        if _loaded is None:
+            _loaded = _read_config()
+        return _loaded
+
+
+def _read_config():
+    """
+    :return: Returns the credentials by SQL type and the connection parameters by sql nickname
+    :rtype: dict, dict
+    """
+    # Loop through and load config files.
+    found_configs = {}
+    for key_ in VALID_LOCATIONS:
+        try:
+            with open(VALID_LOCATIONS[key_]) as fh:
+                found_configs[key_] = json.load(fh)
+        except:
+            pass
+
+    # Break if none found.
+    if len(found_configs.keys()) == 0:
+        raise RuntimeError('Not able to find the connconfig.json file for SQLConn')
+
+    MASTER_CREDS = {}
+    # Want to push credentials down from highest priority (lowest key value) file to lower levels. Sorted call for
+    # clarity.
+    for key_ in sorted(found_configs.keys()):
+        config = found_configs[key_]
+        if 'credentials' in config.keys():
+            for type_ in config['credentials']:
+                if type_ not in MASTER_CREDS.keys():
+                    uname_ = config['credentials'][type_]['username']
+                    pword_ = config['credentials'][type_]['password']
+
+                    if uname_ and pword_:
+                        MASTER_CREDS[type_] = {'username': uname_, 'password': pword_}
+
+    if len(MASTER_CREDS.keys()) == 0:
+        raise RuntimeError('No config file has valid credentials')
+    # Append overlap from highest priority (lowest key value) first.  Sorted call for clarity.
+    SQL_PARAMS = {}
+    for key_ in sorted(found_configs.keys()):
+        # We depend upon having a section of json at the outer level called databases
+        config = found_configs[key_]
+        if 'databases' in config.keys():
+            dbs = config['databases']
+            for db in dbs:
+                if db not in SQL_PARAMS:
+                    SQL_PARAMS[db] = dbs[db]
+                    # Now we have to check to make sure the username and password are present, if either one is not
+                    # present then we will replace both. If we get here, we depend upon there being a section titled
+                    # credentials in the outermost level of json. The keys in within credentials should be the same as
+                    # the type present in the database descriptor.
+                    if 'username' not in SQL_PARAMS[db].keys() or 'password' not in SQL_PARAMS[db].keys():
+                        SQL_PARAMS[db]['username'] = MASTER_CREDS[SQL_PARAMS[db]['type']]['username']
+                        SQL_PARAMS[db]['password'] = MASTER_CREDS[SQL_PARAMS[db]['type']]['password']
+                        if SQL_PARAMS[db]['username'] is None or SQL_PARAMS[db]['password'] is None:
+                            raise ConnectionError(f"The SQL connections do not have proper credentials, please copy "
+                                                  f"the file from "
+                                                  f"{Path(Path(__file__).resolve().parent, 'connconfig.json')}\n"
+                                                  f"and place the file at /data/code/config/connconfig.json (Linux) "
+                                                  f"or C:\\data\\code\\config\\connconfig.json (Windows). Then "
+                                                  f"update the\ncredentials section of the file to include the correct "
+                                                  f"username/password combinations. If the file is already there, "
+                                                  f"then just update the\ncredentials and make sure nothings is null. "
+                                                  f"Have a great day.")
+
+    # The optional pool, session and cache blocks tune the connections of a nickname. Check them here so that a typo
+    # fails loudly instead of silently leaving the defaults in place.
+    for db in SQL_PARAMS:
+        for key_ in SQL_PARAMS[db].get('pool', {}):
+            if key_ not in VALID_POOL_KEYS:
+                raise KeyError(f"'{key_}' in the pool settings of {db} is not one of {VALID_POOL_KEYS}")
+        if not isinstance(SQL_PARAMS[db].get('session', {}), dict):
+            raise TypeError(f'The session settings of {db} must be a json object')
+        for key_ in SQL_PARAMS[db].get('cache', {}):
+            if key_ not in VALID_CACHE_KEYS:
+                raise KeyError(f"'{key_}' in the cache settings of {db} is not one of {VALID_CACHE_KEYS}")
+
+    return MASTER_CREDS, SQL_PARAMS
@@ -1,21 +1,33 @@
 import pandas as pd  # We use pandas SQL functions to retrieve our table queries as pandas dataframes
-import pytds.login  # provided because SQL Servers need an authentication method (ntlm)
 import sqlalchemy  # the underlying SQL connections are managed by SQLAlchemy
+import importlib
+import numbers
 import os
-from contextlib import contextmanager
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 
 from sqlconn.sqlparams import SQLParams
-from sqlconn.mssqlbridge import MsSQLBridge
-from sqlconn.mssqlnoauthbridge import MsSQLNoauthBridge
-from sqlconn.postgresbridge import PostgresBridge
-from sqlconn.snowflakebridge import SnowflakeBridge
-from sqlconn.sqllitebridge import SQLLiteBridge
+from sqlconn.engineregistry import EngineRegistry
+from sqlconn.retrypolicy import RetryPolicy
 from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.dataframesource import DataFrameSource
+from sqlconn.parallelload import ParallelLoad
+from sqlconn.querycache import QueryCache
+from sqlconn.metadatacache import MetadataCache
+from sqlconn import sqltext
+from sqlconn import dfcompact
 
 
 class SQLConn(object):
     """
     Provides an interface to a SQL database, hiding the type of server (hopefully).
+
+    A SQLConn is safe to share between threads. Every call checks its own connection out of the shared pool, and the
+    engine, retry policy and bridge are safe for concurrent use, so a thread pool needs only one SQLConn. Connections
+    taken directly from get_engine().connect() must still stay within the thread that opened them.
     """
 
     # Constants for the different type of SQL databases we currently support.
@@ -25,21 +37,48 @@ class SQLConn(object):
     SQLITE = 'sqlite'
     SNOWFLAKE = 'snowflake'
 
+    # The bridge module and class for each SQL type. Bridges, and the database drivers they pull in, are only imported
+    # once a connection of that type is made.
+    BRIDGES = {MSSQL: ('sqlconn.mssqlbridge', 'MsSQLBridge'),
+               MSSQLNOAUTH: ('sqlconn.mssqlnoauthbridge', 'MsSQLNoauthBridge'),
+               POSTGRES: ('sqlconn.postgresbridge', 'PostgresBridge'),
+               SQLITE: ('sqlconn.sqllitebridge', 'SQLLiteBridge'),
+               SNOWFLAKE: ('sqlconn.snowflakebridge', 'SnowflakeBridge')}
+
+    # Rows per dataframe yielded by iter_dataframes unless the caller asks otherwise.
+    DEFAULT_CHUNK_ROWS = 50000
+
     BULK_FORCE = 0
     BULK_OFF = 1
     BULK_CHANCE = 2
 
-    def __init__(self, _sql_params):
+    # Key word arguments of append_to_table that only the bridges' bulk loads take, pandas.to_sql does not know them
+    BULK_LOAD_KWARGS = ['tmp_dir', 'file_rows', 'max_workers', 'batch_rows', 'chunk_rows', 'format', 'fast_pragmas']
+
+    def __init__(self, _sql_params, retry_policy=None):
         """
-        Use the SQL parameters to create our SQL Alchemy engine. An object of the class is not intended to be shared
-        by multiple threads as the SQLAlchemy engine is not thread-safe
+        Use the SQL parameters to obtain our SQL Alchemy engine. Engines are shared through the EngineRegistry, so
+        every SQLConn pointing at the same database target uses the same connection pool. The object may be created
+        before forking worker processes, each process transparently gets its own pool, and it may be shared by any
+        number of threads.
 
         :param _sql_params: An SQLParams object that contains the necessary information to connect to any of our
                             database types.
+        :param retry_policy: Decides which failed calls are retried. Defaults to the policy shared by the database
+                             target, built from the retry block of the nickname in connconfig.json.
+        :type retry_policy: RetryPolicy
         """
         self.sql_params = _sql_params
+        self._close_lock = threading.Lock()
         self.sql_bridge = self.bridge_factory(self.sql_params.type)
-        self.sql_engine = self.sql_bridge.get_engine(_sql_params)
+        self._engine_key = self.sql_params.engine_key()
+        self.sql_engine = EngineRegistry.acquire(self._engine_key,
+                                                 lambda: self.sql_bridge.get_engine(self.sql_params))
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy.for_params(self.sql_params)
+        self.metadata_cache = MetadataCache.for_params(self.sql_params)
+        # Results are only cached when the nickname has a cache block, or a QueryCache is assigned here.
+        cache_config = self.sql_params.options.get('cache')
+        self.query_cache = QueryCache.shared(cache_config) if cache_config is not None else None
 
     @classmethod
     def get_connection(cls, sql_nickname):
@@ -63,11 +102,56 @@ class SQLConn(object):
         :return: A SQLConn object
         :rtype: SQLConn
         """
-        conn = SQLConn.get_connection(sql_nickname)
-        params = conn.sql_params
+        params = SQLParams.from_json(sql_nickname=sql_nickname)
         params.database = database_name
         params.diff_database = True
-        return SQLConn(params)
+        return cls(params)
+
+    def close(self):
+        """
+        Releases this object's reference to the shared engine. The engine (and its pool) is disposed once every
+        SQLConn using it has been closed. The object cannot be used after it is closed.
+        """
+        with self._close_lock:
+            if self.sql_engine is None:
+                return
+            engine, self.sql_engine = self.sql_engine, None
+        EngineRegistry.release(self._engine_key, engine)
+
+    @staticmethod
+    def close_all():
+        """
+        Disposes every shared engine in the process. SQLConn objects created afterwards will build new engines.
+        """
+        EngineRegistry.dispose_all()
+
+    def prewarm(self, n=None):
+        """
+        Opens connections up front and hands them back to the pool, so the first queries of a worker do not pay the
+        connect latency.
+
+        :param n: Number of connections to open. Defaults to the prewarm (or else pool_size) value of the nickname's
+                  pool settings, and to 1 if neither is set.
+        :type n: int
+        :return: Returns the number of connections that were opened
+        :rtype: int
+        """
+        if n is None:
+            pool = self.sql_params.options.get('pool', {})
+            n = pool.get('prewarm', pool.get('pool_size', 1))
+        # Connections beyond the pool size are closed as soon as they are returned, so there is no point opening them.
+        if callable(getattr(self.sql_engine.pool, 'size', None)):
+            n = min(n, self.sql_engine.pool.size())
+        with ExitStack() as stack:
+            for _ in range(n):
+                stack.enter_context(self.sql_engine.connect())
+        return n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @staticmethod
     def get_sql_nicknames():
@@ -79,41 +163,404 @@ class SQLConn(object):
     def get_nickname(self):
         return self.sql_params.get_nickname()
 
-    def get_dataframe(self, sql, **kwargs):
+    def get_dataframe(self, sql, fast=False, cache_ttl=None, compact=None, params=None, **kwargs):
         """
         Simply execute the provided sql and return a dataframe with the results
 
         :param sql: The sql query that needs to be executed that should include a select statement
+        :param fast: Read through the bridge's bulk path (COPY TO STDOUT on Postgres), worth it for large results.
+                     Only used when no read_sql key word arguments are passed.
+        :param cache_ttl: Seconds the result may be served from the query cache, if the connection has one. None
+                          falls back to the table and default time to live of the cache, 0 bypasses the cache.
+        :param compact: Narrow the numeric columns and turn text columns with few distinct values into categoricals,
+                        chunk by chunk as rows are fetched, see dfcompact. None uses the "compact" setting of the
+                        nickname, which defaults to False.
+        :param params: Values of the bound parameters in the sql, written as :name. Postgres runs statements with
+                       parameters as prepared statements, planned once per pooled connection.
+        :type params: dict
+        :param kwargs: Key word arguments for pandas.read_sql. Passing chunksize returns iter_dataframes instead, and
+                       dtype_backend='pyarrow' builds the dataframe from get_arrow_table.
         :return: Returns the results of the sql query as a pandas dataframe
         """
         assert 'select'.upper() in sql.upper()
-        df = pd.DataFrame()
+        if compact is None:
+            compact = self.sql_params.options.get('compact', False)
+        if kwargs.get('chunksize'):
+            return self.iter_dataframes(sql, chunk_rows=kwargs.pop('chunksize'), compact=compact, params=params,
+                                        **kwargs)
+        if self.query_cache is not None:
+            ttl = self.query_cache.ttl_for(sql, cache_ttl)
+            if ttl:
+                key = self.query_cache.make_key(self._engine_key, sql,
+                                                dict(kwargs, fast=fast, compact=compact, params=params))
+                return self.query_cache.get_or_read(key, sql, ttl,
+                                                    lambda: self._read_dataframe(sql, fast, compact, params, **kwargs))
+        return self._read_dataframe(sql, fast, compact, params, **kwargs)
+
+    def _read_dataframe(self, sql, fast, compact, params, **kwargs):
+        """
+        Reads the results of the sql query, see get_dataframe.
+        """
+        if fast and not kwargs and params is None:
+            df = self.sql_bridge.bulk_read(sql)
+            return dfcompact.compact_dataframe(df) if compact else df
+        if kwargs.get('dtype_backend') == 'pyarrow':
+            # Arrow backed columns wrap the arrow buffers, so no copy is made converting the table.
+            return self.get_arrow_table(sql, params=params).to_pandas(types_mapper=pd.ArrowDtype)
+        if compact:
+            def read_compact(connection):
+                connection = connection.execution_options(**self.sql_bridge.stream_options(self.DEFAULT_CHUNK_ROWS))
+                return dfcompact.concat_compact(self._read_compact(connection, sql, params, self.DEFAULT_CHUNK_ROWS,
+                                                                   **kwargs))
+            return self._run(read_compact)
+        return self._run(lambda connection: self._read_sql(connection, sql, params, **kwargs))
+
+    def _read_sql(self, connection, sql, params, prepared=True, **kwargs):
+        """
+        Runs pandas.read_sql on the connection, binding the parameters through the bridge when there are any.
+        """
+        if params is None:
+            return pd.read_sql(sql, connection, **kwargs)
+        statement, params = self.sql_bridge.bind_statement(connection, sql, params, prepared=prepared)
+        return pd.read_sql(statement, connection, params=params, **kwargs)
+
+    def _read_compact(self, connection, sql, params, chunk_rows, **kwargs):
+        """
+        Yields the results of the sql query in compacted chunks, see dfcompact. The integer columns are taken from the
+        cursor description, so integer columns holding nulls become nullable integers while real floats stay floats.
+        With read_sql key word arguments the chunks come from pandas.read_sql, which hides the cursor, and no column is
+        treated as an integer.
+        """
+        if kwargs:
+            for chunk_df in self._read_sql(connection, sql, params, prepared=False, chunksize=chunk_rows, **kwargs):
+                yield dfcompact.compact_dataframe(chunk_df)
+            return
+        result = connection.execute(sql) if params is None else \
+            connection.execute(*self.sql_bridge.bind_statement(connection, sql, params, prepared=False))
+        integer_columns = self.sql_bridge.integer_columns(result.cursor.description)
+        columns = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunk_rows)
+            if not rows:
+                break
+            chunk_df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            yield dfcompact.compact_dataframe(chunk_df, integer_columns=integer_columns)
+
+    def _execute(self, connection, sql, params=None):
+        """
+        Executes the sql on the connection, binding the parameters through the bridge when there are any.
+        """
+        if params is None:
+            return connection.execute(sql)
+        return connection.execute(*self.sql_bridge.bind_statement(connection, sql, params))
+
+    def get_arrow_table(self, sql, batch_rows=DEFAULT_CHUNK_ROWS, params=None):
+        """
+        Execute the provided sql and return the results as a pyarrow Table. Postgres queries without bound parameters
+        are read through the bridge's columnar path (COPY TO STDOUT parsed by pyarrow's CSV reader), which builds no
+        Python objects per row.
+
+        Otherwise the rows are fetched from a streaming cursor in batches and each batch is transposed into arrow
+        arrays. The driver still builds a Python object per row and per value, so this is not much faster than
+        pandas.read_sql. What it saves is the pandas object columns, and the memory to hold the whole result in them.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :param batch_rows: Number of rows fetched and converted at a time
+        :type batch_rows: int
+        :param params: Values of the bound parameters in the sql, written as :name
+        :type params: dict
+        :return: Returns the results of the sql query
+        :rtype: pyarrow.Table
+        """
+        assert 'select'.upper() in sql.upper()
         try:
-            with self.sql_engine.connect() as connection:
-                df = pd.read_sql(sql, connection, **kwargs)
-        except Exception as e:
-            # We treat the exceptions we see as connection errors and the best way we know to handle them is by
-            # resetting the pool of connections for the engine.
-            self.sql_engine.dispose()
-            with self.sql_engine.connect() as connection:
-                df = pd.read_sql(sql, connection, **kwargs)
-        return df
-
-    def execute_sql(self, sql):
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError('SQLConn.get_arrow_table needs the pyarrow package to be installed')
+        if params is None:
+            table = self.sql_bridge.bulk_read_arrow(sql)
+            if table is not None:
+                return table
+
+        def read(connection):
+            connection = connection.execution_options(**self.sql_bridge.stream_options(batch_rows))
+            result = connection.execute(sql) if params is None else \
+                connection.execute(*self.sql_bridge.bind_statement(connection, sql, params, prepared=False))
+            columns = list(result.keys())
+            tables = []
+            while True:
+                rows = result.fetchmany(batch_rows)
+                if not rows:
+                    break
+                tables.append(pa.Table.from_arrays([pa.array(values, from_pandas=True) for values in zip(*rows)],
+                                                   names=columns))
+            if not tables:
+                return pa.table({column: pa.array([]) for column in columns})
+            # A batch holding only nulls, or decimals of a different precision, gets its own type. Promote the
+            # batches to a common schema before stitching them together.
+            try:
+                return pa.concat_tables(tables, promote_options='permissive')
+            except TypeError:
+                return pa.concat_tables(tables, promote=True)
+        return self._run(read)
+
+    def iter_dataframes(self, sql, chunk_rows=DEFAULT_CHUNK_ROWS, compact=False, params=None, **kwargs):
+        """
+        Execute the provided sql and yield the results in dataframes of at most chunk_rows rows. The query runs on a
+        server-side cursor where the driver supports one (a named cursor on Postgres, the unbuffered TDS stream on SQL
+        Server), so peak memory is proportional to the chunk rather than to the result.
+
+        The connection stays checked out until the iterator is exhausted or closed. Failures are not retried, as part
+        of the result may already have been consumed.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :type sql: str
+        :param chunk_rows: Number of rows per dataframe
+        :type chunk_rows: int
+        :param compact: Narrow the dtypes of every chunk, see dfcompact. Chunks may then differ in dtype.
+        :type compact: bool
+        :param params: Values of the bound parameters in the sql, written as :name
+        :type params: dict
+        :param kwargs: Key word arguments for pandas.read_sql
+        :type kwargs: dictionary
+        :return: Yields the results of the sql query as pandas dataframes
+        :rtype: generator
+        """
+        assert 'select'.upper() in sql.upper()
+        with self.sql_engine.connect() as connection:
+            connection = connection.execution_options(**self.sql_bridge.stream_options(chunk_rows))
+            if compact:
+                yield from self._read_compact(connection, sql, params, chunk_rows, **kwargs)
+                return
+            yield from self._read_sql(connection, sql, params, prepared=False, chunksize=chunk_rows, **kwargs)
+
+    def map_dataframes(self, sqls, max_workers=None, **kwargs):
+        """
+        Runs independent queries concurrently over the shared pool and returns their results in the order given.
+
+        :param sqls: The sql queries, each should include a select statement
+        :type sqls: list
+        :param max_workers: Number of queries in flight at once. Defaults to the pool size, more threads than pooled
+                            connections would only wait on the pool.
+        :type max_workers: int
+        :param kwargs: Key word arguments passed on to get_dataframe for every query
+        :type kwargs: dictionary
+        :return: Returns one dataframe per query
+        :rtype: list
+        """
+        sqls = list(sqls)
+        if not sqls:
+            return []
+        if max_workers is None:
+            max_workers = self._pool_size()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(sqls))) as executor:
+            return list(executor.map(lambda sql: self.get_dataframe(sql, **kwargs), sqls))
+
+    def get_dataframe_partitioned(self, sql, partition_column, num_partitions=None, bounds=None, method='range',
+                                  max_workers=None, stream=False, **kwargs):
+        """
+        Splits the query into partitions on a column and reads them concurrently over the shared pool, so a large
+        extract uses several connections (and server backends) instead of one. Each partition runs as
+        SELECT * FROM (sql) sq_part WHERE <predicate>, so the database must be able to push the predicate down (e.g. to
+        an index on the column) for this to be faster than get_dataframe.
+
+        :param sql: The sql query that needs to be executed that should include a select statement
+        :param partition_column: The column of the query results to partition on
+        :type partition_column: str
+        :param num_partitions: Number of partitions. Defaults to the pool size.
+        :type num_partitions: int
+        :param bounds: The (lower, upper) values of the column the range partitions are spread over. Rows outside them
+                       still go to the first and last partition. Read with MIN and MAX when not passed.
+        :type bounds: tuple
+        :param method: 'range' splits numeric or date columns into equal ranges, 'hash' splits on a hash of the
+                       column, which spreads skewed columns evenly.
+        :type method: str
+        :param max_workers: Number of partitions read at once. Defaults to the pool size.
+        :type max_workers: int
+        :param stream: Return a generator of the partition dataframes, in partition order, instead of concatenating
+                       them. At most max_workers partitions are held at a time.
+        :type stream: bool
+        :param kwargs: Key word arguments passed on to get_dataframe for every partition
+        :type kwargs: dictionary
+        :return: Returns the results of the sql query as a pandas dataframe, or a generator of dataframes if stream
+        """
+        assert 'select'.upper() in sql.upper()
+        if num_partitions is None:
+            num_partitions = self._pool_size()
+        if method == 'range':
+            if bounds is None:
+                bounds_df = self.get_dataframe(f'SELECT MIN({partition_column}) AS lower_bound, '
+                                               f'MAX({partition_column}) AS upper_bound FROM ({sql}) sq_part',
+                                               cache_ttl=0, params=kwargs.get('params'))
+                bounds = (bounds_df.iloc[0, 0], bounds_df.iloc[0, 1])
+            predicates = self._range_predicates(partition_column, num_partitions, *bounds)
+        elif method == 'hash':
+            predicates = [self.sql_bridge.hash_predicate(partition_column, num_partitions, partition)
+                          for partition in range(num_partitions)]
+        else:
+            raise KeyError(f"We do not support the {method} partition method, use 'range' or 'hash'")
+
+        sqls = [f'SELECT * FROM ({sql}) sq_part WHERE {predicate}' for predicate in predicates]
+        if max_workers is None:
+            max_workers = self._pool_size()
+        if stream:
+            return self._iter_partitions(sqls, max_workers, **kwargs)
+        # Compacted partitions may have different categories, concat_compact combines them
+        return dfcompact.concat_compact(self.map_dataframes(sqls, max_workers=max_workers, **kwargs))
+
+    def _iter_partitions(self, sqls, max_workers, **kwargs):
+        """
+        Reads the queries concurrently and yields their results in order, keeping at most max_workers in flight.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sqls)))) as executor:
+            pending = deque()
+            for sql in sqls:
+                pending.append(executor.submit(self.get_dataframe, sql, **kwargs))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def _range_predicates(column, num_partitions, lower, upper):
+        """
+        :return: Returns the where clauses splitting the column into num_partitions equal ranges between lower and
+                 upper. The first also takes the nulls and the values below lower, the last the values above upper.
+        :rtype: list
+        """
+        if lower is None or upper is None or pd.isnull(lower) or pd.isnull(upper):
+            # We have nothing to split, every row has a null in the column
+            return ['1 = 1']
+        if isinstance(lower, str) or isinstance(upper, str):
+            raise TypeError(f'We can only range partition numeric or date columns, use hash for {column}')
+
+        if isinstance(lower, numbers.Integral) and isinstance(upper, numbers.Integral):
+            points = [int(lower) + (int(upper) - int(lower)) * partition // num_partitions
+                      for partition in range(1, num_partitions)]
+        else:
+            points = [lower + (upper - lower) * partition / num_partitions for partition in range(1, num_partitions)]
+        # Narrow integer ranges give the same split point more than once
+        points = sorted(set(points))
+        if not points:
+            return ['1 = 1']
+
+        literals = [str(point) if isinstance(point, numbers.Number) else f"'{point}'" for point in points]
+        predicates = [f'({column} < {literals[0]} OR {column} IS NULL)']
+        predicates += [f'{column} >= {low} AND {column} < {high}' for low, high in zip(literals, literals[1:])]
+        predicates.append(f'{column} >= {literals[-1]}')
+        return predicates
+
+    def _pool_size(self):
+        """
+        :return: Returns the number of connections the pool keeps, 1 for pools without a fixed size
+        :rtype: int
+        """
+        return self.sql_engine.pool.size() if callable(getattr(self.sql_engine.pool, 'size', None)) else 1
+
+    def execute_sql(self, sql, params=None):
         """
         Simply execute the query
 
         :param sql: The sql query that needs to be executed
+        :param params: Values of the bound parameters in the sql, written as :name. Postgres runs statements with
+                       parameters as prepared statements, planned once per pooled connection.
+        :type params: dict
         """
-        try:
-            with self.sql_engine.connect() as connection:
-                connection.execute(sql)
-        except Exception as e:
-            # We treat the exceptions we see as connection errors and the best way we know to handle them is by
-            # resetting the pool of connections for the engine.
-            self.sql_engine.dispose()
-            with self.sql_engine.connect() as connection:
-                connection.execute(sql)
+        self._run(lambda connection: self._execute(connection, sql, params))
+        self._invalidate_written([sql])
+
+    def execute_many(self, sql, param_rows):
+        """
+        Executes one statement for every set of bound parameters, on one connection and in one transaction, using
+        the driver's batch path (execute_batch on Postgres, executemany elsewhere). Much faster than calling
+        execute_sql once per set, which pays a checkout, a round trip and a commit each time.
+
+        :param sql: The sql query that needs to be executed, with bound parameters written as :name
+        :type sql: str
+        :param param_rows: Values of the bound parameters by name, one dictionary per execution
+        :type param_rows: list
+        """
+        param_rows = list(param_rows)
+        if not param_rows:
+            return
+
+        def execute(connection):
+            with self.sql_bridge.transaction(connection):
+                self.sql_bridge.execute_many(connection, sql, param_rows)
+        self._run(execute)
+        self._invalidate_written([sql])
+
+    def execute_batch(self, sqls):
+        """
+        Executes the queries in order on one connection and in one transaction. Either all of them are committed or,
+        if one fails, none of them are.
+
+        :param sqls: The sql queries that need to be executed
+        :type sqls: list
+        """
+        sqls = list(sqls)
+        if not sqls:
+            return
+
+        def execute(connection):
+            with self.sql_bridge.transaction(connection):
+                for sql in sqls:
+                    connection.execute(sql)
+        self._run(execute)
+        self._invalidate_written(sqls)
+
+    def _invalidate_written(self, sqls):
+        """
+        Drops the cached results reading from the tables the statements wrote to, and the cached metadata of the
+        tables they dropped, created or altered.
+        """
+        for sql in sqls:
+            tables = sqltext.written_tables(sql)
+            if self.query_cache is not None:
+                self.query_cache.invalidate_tables(tables)
+            if sqltext.is_ddl(sql):
+                for table in tables:
+                    self.metadata_cache.invalidate(table)
+
+    def invalidate_metadata(self, table=None, schema=None):
+        """
+        Forgets the cached columns of a table, e.g. after it was changed by another process or outside of SQLConn.
+        DDL run through execute_sql and the bulk loads is picked up without calling this.
+
+        :param table: Name of the table. Could include schema could not include schema. None forgets every table.
+        :type table: str
+        :param schema: Name of the schema. None forgets the table in every schema.
+        :type schema: str
+        """
+        if table is not None and '.' in table:
+            table, schema = self.get_names(table=table, schema=schema)
+        self.metadata_cache.invalidate(table, schema)
+
+    def _run(self, operation):
+        """
+        Runs the operation on a pooled connection, retrying failures the retry policy classifies as transient or as
+        deadlocks.
+
+        :param operation: Callable taking a sqlalchemy connection
+        :type operation: callable
+        :return: Returns whatever the operation returns
+        """
+        return self.retry_policy.run(self.sql_engine, operation, self.sql_bridge.classify_error)
+
+    def cache_stats(self):
+        """
+        :return: Returns the counters of the query cache, see QueryCache.stats. Empty if results are not cached.
+        :rtype: dict
+        """
+        return self.query_cache.stats() if self.query_cache is not None else {}
+
+    def retry_stats(self):
+        """
+        :return: Returns the retry counters of the retry policy, see RetryPolicy.stats
+        :rtype: dict
+        """
+        return self.retry_policy.stats()
 
     def get_engine(self):
         """
@@ -124,25 +571,47 @@ class SQLConn(object):
         return self.sql_engine
 
     def append_to_table(self, table_name, data_to_append, if_exists='append', schema=None, bulk_copy=BULK_CHANCE,
-                        chance_min_length=100, **kwargs):
+                        chance_min_length=100, constants=None, parallelism=None, key_columns=None, **kwargs):
         """
         Attempts to append the provided dataframe to the provided sql table name. The method will first remove any
         columns in the dataframe that are not available in the table. NOTE: THIS ONLY WORKS FOR POSTGRESQL AT THE
         MOMENT!!!!
 
+        The dataframe is never changed or copied as a whole. Dropped columns and constants are applied to one chunk
+        of rows at a time as the rows are written.
+
         :param table_name: The name of the sql table to append the dataframe.
-        :param data_to_append: Either a dataframe or pandas series object.
+        :param data_to_append: Either a dataframe or pandas series object. An iterator of dataframes with the same
+                               columns is streamed through the bulk load, without falling back to to_sql.
         :param if_exists: Provides an option to override the to_sql parameter for how we treat a possible existing table
+                          or 'upsert', which bulk loads the rows into a staging table and then updates the rows of the
+                          table with the same key_columns and inserts the others, in one statement.
         :param schema: Provides option to override the to_sql schema parameter.
         :param bulk_copy: We allow three different options here, either force, off, or chance. The chance option will
                           do a bulk copy if the length of the dataframe passed is > 100.
         :param chance_min_length: If someone sends bulk chance, then we will try to bulk load the table to the
                                   database if the length of the dataframe is greater than this value.
+        :param constants: Columns added to every row, by name, e.g. a load id or status. Cheaper than adding them to
+                          the dataframe first.
+        :type constants: dict
+        :param parallelism: Number of bulk loads run at once over separate pooled connections, each loading a
+                            partition of the rows in a transaction of its own. The table is created or replaced once
+                            beforehand. Ignored unless the load is bulk and the bridge supports parallel loads.
+        :type parallelism: int
+        :param key_columns: The columns identifying a row for if_exists='upsert'. Postgres and SQLite need a primary
+                            key or unique index on exactly these columns. Every key may only appear once in the data.
+        :type key_columns: list
+        :return: With parallelism, returns the rows loaded, the seconds taken, the rows_per_second and the rows and
+                 seconds of each of the partitions. Raises a BulkLoadError with the error of every failed partition,
+                 the other partitions stay loaded.
+        :rtype: dict
         """
         if type(data_to_append) == pd.Series:
-            temp_df = pd.DataFrame(data_to_append).transpose()
-        else:
-            temp_df = data_to_append.copy(deep=True)
+            data_to_append = pd.DataFrame(data_to_append).transpose()
+        source = DataFrameSource(data_to_append, constants=constants)
+        first_df = source.first()
+        if first_df is None:
+            return
 
         table_name, schema_name = self.get_names(table=table_name,
                                                  schema=schema)
@@ -150,32 +619,113 @@ class SQLConn(object):
                                                        schema_name=schema_name)
 
         if sql_columns_list:
-            temp_df = self.sql_bridge.get_df_interesection(temp_df, sql_columns_list)
+            source.constants = {column: source.constants[column] for column in
+                                self.sql_bridge.intersect_columns(list(source.constants), sql_columns_list)}
+            source.columns = self.sql_bridge.intersect_columns([column for column in first_df.columns
+                                                                if column not in source.constants], sql_columns_list)
             table_state = BaseSQLBridge.TABLE_STATE_EXISTS
         else:
             table_state = BaseSQLBridge.TABLE_STATE_NO_EXISTS
 
-        if bulk_copy == SQLConn.BULK_CHANCE and len(temp_df) > chance_min_length:
+        if if_exists == 'upsert':
+            if not key_columns:
+                raise KeyError(f'We need the key_columns to upsert into {schema_name}.{table_name}')
+            if table_state == BaseSQLBridge.TABLE_STATE_EXISTS:
+                return self._upsert(source, table_name, schema_name, key_columns, parallelism, **kwargs)
+            # Every row is new to a table that does not exist yet
+            if_exists = 'append'
+
+        if source.is_iterator():
+            # We cannot count the rows of an iterator up front, or walk it a second time for a fallback
+            if bulk_copy == SQLConn.BULK_CHANCE:
+                bulk_copy = SQLConn.BULK_FORCE
+        elif bulk_copy == SQLConn.BULK_CHANCE and len(data_to_append) > chance_min_length:
             bulk_copy = SQLConn.BULK_FORCE
+        if bulk_copy == SQLConn.BULK_FORCE and parallelism and parallelism > 1 and \
+                self.sql_bridge.SUPPORTS_PARALLEL_LOAD:
+            # Partitions that already committed cannot be loaded again by to_sql, so there is no fallback
+            try:
+                return ParallelLoad(self.sql_bridge, table_name, schema_name, parallelism,
+                                    **kwargs).run(source, table_state, if_exists)
+            finally:
+                if self.query_cache is not None:
+                    self.query_cache.invalidate_tables([table_name])
+
         try:
             if bulk_copy == SQLConn.BULK_FORCE:
-                self.sql_bridge.bulk_load(bulk_df=temp_df,
+                self.sql_bridge.bulk_load(bulk_df=source,
                                           table_name=table_name,
                                           schema_name=schema_name,
                                           table_state=table_state,
                                           if_exists=if_exists,
                                           **kwargs)
         except:
+            if source.is_iterator():
+                raise
             bulk_copy = SQLConn.BULK_OFF
 
         if bulk_copy in [SQLConn.BULK_OFF, SQLConn.BULK_CHANCE]:
-            try:
-                temp_df.to_sql(table_name, self.sql_engine, if_exists=if_exists, index=False, schema=schema_name, **kwargs)
-            except Exception as e:
-                # We treat the exceptions we see as connection errors and the best way we know to handle them is by
-                # resetting the pool of connections for the engine.
-                self.sql_engine.dispose()
-                temp_df.to_sql(table_name, self.sql_engine, if_exists=if_exists, index=False, schema=schema_name, **kwargs)
+            if source.is_iterator():
+                with self.sql_engine.connect() as connection:
+                    self._to_sql(connection, source, table_name, schema_name, if_exists, **kwargs)
+            else:
+                self._run(lambda connection: self._to_sql(connection, source, table_name, schema_name, if_exists,
+                                                          **kwargs))
+            if if_exists == 'replace' or table_state == BaseSQLBridge.TABLE_STATE_NO_EXISTS:
+                # pandas dropped or created the table
+                self.invalidate_metadata(table_name, schema_name)
+
+        if self.query_cache is not None:
+            self.query_cache.invalidate_tables([table_name])
+
+    def _upsert(self, source, table_name, schema_name, key_columns, parallelism, **kwargs):
+        """
+        Bulk loads the rows into a staging table next to the table, moves them into the table with the bridge's
+        upsert statement and drops the staging table. The staging table is a regular table, because the bulk loads
+        run on connections of their own where a session's temporary table would not be visible.
+
+        :return: Returns the statistics of a parallel load, None otherwise
+        :rtype: dict
+        """
+        columns = list(source.schema_frame().columns)
+        missing = [column for column in key_columns if not self.sql_bridge.intersect_columns([column], columns)]
+        if missing:
+            raise KeyError(f'The key columns {missing} are not columns of both the data and {schema_name}.{table_name}')
+
+        staging_name = f'{table_name}_upsert_{uuid.uuid4().hex[:12]}'
+        stats = None
+        try:
+            if parallelism and parallelism > 1 and self.sql_bridge.SUPPORTS_PARALLEL_LOAD:
+                stats = ParallelLoad(self.sql_bridge, staging_name, schema_name, parallelism,
+                                     **kwargs).run(source, BaseSQLBridge.TABLE_STATE_NO_EXISTS, 'append')
+            else:
+                self.sql_bridge.bulk_load(bulk_df=source,
+                                          table_name=staging_name,
+                                          schema_name=schema_name,
+                                          table_state=BaseSQLBridge.TABLE_STATE_NO_EXISTS,
+                                          if_exists='append',
+                                          **kwargs)
+            self.execute_sql(self.sql_bridge.upsert_sql(table_name, schema_name, staging_name, columns, key_columns))
+        finally:
+            self.execute_sql(f'DROP TABLE IF EXISTS {schema_name}.{staging_name}')
+        return stats
+
+    def _to_sql(self, connection, source, table_name, schema_name, if_exists, **kwargs):
+        """
+        Writes the rows of the source with pandas.to_sql in one transaction, a chunk at a time. The bulk load key word
+        arguments are dropped, the others go to pandas.to_sql.
+        """
+        kwargs = {key: value for key, value in kwargs.items() if key not in self.BULK_LOAD_KWARGS}
+        with self.sql_bridge.transaction(connection):
+            chunks_written = 0
+            for chunk_df in source.iter_chunks(self.DEFAULT_CHUNK_ROWS):
+                chunk_df.to_sql(table_name, connection, if_exists=if_exists if chunks_written == 0 else 'append',
+                                index=False, schema=schema_name, **kwargs)
+                chunks_written += 1
+            if chunks_written == 0:
+                # We still create the table for a dataframe without rows
+                source.schema_frame().to_sql(table_name, connection, if_exists=if_exists, index=False,
+                                             schema=schema_name, **kwargs)
 
     def bridge_factory(self, sql_type):
         """
@@ -184,18 +734,20 @@ class SQLConn(object):
         :return: Returns a bridge object that helps with type specific SQL operations.
         :rtype: BaseSQLBridge
         """
-        if sql_type == SQLConn.SNOWFLAKE:
-            return SnowflakeBridge(sql_conn=self)
-        elif sql_type == SQLConn.MSSQL:
-            return MsSQLBridge(sql_conn=self)
-        elif sql_type == SQLConn.MSSQLNOAUTH:
-            return MsSQLNoauthBridge(sql_conn=self)
-        elif sql_type == SQLConn.POSTGRES:
-            return PostgresBridge(sql_conn=self)
-        elif sql_type == SQLConn.SQLITE:
-            return SQLLiteBridge(sql_conn=self)
-        else:
-            raise RuntimeError(f'We do not support a bulk load for SQLConn connection type {self.sql_params.type}')
+        return self.bridge_class(sql_type)(sql_conn=self)
+
+    @staticmethod
+    def bridge_class(sql_type):
+        """
+        :param sql_type: One of our supported SQL Types
+        :type sql_type: str
+        :return: Returns the bridge class for the SQL type, importing its module on first use.
+        :rtype: type
+        """
+        if sql_type not in SQLConn.BRIDGES:
+            raise RuntimeError(f'We do not support a bulk load for SQLConn connection type {sql_type}')
+        module_name, class_name = SQLConn.BRIDGES[sql_type]
+        return getattr(importlib.import_module(module_name), class_name)
 
     def get_names(self, table, schema=None):
         """
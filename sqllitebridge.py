@@ -1,6 +1,8 @@
-import sqlalchemy
+import pandas as pd
 
 from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.dataframesource import DataFrameSource
+from sqlconn.retrypolicy import RetryPolicy
 
 
 class SQLLiteBridge(BaseSQLBridge):
@@ -17,6 +19,9 @@ class SQLLiteBridge(BaseSQLBridge):
         """
         super(SQLLiteBridge, self).__init__(sql_conn)
 
+    # SQLite allows one writer at a time, parallel loads would only wait on each other's locks
+    SUPPORTS_PARALLEL_LOAD = False
+
     def get_engine(self, sql_params):
         """
         Creates an engine for the sql connector.
@@ -26,8 +31,52 @@ class SQLLiteBridge(BaseSQLBridge):
         :return: Returns the engine
         :rtype: sqlalchemy engine
         """
-        return sqlalchemy.create_engine('{0}:///{1}'.format(sql_params.type,
-                                                            sql_params.database))
+        return self._build_engine('{0}:///{1}'.format(sql_params.type,
+                                                      sql_params.database),
+                                  sql_params)
+
+    def pool_kwargs(self, pool):
+        """
+        SQLAlchemy does not use a sized pool for SQLite, so only the settings that apply to any pool are passed on.
+
+        :param pool: The pool block from connconfig.json
+        :type pool: dict
+        :return: Returns the create_engine keyword arguments for the pool settings
+        :rtype: dict
+        """
+        pool = {key: value for key, value in pool.items() if key in ['pre_ping', 'recycle']}
+        return super(SQLLiteBridge, self).pool_kwargs(pool)
+
+    def session_statements(self, session):
+        """
+        :param session: The session block from connconfig.json
+        :type session: dict
+        :return: Returns the PRAGMA statements run on every new connection
+        :rtype: list
+        """
+        return [f'PRAGMA {key} = {value}' for key, value in session.items()]
+
+    def hash_predicate(self, column, num_partitions, partition):
+        """
+        SQLite has no MOD function, so we use the % operator. The column must be an integer. See
+        BaseSQLBridge.hash_predicate.
+        """
+        predicate = f'ABS({column}) % {num_partitions:d} = {partition:d}'
+        return f'({predicate} OR {column} IS NULL)' if partition == 0 else predicate
+
+    def classify_driver_error(self, error):
+        """
+        SQLite has no network to lose, but a writer in another process can hold the database lock. That is retried the
+        same way as a deadlock.
+
+        :param error: The exception raised by the driver
+        :type error: Exception
+        :return: Returns RetryPolicy.DEADLOCK or RetryPolicy.PERMANENT
+        :rtype: str
+        """
+        if type(error).__name__ == 'OperationalError' and 'locked' in str(error):
+            return RetryPolicy.DEADLOCK
+        return super(SQLLiteBridge, self).classify_driver_error(error)
 
     @staticmethod
     def default_schema():
@@ -37,13 +86,34 @@ class SQLLiteBridge(BaseSQLBridge):
         """
         return 'main'
 
-    def bulk_load(self, bulk_df, table_name, schema_name, table_state=BaseSQLBridge.TABLE_STATE_UNKNOWN,
-                      if_exists='append', **kwargs):
+    @classmethod
+    def column_types_sql(cls):
         """
-        Perform a bulk copy into the table.
+        SQLite has no information_schema, the table_info pragma lists the columns instead.
+
+        :return: Returns the SQL for retrieving the column names and types, with the table_name and schema_name bound
+                 parameters
+        :rtype: str
+        """
+        return """SELECT name AS column_name, type AS data_type
+                  FROM pragma_table_info(:table_name, :schema_name)
+                  ORDER BY cid"""
+
+    # Rows inserted per executemany call of a bulk load
+    BULK_LOAD_CHUNK_ROWS = 50000
 
-        :param bulk_df: Dataframe values to copy into the table
-        :type bulk_df: pd.DataFrame
+    # Pragmas set for the duration of a bulk load with fast_pragmas=True. The database can be corrupted if the machine
+    # loses power during the load, which is fine for caches and fixtures that can be rebuilt.
+    FAST_LOAD_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'OFF'}
+
+    def bulk_load(self, bulk_df, table_name, schema_name, table_state=BaseSQLBridge.TABLE_STATE_UNKNOWN, if_exists='append', **kwargs):
+        """
+        Perform a bulk insert into the table. SQLite has no COPY, so the rows are inserted with executemany a chunk
+        at a time, all in one transaction. Each chunk is turned into tuples column by column rather than row by row.
+
+        :param bulk_df: Dataframe values to copy into the table, or an iterator of dataframes with the same columns,
+                        or a DataFrameSource. The table is created from the first one.
+        :type bulk_df: pd.DataFrame or iterable or DataFrameSource
         :param table_name: Name of the table
         :type table_name: str
         :param schema_name: Name of the schema
@@ -52,7 +122,90 @@ class SQLLiteBridge(BaseSQLBridge):
         :type table_state: int
         :param if_exists: Follows the pandas SQL functions if exists
         :type if_exists: str
-        :param kwargs: Key word arguments if needed for the bulk load
+        :param kwargs: Key word arguments if needed for the bulk load, chunk_rows sets the rows inserted per chunk and
+                       fast_pragmas=True sets FAST_LOAD_PRAGMAS until the load is done
         :type kwargs: dictionary
         """
-        raise RuntimeError('We do not handle bulk loads for SQL Lite')
+        source = DataFrameSource.wrap(bulk_df)
+        first_df = source.schema_frame()
+        if first_df is None:
+            return
+        chunk_rows = kwargs.get('chunk_rows', self.BULK_LOAD_CHUNK_ROWS)
+
+        self._determine_table(bulk_df=first_df,
+                              table_name=table_name,
+                              schema_name=schema_name,
+                              table_state=table_state,
+                              if_exists=if_exists)
+
+        columns = list(first_df.columns)
+        insert_sql = 'INSERT INTO {0}.{1} ({2}) VALUES ({3})'.format(schema_name, table_name,
+                                                                      ','.join(map(self._quote, columns)),
+                                                                      ','.join('?' * len(columns)))
+        pragmas = self.FAST_LOAD_PRAGMAS if kwargs.get('fast_pragmas', False) else {}
+
+        with self.sql_connection.get_engine().connect() as connection:
+            dbapi_connection = connection.connection
+            cursor = dbapi_connection.cursor()
+            previous_pragmas = self._set_pragmas(cursor, pragmas)
+            try:
+                # With the driver in autocommit mode every insert would be a transaction of its own
+                if not dbapi_connection.in_transaction:
+                    cursor.execute('BEGIN')
+                for chunk_df in source.iter_chunks(chunk_rows):
+                    cursor.executemany(insert_sql, self._rows(chunk_df[columns]))
+                dbapi_connection.commit()
+            except BaseException:
+                dbapi_connection.rollback()
+                raise
+            finally:
+                self._set_pragmas(cursor, previous_pragmas)
+                cursor.close()
+
+    @staticmethod
+    def _quote(name):
+        """
+        :return: Returns the identifier quoted for SQLite
+        :rtype: str
+        """
+        return '"{0}"'.format(str(name).replace('"', '""'))
+
+    @staticmethod
+    def _set_pragmas(cursor, pragmas):
+        """
+        :param cursor: A cursor outside of a transaction, journal_mode cannot change inside one
+        :param pragmas: The values to set by pragma name
+        :type pragmas: dict
+        :return: Returns the values the pragmas had before
+        :rtype: dict
+        """
+        previous = {}
+        for name, value in pragmas.items():
+            previous[name] = cursor.execute(f'PRAGMA {name}').fetchone()[0]
+            cursor.execute(f'PRAGMA {name} = {value}')
+        return previous
+
+    @staticmethod
+    def _rows(chunk_df):
+        """
+        :param chunk_df: One chunk of the load
+        :type chunk_df: pd.DataFrame
+        :return: Returns the rows as tuples of values sqlite3 can bind, None for nulls and datetimes as text the way
+                 pandas.to_sql writes them
+        :rtype: list
+        """
+        columns = []
+        for _, series in chunk_df.items():
+            if pd.api.types.is_datetime64_any_dtype(series.dtype):
+                if getattr(series.dt, 'tz', None) is not None:
+                    series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+                values = series.dt.strftime('%Y-%m-%d %H:%M:%S.%f').to_numpy(dtype=object)
+            else:
+                # NumPy turns its numbers into the matching Python ints, floats and bools here. We copy so setting
+                # the nulls below never writes into the caller's object columns.
+                values = series.to_numpy(dtype=object, copy=True)
+            nulls = series.isna().to_numpy()
+            if nulls.any():
+                values[nulls] = None
+            columns.append(values)
+        return list(zip(*columns))
@@ -1,4 +1,6 @@
-from sqlconn import SQL_PARAMS
+import json
+
+from sqlconn.sqlconfig import load_config
 
 
 class SQLParams(object):
@@ -6,7 +8,11 @@ class SQLParams(object):
     Contains the parameters needed for connecting to a SQL database
     """
 
-    def __init__(self, _host, _database, _username, _password, _port, _type):
+    # Keys of a database entry in connconfig.json that describe the connection itself. Anything else in the entry is
+    # an optional tuning block (pool, session, ...) and is kept in options.
+    CONNECTION_KEYS = ['host', 'database', 'username', 'password', 'port', 'type']
+
+    def __init__(self, _host, _database, _username, _password, _port, _type, _options=None):
         """
         Stores the necessary parameters for connecting to a database
 
@@ -16,6 +22,7 @@ class SQLParams(object):
         :param _password: The password for the user.
         :param _port: Only used for Postgres tables at the moment.
         :param _type: Either SQLConn.MSSQL, SQLConn.POSTGRES, SQLConn.SQLITE
+        :param _options: Optional tuning blocks keyed by name, e.g. {'pool': {...}, 'session': {...}}
         """
         self.host = _host
         self.database = _database
@@ -23,6 +30,7 @@ class SQLParams(object):
         self.password = _password
         self.port = _port
         self.type = _type
+        self.options = dict(_options) if _options else {}
 
         # We allow changing the default database and this is something that should be updated if we do.
         self.diff_database = False
@@ -30,15 +38,16 @@ class SQLParams(object):
     @classmethod
     def from_json(cls, sql_nickname):
         """
-        Based upon the input nickname, we look for the sql parameters in the dictionary contained at the top of
-        this file. NOTE:  In order to see the currently available sql nicknames use the provided function,
+        Based upon the input nickname, we look for the sql parameters in the dictionary loaded from our
+        connconfig.json files. NOTE:  In order to see the currently available sql nicknames use the provided function,
         get_sql_nicknames.
 
         :param sql_nickname: A nickname representing a set of sql parameters.
         :return: Returns an SQLParams object that can be used to create a SQLConn object.
         """
-        if sql_nickname in list(SQL_PARAMS.keys()):
-            wanted_sql_params = SQL_PARAMS[sql_nickname]
+        known_params = load_config()[1]
+        if sql_nickname in list(known_params.keys()):
+            wanted_sql_params = known_params[sql_nickname]
         else:
             raise KeyError('{0:s} is not a valid sql nickname'.format(sql_nickname))
         return cls(wanted_sql_params['host'],
@@ -46,26 +55,40 @@ class SQLParams(object):
                    wanted_sql_params['username'],
                    wanted_sql_params['password'],
                    wanted_sql_params['port'],
-                   wanted_sql_params['type'])
+                   wanted_sql_params['type'],
+                   {key: value for key, value in wanted_sql_params.items() if key not in cls.CONNECTION_KEYS})
+
+    def engine_key(self):
+        """
+        Describes the database target these parameters resolve to. Parameters with the same key can share an engine.
+
+        :return: Returns the host, port, database, username, type and the pool/session tuning
+        :rtype: tuple
+        """
+        # Two nicknames for the same target with different pool or session settings must not share an engine.
+        tuning = json.dumps({'pool': self.options.get('pool', {}),
+                             'session': self.options.get('session', {})}, sort_keys=True)
+        return self.host, self.port, self.database, self.username, self.type, tuning
 
     @staticmethod
     def get_sql_nicknames():
         """
         :return: Returns the available list of sql nicknames.
         """
-        return list(SQL_PARAMS.keys())
+        return list(load_config()[1].keys())
 
     def get_nickname(self):
         """
         Provides the nickname for the current group of sql parameters
         """
-        for key in SQL_PARAMS.keys():
-            if ((SQL_PARAMS[key]['host'] == self.host) and
-                    ((SQL_PARAMS[key]['database'] == self.database) or self.diff_database) and
-                    (SQL_PARAMS[key]['username'] == self.username) and
-                    (SQL_PARAMS[key]['password'] == self.password) and
-                    (SQL_PARAMS[key]['port'] == self.port) and
-                    (SQL_PARAMS[key]['type'] == self.type)):
+        known_params = load_config()[1]
+        for key in known_params.keys():
+            if ((known_params[key]['host'] == self.host) and
+                    ((known_params[key]['database'] == self.database) or self.diff_database) and
+                    (known_params[key]['username'] == self.username) and
+                    (known_params[key]['password'] == self.password) and
+                    (known_params[key]['port'] == self.port) and
+                    (known_params[key]['type'] == self.type)):
                 return key
         # If we get here then we were not able to match our parameters to anything in our SQL dictionary
         raise NameError('SQL Parameters do not match any nickname')
@@ -80,14 +103,16 @@ class SQLParams(object):
         :param sqlparams_object: Since the parameters object already has everything needed for a connection, we will
                                  create the connection based upon the parameters.
         """
-        if nickname in list(SQL_PARAMS.keys()):
+        known_params = load_config()[1]
+        if nickname in list(known_params.keys()):
             raise KeyError('This nickname is already taken')
 
-        SQL_PARAMS[nickname] = {
+        known_params[nickname] = {
                 "host": sqlparams_object.host,
                 "database": sqlparams_object.database,
                 "username": sqlparams_object.username,
                 "password": sqlparams_object.password,
                 "port": sqlparams_object.port,
-                "type": sqlparams_object.type
+                "type": sqlparams_object.type,
+                **sqlparams_object.options
             }
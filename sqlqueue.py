@@ -3,6 +3,7 @@ import pandas
 import numbers
 import socket
 
+from sqlconn.appendbuffer import AppendBuffer
 from sqlconn.sqlconn import SQLConn
 
 
@@ -64,19 +65,43 @@ class SQLQueue(object):
             # Don't trust the caller, they might have named the priority column incorrectly
             priority_included = False
 
+        self.sql_conn.append_to_table(table_name=self.squeue,
+                                      data_to_append=df,
+                                      constants=self._put_constants(priority_included, priority))
+
+    def put_buffer(self, priority_included=False, priority=MIN_PRIORITY, **kwargs):
+        """
+        Returns a buffer for producers that put a few rows at a time. The rows of many puts are written together in
+        one bulk load from a background thread, see AppendBuffer.
+
+            with squeue.put_buffer(max_latency_ms=500) as buffer:
+                buffer.append(df)
+
+        :param priority_included: True if every dataframe appended has a priority column.
+        :param priority: The priority given to all of the rows if they do not have a priority column.
+        :param kwargs: Key word arguments passed on to AppendBuffer, e.g. max_rows or max_latency_ms
+        :return: Returns the buffer, close it or use it as a context manager to write the last rows
+        :rtype: AppendBuffer
+        """
+        return AppendBuffer(self.sql_conn, self.squeue, constants=self._put_constants(priority_included, priority),
+                            **kwargs)
+
+    def _put_constants(self, priority_included, priority):
+        """
+        :return: Returns the columns added to every row put into the queue
+        :rtype: dict
+        """
         priority = self.MAX_PRIORITY if priority > self.MAX_PRIORITY else priority
         priority = self.MIN_PRIORITY if priority < self.MIN_PRIORITY else priority
 
+        # Need to add unique identifiers to the list. They are added as the rows are written, the caller's dataframe
+        # is left as it is.
+        constants = {self.SQ_STATUS: self.STATUS_AVAILABLE,
+                     self.SQ_PUT_HOSTNAME: socket.gethostname()}
         if priority_included is not True:
             # If priority is not already present in the dataframe then we need to add a priority column
-            df.loc[:, self.SQ_PRIORITY] = priority
-
-        # Need to add unique identifiers to the list
-        df.loc[:, self.SQ_STATUS] = self.STATUS_AVAILABLE
-        df.loc[:, self.SQ_PUT_HOSTNAME] = socket.gethostname()
-
-        self.sql_conn.append_to_table(table_name=self.squeue,
-                                      data_to_append=df)
+            constants[self.SQ_PRIORITY] = priority
+        return constants
 
     def claim(self, conditional_claim=None, join_text=''):
         """
@@ -85,38 +110,31 @@ class SQLQueue(object):
         :return: Returns the squeue ID for the row.
         """
         # The assumption is we just want to claim the next available highest priority and have its id number returned
-        # to us so we can use that later to retrieve it.
+        # to us so we can use that later to retrieve it. The select and the update run in one transaction so the row
+        # lock taken by FOR UPDATE holds until the row is marked as claimed.
         if not conditional_claim:
             conditional_claim = ''
         else:
             conditional_claim = 'and ' + conditional_claim
-        with self.sql_conn.get_engine().connect() as connection:
-            sql_select = """SELECT {3:s} FROM {0:s} 
-                            {6:s}
-                            WHERE {1:s} = '{2:s}' {5:s} 
-                            ORDER BY {4:s} DESC, {3:s} ASC LIMIT 1 FOR UPDATE OF {0:s};""".format(self.squeue,
-                                                                                                  self.SQ_STATUS,
-                                                                                                  self.STATUS_AVAILABLE,
-                                                                                                  self.SQ_ID,
-                                                                                                  self.SQ_PRIORITY,
-                                                                                                  conditional_claim,
-                                                                                                  join_text)
-            row_id_df = pandas.read_sql(sql_select, connection)
-            if len(row_id_df) > 0:
-                sql_update = """UPDATE {0:s} SET {1:s} = '{2:s}',
-                                                 {3:s} = now(),
-                                                 {6:s} = '{7:s}' 
-                                WHERE {4:s} = {5:d};""".format(self.squeue,
-                                                               self.SQ_STATUS,
-                                                               self.STATUS_CLAIMED,
-                                                               self.SQ_CLAIM_TIME,
-                                                               self.SQ_ID,
-                                                               row_id_df.loc[0, self.SQ_ID],
-                                                               self.SQ_CLAIM_HOSTNAME,
-                                                               socket.gethostname())
-                connection.execute(sql_update)
-                return row_id_df.loc[0, self.SQ_ID]
-        return -1
+        sql_select = f"""SELECT {self.SQ_ID} FROM {self.squeue}
+                         {join_text}
+                         WHERE {self.SQ_STATUS} = :status {conditional_claim}
+                         ORDER BY {self.SQ_PRIORITY} DESC, {self.SQ_ID} ASC LIMIT 1 FOR UPDATE OF {self.squeue}"""
+        sql_update = f"""UPDATE {self.squeue} SET {self.SQ_STATUS} = :status,
+                                                  {self.SQ_CLAIM_TIME} = now(),
+                                                  {self.SQ_CLAIM_HOSTNAME} = :hostname
+                         WHERE {self.SQ_ID} = :sq_id"""
+
+        def claim_row(connection):
+            with connection.begin():
+                row = self.sql_conn._execute(connection, sql_select, {'status': self.STATUS_AVAILABLE}).first()
+                if row is None:
+                    return -1
+                self.sql_conn._execute(connection, sql_update, {'status': self.STATUS_CLAIMED,
+                                                                'hostname': socket.gethostname(),
+                                                                'sq_id': int(row[0])})
+                return row[0]
+        return self.sql_conn._run(claim_row)
 
     def get(self, row_id, join_text=''):
         """
@@ -126,20 +144,15 @@ class SQLQueue(object):
         :return: Returns the corresponding dataframe row.
         """
         # Will return the row as a dataframe without the squeue specific values
-        sql_update = """UPDATE {0:s} SET {1:s} = now(), 
-                                         {2:s} = '{3:s}',
-                                         {4:s} = '{5:s}'  
-                        WHERE {6:s} = {7:d}""".format(self.squeue,
-                                                      self.SQ_GET_TIME,
-                                                      self.SQ_STATUS,
-                                                      self.STATUS_PROGRESS,
-                                                      self.SQ_GET_HOSTNAME,
-                                                      socket.gethostname(),
-                                                      self.SQ_ID,
-                                                      row_id)
-        self.sql_conn.execute_sql(sql_update)
-        sql_select = """SELECT * FROM {0:s} {3:s} WHERE {1:s} = {2:d}""".format(self.squeue, self.SQ_ID, row_id, join_text)
-        return self.sql_conn.get_dataframe(sql_select)
+        sql_update = f"""UPDATE {self.squeue} SET {self.SQ_GET_TIME} = now(),
+                                                  {self.SQ_STATUS} = :status,
+                                                  {self.SQ_GET_HOSTNAME} = :hostname
+                         WHERE {self.SQ_ID} = :sq_id"""
+        self.sql_conn.execute_sql(sql_update, params={'status': self.STATUS_PROGRESS,
+                                                      'hostname': socket.gethostname(),
+                                                      'sq_id': int(row_id)})
+        sql_select = f"""SELECT * FROM {self.squeue} {join_text} WHERE {self.SQ_ID} = :sq_id"""
+        return self.sql_conn.get_dataframe(sql_select, params={'sq_id': int(row_id)}, cache_ttl=0)
 
     def finish(self, row_id, finish_status=STATUS_COMPLETED):
         """
@@ -149,25 +162,30 @@ class SQLQueue(object):
         :param finish_status: Whether the row from the queue finished without exception or not.
         """
         # Sets the row in the queue to completed so the queue manager knows that we are finished.
-        sql_update = """UPDATE {0:s} SET {1:s} = now(),
-                                         {2:s} = '{3:s}'
-                        WHERE {4:s} = {5:d}""".format(self.squeue,
-                                                      self.SQ_FINISH_TIME,
-                                                      self.SQ_STATUS,
-                                                      finish_status,
-                                                      self.SQ_ID,
-                                                      row_id)
-        self.sql_conn.execute_sql(sql_update)
+        sql_update = f"""UPDATE {self.squeue} SET {self.SQ_FINISH_TIME} = now(),
+                                                  {self.SQ_STATUS} = :status
+                         WHERE {self.SQ_ID} = :sq_id"""
+        self.sql_conn.execute_sql(sql_update, params={'status': finish_status, 'sq_id': int(row_id)})
+
+    def finish_many(self, row_ids, finish_status=STATUS_COMPLETED):
+        """
+        Sets the status of many rows at once, in one round trip batch and one transaction.
+
+        :param row_ids: The squeue IDs that were returned from the get function
+        :param finish_status: Whether the rows from the queue finished without exception or not.
+        """
+        sql_update = f"""UPDATE {self.squeue} SET {self.SQ_FINISH_TIME} = now(),
+                                                  {self.SQ_STATUS} = :status
+                         WHERE {self.SQ_ID} = :sq_id"""
+        self.sql_conn.execute_many(sql_update, [{'status': finish_status, 'sq_id': int(row_id)} for row_id in row_ids])
 
     def get_status(self, row_id):
         """
         :param row_id: The squeue ID that was returned from the get function
         :return: Returns the status corresponding to the row ID.
         """
-        status_df = self.sql_conn.get_dataframe('SELECT {0:s} FROM {1:s} WHERE {2:s} = {3:d}'.format(self.SQ_STATUS,
-                                                                                                     self.squeue,
-                                                                                                     self.SQ_ID,
-                                                                                                     row_id))
+        sql_select = f'SELECT {self.SQ_STATUS} FROM {self.squeue} WHERE {self.SQ_ID} = :sq_id'
+        status_df = self.sql_conn.get_dataframe(sql_select, params={'sq_id': int(row_id)}, cache_ttl=0)
         if len(status_df) > 0:
             return status_df.loc[0, self.SQ_STATUS]
         return self.STATUS_NOEXIST
@@ -211,7 +229,8 @@ class SQLQueue(object):
                                               {join_text}
                                               JOIN run_id rid ON rid.run_id = pricing_queue.run_id
                                               {conditional_claim}
-                                              AND date(rid.post_time) >= date(now() - interval '1 day'))""")
+                                              AND date(rid.post_time) >= date(now() - interval '1 day'))""",
+                                                    cache_ttl=0)
             return status_df
         else:
             return pandas.DataFrame(columns=['sq_id', 'sq_status'])
@@ -222,7 +241,8 @@ class SQLQueue(object):
         """
         return self.sql_conn.get_dataframe("""SELECT * FROM {0:s} WHERE {1:s} = '{2:s}'""".format(self.squeue,
                                                                                                   self.SQ_STATUS,
-                                                                                                  self.STATUS_PROGRESS))
+                                                                                                  self.STATUS_PROGRESS),
+                                           cache_ttl=0)
 
     def cleanup_long_running_rows(self, in_progress_timeout_h=8, claimed_timeout_h=1, join_text=''):
         with self.sql_conn.get_engine().connect() as connection:
@@ -292,7 +312,8 @@ class SQLQueue(object):
                                                                               self.SQ_STATUS,
                                                                               self.STATUS_AVAILABLE,
                                                                               conditional_claim,
-                                                                              join_text))
+                                                                              join_text),
+                                                         cache_ttl=0)
         if len(unclaimed_count_df) > 0:
             return unclaimed_count_df.loc[0, 'count']
         else:
@@ -0,0 +1,71 @@
+"""
+Light-weight inspection of SQL text, used to key cached results and to find the tables a statement reads or writes.
+These are regular expressions, not a parser. They are meant to err on the side of naming too many tables.
+"""
+import re
+
+# Table names following the keywords that read from a table.
+_READ_PATTERN = re.compile(r'\b(?:from|join)\s+([\w."\[\]]+)', re.IGNORECASE)
+
+# Table names following the keywords of statements that change a table's rows or definition.
+_WRITE_PATTERN = re.compile(r'\b(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?|merge\s+into|copy|'
+                            r'(?:drop|create|alter)\s+table(?:\s+if\s+(?:not\s+)?exists)?)\s+([\w."\[\]]+)',
+                            re.IGNORECASE)
+
+# Statements that change a table's definition.
+_DDL_PATTERN = re.compile(r'^\s*(?:drop|create|alter)\b', re.IGNORECASE)
+
+# String literals, quoted identifiers and runs of whitespace. Whitespace inside the quotes is part of a value.
+_QUOTED_OR_SPACE_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\[[^\]]*\]|\s+")
+
+
+def normalize_sql(sql):
+    """
+    :param sql: A sql statement
+    :type sql: str
+    :return: Returns the statement with runs of whitespace outside of quotes collapsed and any trailing semicolon
+             removed
+    :rtype: str
+    """
+    collapsed = _QUOTED_OR_SPACE_PATTERN.sub(lambda match: ' ' if match.group().isspace() else match.group(), sql)
+    return collapsed.strip().rstrip(';').strip()
+
+
+def table_name(name):
+    """
+    :param name: A possibly schema qualified and quoted table name
+    :type name: str
+    :return: Returns the bare, lower case table name
+    :rtype: str
+    """
+    return re.sub(r'["\[\]]', '', name).split('.')[-1].lower()
+
+
+def referenced_tables(sql):
+    """
+    :param sql: A sql statement
+    :type sql: str
+    :return: Returns the bare, lower case names of the tables the statement reads from
+    :rtype: set
+    """
+    return {table_name(name) for name in _READ_PATTERN.findall(sql)}
+
+
+def written_tables(sql):
+    """
+    :param sql: A sql statement
+    :type sql: str
+    :return: Returns the bare, lower case names of the tables the statement changes
+    :rtype: set
+    """
+    return {table_name(name) for name in _WRITE_PATTERN.findall(sql)}
+
+
+def is_ddl(sql):
+    """
+    :param sql: A sql statement
+    :type sql: str
+    :return: Returns True if the statement drops, creates or alters something
+    :rtype: bool
+    """
+    return bool(_DDL_PATTERN.match(sql))
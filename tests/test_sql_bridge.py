@@ -1,9 +1,31 @@
-from sqlconn import SQLConn
+from sqlconn import SQLConn, SQLParams, AppendBuffer, AsyncSQLConn, dfcompact, pgbinary
 from sqlconn.postgresbridge import PostgresBridge
 from sqlconn.mssqlbridge import MsSQLBridge
 from sqlconn.snowflakebridge import SnowflakeBridge
 from sqlconn.sqllitebridge import SQLLiteBridge
+from sqlconn.snowflakestage import SnowflakeStage
+from sqlconn.basesqlbridge import BaseSQLBridge
+from sqlconn.engineregistry import EngineRegistry
+from sqlconn.retrypolicy import RetryPolicy
+from sqlconn.dataframesource import DataFrameSource
+from sqlconn.copystream import CopyStream
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import io
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import numpy as np
 import pandas as pd
+import pytest
+import sqlalchemy
+import tracemalloc
 
 
 init_df = pd.DataFrame({
@@ -79,6 +101,78 @@ def test_postgres_db():
                  test_table_name='tmp.test_load_bulk')
 
 
+def test_append_to_table_memory():
+    sql_conn = SQLConn.get_connection('devpg')
+    sql_conn.execute_sql('DROP TABLE IF EXISTS tmp.test_load_memory')
+    sql_conn.execute_sql('CREATE TABLE tmp.test_load_memory (test BIGINT, value DOUBLE PRECISION, status TEXT)')
+
+    rows = 2000000
+    load_df = pd.DataFrame({'test': np.arange(rows, dtype=np.int64),
+                            'value': np.random.random(rows),
+                            'not_in_table': np.zeros(rows)})
+    input_bytes = load_df.memory_usage(index=True, deep=True).sum()
+
+    tracemalloc.start()
+    sql_conn.append_to_table(table_name='tmp.test_load_memory',
+                             data_to_append=load_df,
+                             bulk_copy=SQLConn.BULK_FORCE,
+                             constants={'status': 'loaded'})
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # The load works on chunks, it must not copy the input as a whole
+    assert peak_bytes < 0.5 * input_bytes, f'Loading {input_bytes} bytes allocated up to {peak_bytes} bytes'
+    assert list(load_df.columns) == ['test', 'value', 'not_in_table'], 'The caller\'s dataframe was changed'
+    assert sql_conn.get_dataframe("SELECT count(1) t_count FROM tmp.test_load_memory WHERE status = 'loaded'",
+                                  cache_ttl=0).loc[0, 't_count'] == rows
+    sql_conn.execute_sql('DROP TABLE tmp.test_load_memory')
+
+
+def test_append_to_table_memory_sqlite(tmp_path):
+    # The same check without a server, through the chunked SQLite bulk load
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_memory.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.execute_sql('CREATE TABLE test_load_memory (test BIGINT, value DOUBLE PRECISION, status TEXT)')
+
+    rows = 500000
+    load_df = pd.DataFrame({'test': np.arange(rows, dtype=np.int64),
+                            'value': np.random.random(rows),
+                            'not_in_table': np.zeros(rows)})
+    input_bytes = load_df.memory_usage(index=True, deep=True).sum()
+
+    tracemalloc.start()
+    sql_conn.append_to_table(table_name='test_load_memory',
+                             data_to_append=load_df,
+                             bulk_copy=SQLConn.BULK_FORCE,
+                             constants={'status': 'loaded'},
+                             chunk_rows=10000)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert peak_bytes < 0.5 * input_bytes, f'Loading {input_bytes} bytes allocated up to {peak_bytes} bytes'
+    assert list(load_df.columns) == ['test', 'value', 'not_in_table'], 'The caller\'s dataframe was changed'
+    assert sql_conn.get_dataframe("SELECT count(1) t_count FROM test_load_memory WHERE status = 'loaded'",
+                                  cache_ttl=0).loc[0, 't_count'] == rows
+
+
+def test_append_to_table_parallel():
+    sql_conn = SQLConn.get_connection('devpg')
+    sql_conn.execute_sql('DROP TABLE IF EXISTS tmp.test_load_parallel')
+
+    rows = 100000
+    load_df = pd.DataFrame({'test': np.arange(rows, dtype=np.int64), 'value': np.random.random(rows)})
+    stats = sql_conn.append_to_table(table_name='tmp.test_load_parallel', data_to_append=load_df,
+                                     bulk_copy=SQLConn.BULK_FORCE, parallelism=4)
+    assert stats['rows'] == rows and len(stats['partitions']) == 4
+
+    # A stream of chunks is handed out to the partitions as it is read
+    chunks = (load_df.iloc[start:start + 10000] for start in range(0, rows, 10000))
+    stats = sql_conn.append_to_table(table_name='tmp.test_load_parallel', data_to_append=chunks, parallelism=4)
+    assert stats['rows'] == rows
+    assert sql_conn.get_dataframe('SELECT count(1) t_count FROM tmp.test_load_parallel',
+                                  cache_ttl=0).loc[0, 't_count'] == rows * 2
+    sql_conn.execute_sql('DROP TABLE tmp.test_load_parallel')
+
+
 def test_sqlserver_db():
     sql_conn = SQLConn.get_connection('devvmart')
     try:
@@ -91,7 +185,7 @@ def test_sqlserver_db():
                  sql_conn=sql_conn,
                  sql_bridge=MsSQLBridge(SQLConn.get_connection('devvmart')),
                  test_table_name='test.test_load_bulk',
-                 tmp_dir='/tmp')
+                 batch_rows=4)
 
 
 def test_snowflake_db():
@@ -102,3 +196,433 @@ def test_snowflake_db():
                  sql_bridge=SnowflakeBridge(SQLConn.get_connection('devvmartsnow')),
                  test_table_name='test.test_load_bulk',
                  tmp_dir='/tmp')
+
+
+def test_sqlite_db(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_load.db'), '', '', 0, SQLConn.SQLITE))
+    _test_bridge(load_df=init_df.copy(deep=True),
+                 sql_conn=sql_conn,
+                 sql_bridge=SQLLiteBridge(sql_conn),
+                 test_table_name='main.test_load_bulk',
+                 fast_pragmas=True)
+
+    # The pragmas only hold for the duration of the load
+    assert pd.read_sql('PRAGMA journal_mode', sql_conn.sql_engine).iloc[0, 0] == 'delete'
+
+    typed_df = pd.DataFrame({'id': [1, 2],
+                             'value': [0.5, np.nan],
+                             'created': pd.to_datetime(['2020-01-02 03:04:05', None])})
+    sql_conn.append_to_table(table_name='main.test_load_typed', data_to_append=typed_df, if_exists='replace',
+                             bulk_copy=SQLConn.BULK_FORCE, chunk_rows=1)
+    loaded_df = sql_conn.get_dataframe('SELECT * FROM main.test_load_typed ORDER BY id')
+    assert loaded_df['value'].isna().tolist() == [False, True]
+    assert loaded_df['created'].tolist() == ['2020-01-02 03:04:05.000000', None]
+
+
+def test_sqlite_upsert(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_upsert.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.execute_sql('CREATE TABLE test_upsert (id INTEGER PRIMARY KEY, value TEXT)')
+    sql_conn.append_to_table(table_name='test_upsert', data_to_append=pd.DataFrame({'id': [1, 2], 'value': ['a', 'b']}))
+
+    upsert_df = pd.DataFrame({'id': [2, 3], 'value': ['B', 'c']})
+    sql_conn.append_to_table(table_name='test_upsert', data_to_append=upsert_df, if_exists='upsert', key_columns=['id'],
+                             bulk_copy=SQLConn.BULK_FORCE)
+    loaded_df = sql_conn.get_dataframe('SELECT id, value FROM test_upsert ORDER BY id')
+    assert loaded_df['value'].tolist() == ['a', 'B', 'c']
+    # The staging table is gone
+    tables_df = sql_conn.get_dataframe("SELECT name FROM sqlite_master WHERE type = 'table'")
+    assert tables_df['name'].tolist() == ['test_upsert']
+
+
+def test_append_buffer(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_buffer.db'), '', '', 0, SQLConn.SQLITE))
+    with AppendBuffer(sql_conn, 'main.test_buffer', max_rows=100, max_latency_ms=50) as buffer:
+        for row in range(250):
+            buffer.append(pd.DataFrame({'test': [row], 'load': [str(row)]}))
+    # The rows were written in a few bulk loads rather than one insert each
+    assert buffer.stats()['rows'] == 250 and buffer.stats()['flushes'] < 250
+    assert sql_conn.get_dataframe('SELECT count(1) t_count FROM main.test_buffer').loc[0, 't_count'] == 250
+
+
+def test_append_buffer_dead_thread(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_buffer.db'), '', '', 0, SQLConn.SQLITE))
+    buffer = AppendBuffer(sql_conn, 'main.test_buffer')
+
+    def fail():
+        raise SystemExit('the background thread died')
+    buffer._due = fail
+    buffer.append(pd.DataFrame({'test': [1]}))
+    # flush and close raise instead of waiting on the dead thread
+    with pytest.raises(SystemExit):
+        buffer.flush()
+    with pytest.raises(RuntimeError):
+        buffer.close()
+
+
+class LocalStage(SnowflakeStage):
+    """
+    Stands a local directory in for the Snowflake stage, COPY INTO appends the staged files with to_sql.
+    """
+
+    def __init__(self, sql_conn, stage_dir):
+        super(LocalStage, self).__init__(sql_conn)
+        self.stage_dir = stage_dir
+        self.put_files = []
+
+    def put(self, local_pattern, stage_path, parallel):
+        target = self.stage_dir / stage_path
+        target.mkdir(parents=True)
+        for file_name in sorted(glob.glob(local_pattern)):
+            self.put_files.append(shutil.copy(file_name, target))
+
+    def copy_into(self, table_name, schema_name, columns, stage_path, file_format):
+        for file_name in sorted((self.stage_dir / stage_path).iterdir()):
+            pd.read_csv(file_name, sep='\t', header=None, names=columns).to_sql(
+                table_name, self.sql_connection.sql_engine, schema=schema_name, if_exists='append', index=False)
+
+    def remove(self, stage_path):
+        shutil.rmtree(self.stage_dir / stage_path, ignore_errors=True)
+
+
+def test_snowflake_staging(tmp_path):
+    # The bridge runs its DDL on SQLite, only the stage would need Snowflake
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'stage.db'), '', '', 0, SQLConn.SQLITE))
+    sql_bridge = SnowflakeBridge(sql_conn)
+    sql_bridge.stage = LocalStage(sql_conn, tmp_path / 'stage')
+    (tmp_path / 'files').mkdir()
+
+    load_df = pd.DataFrame({'test': range(25), 'load': [f'row\t{x}' for x in range(25)]})
+    for table_state in [BaseSQLBridge.TABLE_STATE_NO_EXISTS, BaseSQLBridge.TABLE_STATE_EXISTS]:
+        sql_bridge.bulk_load(bulk_df=load_df, table_name='test_stage', schema_name='main', table_state=table_state,
+                             tmp_dir=str(tmp_path / 'files'), file_rows=10, max_workers=2)
+
+    loaded_df = sql_conn.get_dataframe('SELECT * FROM main.test_stage ORDER BY test')
+    assert len(loaded_df) == 50 and loaded_df['load'].tolist()[::2] == load_df['load'].tolist()
+    # Every load stages its own files and removes them afterwards
+    assert len(sql_bridge.stage.put_files) == 6 and len(set(sql_bridge.stage.put_files)) == 6
+    assert not list((tmp_path / 'stage' / 'tmp').iterdir()) and not list((tmp_path / 'files').iterdir())
+
+
+class FailingStage(LocalStage):
+    """
+    A stage whose COPY INTO and cleanup both fail.
+    """
+
+    def copy_into(self, table_name, schema_name, columns, stage_path, file_format):
+        raise ValueError('copy failed')
+
+    def remove(self, stage_path):
+        raise OSError('remove failed')
+
+
+def test_snowflake_staging_cleanup_error(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'stage.db'), '', '', 0, SQLConn.SQLITE))
+    sql_bridge = SnowflakeBridge(sql_conn)
+    sql_bridge.stage = FailingStage(sql_conn, tmp_path / 'stage')
+    # The error of the load is raised, not the error of the cleanup
+    with pytest.raises(ValueError):
+        sql_bridge.bulk_load(bulk_df=init_df.copy(deep=True), table_name='test_stage', schema_name='main',
+                             table_state=BaseSQLBridge.TABLE_STATE_NO_EXISTS)
+
+
+def test_engine_registry(tmp_path):
+    sql_params = SQLParams('', str(tmp_path / 'test_registry.db'), '', '', 0, SQLConn.SQLITE)
+    engine_key = sql_params.engine_key()
+    first_conn, second_conn = SQLConn(sql_params), SQLConn(sql_params)
+    # Both objects share one engine, and its pool
+    assert first_conn.sql_engine is second_conn.sql_engine
+    assert EngineRegistry.ref_count(engine_key) == 2
+
+    # Closing twice releases one reference
+    first_conn.close()
+    first_conn.close()
+    assert EngineRegistry.ref_count(engine_key) == 1
+    assert second_conn.get_dataframe('SELECT 1 AS one').loc[0, 'one'] == 1
+
+    # A holder of an engine that close_all replaced must not release the new one
+    SQLConn.close_all()
+    with SQLConn(sql_params) as third_conn:
+        second_conn.close()
+        assert EngineRegistry.ref_count(engine_key) == 1
+        assert third_conn.get_dataframe('SELECT 1 AS one').loc[0, 'one'] == 1
+    assert EngineRegistry.ref_count(engine_key) == 0
+
+
+def test_sqlite_pool_session(tmp_path):
+    sql_params = SQLParams('', str(tmp_path / 'test_session.db'), '', '', 0, SQLConn.SQLITE,
+                           {'pool': {'pre_ping': True, 'prewarm': 2}, 'session': {'cache_size': -4000}})
+    sql_conn = SQLConn(sql_params)
+    # The session block is applied to every new connection
+    assert pd.read_sql('PRAGMA cache_size', sql_conn.sql_engine).iloc[0, 0] == -4000
+    assert sql_conn.prewarm() == 2
+
+    # The same database with other settings gets an engine of its own
+    plain_conn = SQLConn(SQLParams('', str(tmp_path / 'test_session.db'), '', '', 0, SQLConn.SQLITE))
+    assert plain_conn.sql_engine is not sql_conn.sql_engine
+    assert pd.read_sql('PRAGMA cache_size', plain_conn.sql_engine).iloc[0, 0] != -4000
+
+
+def test_sqlite_retry(tmp_path):
+    retry_policy = RetryPolicy(max_retries=2, base_delay=0)
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_retry.db'), '', '', 0, SQLConn.SQLITE),
+                       retry_policy=retry_policy)
+    assert sql_conn.sql_bridge.classify_error(sqlite3.OperationalError('database is locked')) == RetryPolicy.DEADLOCK
+    assert sql_conn.sql_bridge.classify_error(sqlite3.OperationalError('no such table: x')) == RetryPolicy.PERMANENT
+    assert sql_conn.sql_bridge.classify_error(ConnectionResetError()) == RetryPolicy.TRANSIENT
+
+    # A locked database is retried until it is free
+    attempts = []
+
+    def read(connection):
+        attempts.append(connection)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return pd.read_sql('SELECT 1 AS one', connection)
+    assert sql_conn._run(read).loc[0, 'one'] == 1
+    assert sql_conn.retry_stats()['deadlock'] == 2
+
+    # Permanent errors are raised right away, and errors that keep coming are raised once the retries run out
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        sql_conn.execute_sql('SELECT * FROM not_here')
+    assert sql_conn.retry_stats()['deadlock'] == 2 and sql_conn.retry_stats()['gave_up'] == 0
+
+    def locked(connection):
+        raise sqlite3.OperationalError('database is locked')
+    with pytest.raises(sqlite3.OperationalError):
+        sql_conn._run(locked)
+    assert sql_conn.retry_stats()['deadlock'] == 4 and sql_conn.retry_stats()['gave_up'] == 1
+
+
+def test_lazy_import():
+    # Importing the package reads no configuration and imports neither pandas, SQLAlchemy nor any driver
+    code = ('import sys, sqlconn, sqlconn.sqlconfig; '
+            'print(any(name in sys.modules for name in ["pandas", "sqlalchemy", "psycopg2", "pytds"]), '
+            'sqlconn.sqlconfig._loaded is None)')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))).stdout
+    assert output.split() == ['False', 'True']
+
+
+def _count_rows(sql_conn):
+    return int(sql_conn.get_dataframe('SELECT count(1) t_count FROM test_fork').loc[0, 't_count'])
+
+
+def test_sqlite_fork(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_fork.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.append_to_table(table_name='test_fork', data_to_append=init_df.copy(deep=True))
+    sql_conn.prewarm()
+
+    # The children inherit the object and get a pool of their own
+    context = multiprocessing.get_context('fork')
+    counts = context.Queue()
+    children = [context.Process(target=lambda: counts.put(_count_rows(sql_conn))) for _ in range(2)]
+    for child in children:
+        child.start()
+    assert [counts.get(timeout=60) for _ in children] == [len(init_df)] * 2
+    for child in children:
+        child.join()
+        assert child.exitcode == 0
+    assert _count_rows(sql_conn) == len(init_df)
+
+
+def test_sqlite_threads(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_threads.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.append_to_table(table_name='test_threads', data_to_append=init_df.copy(deep=True))
+
+    # One object serves every thread of the pool
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        counts = list(executor.map(lambda test: sql_conn.get_dataframe(
+            f'SELECT count(1) t_count FROM test_threads WHERE test <= {test}').loc[0, 't_count'], range(1, 33)))
+    assert counts == [min(test, len(init_df)) for test in range(1, 33)]
+
+
+def test_sqlite_async(tmp_path):
+    async def run():
+        async_conn = AsyncSQLConn(SQLParams('', str(tmp_path / 'test_async.db'), '', '', 0, SQLConn.SQLITE))
+        await async_conn.append_to_table(table_name='test_async', data_to_append=init_df.copy(deep=True))
+        await async_conn.execute_sql('DELETE FROM test_async WHERE test > :test', params={'test': 5})
+        counts = await asyncio.gather(*[async_conn.get_dataframe('SELECT count(1) t_count FROM test_async')
+                                        for _ in range(4)])
+        await async_conn.close()
+        return [df.loc[0, 't_count'] for df in counts]
+    assert asyncio.run(run()) == [5] * 4
+
+
+def test_sqlite_iter_dataframes(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_iter.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.append_to_table(table_name='test_iter', data_to_append=init_df.copy(deep=True))
+
+    chunks = list(sql_conn.iter_dataframes('SELECT * FROM test_iter ORDER BY test', chunk_rows=4))
+    assert [len(chunk_df) for chunk_df in chunks] == [4, 4, 2]
+    assert pd.concat(chunks)['test'].tolist() == init_df['test'].tolist()
+    # get_dataframe streams as well when asked for a chunksize
+    chunks = sql_conn.get_dataframe('SELECT * FROM test_iter WHERE test > :test', params={'test': 7}, chunksize=2)
+    assert [chunk_df['test'].tolist() for chunk_df in chunks] == [[8, 9], [10]]
+
+
+def test_sqlite_arrow(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_arrow.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.append_to_table(table_name='test_arrow', data_to_append=init_df.copy(deep=True))
+
+    table = sql_conn.get_arrow_table('SELECT * FROM test_arrow ORDER BY test', batch_rows=3)
+    assert table.num_rows == len(init_df) and table.column_names == list(init_df.columns)
+    assert table.schema.field('test').type == pa.int64()
+    assert table.column('load').to_pylist() == init_df['load'].tolist()
+    arrow_df = sql_conn.get_dataframe('SELECT * FROM test_arrow ORDER BY test', dtype_backend='pyarrow')
+    assert isinstance(arrow_df['test'].dtype, pd.ArrowDtype) and arrow_df['test'].tolist() == init_df['test'].tolist()
+
+
+def test_postgres_parse_copy(tmp_path):
+    # Parses COPY TO STDOUT output, without a Postgres server
+    sql_bridge = PostgresBridge(SQLConn(SQLParams('', str(tmp_path / 'test_copy.db'), '', '', 0, SQLConn.SQLITE)))
+    column = collections.namedtuple('column', ['name', 'type_code'])
+    description = [column('id', 20), column('value', 701), column('flag', 16), column('code', 25),
+                   column('created', 1114)]
+    copy_io = io.BytesIO(b'1,0.5,t,007,2020-01-02 03:04:05\n2,\\N,f,"",\\N\n')
+
+    copy_df = sql_bridge._parse_copy(copy_io, description)
+    assert copy_df['id'].tolist() == [1, 2] and copy_df['flag'].tolist() == [True, False]
+    assert copy_df['code'].tolist() == ['007', ''] and copy_df['value'].isna().tolist() == [False, True]
+    assert copy_df['created'].isna().tolist() == [False, True]
+
+    copy_io.seek(0)
+    table = sql_bridge._parse_copy_arrow(copy_io, description)
+    assert table.column('code').to_pylist() == ['007', ''] and table.column('value').to_pylist() == [0.5, None]
+    assert table.column('flag').to_pylist() == [True, False]
+
+
+def test_sqlite_query_cache(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_cache.db'), '', '', 0, SQLConn.SQLITE,
+                                 {'cache': {'default_ttl': 60, 'spill_dir': str(tmp_path / 'cache')}}))
+    sql_conn.append_to_table(table_name='test_cache', data_to_append=init_df.copy(deep=True))
+
+    sql = "SELECT count(1) t_count FROM test_cache WHERE load <> 'a  b'"
+    assert sql_conn.get_dataframe(sql).loc[0, 't_count'] == len(init_df)
+    assert sql_conn.get_dataframe(sql.replace(' FROM', '\n  FROM')).loc[0, 't_count'] == len(init_df)
+    assert sql_conn.cache_stats()['hits'] == 1
+    # Whitespace inside a literal changes the query
+    sql_conn.get_dataframe(sql.replace('a  b', 'a b'))
+    assert sql_conn.cache_stats()['hits'] == 1
+
+    # Appending to the table drops the results reading from it
+    sql_conn.append_to_table(table_name='test_cache', data_to_append=init_df.copy(deep=True))
+    assert sql_conn.get_dataframe(sql).loc[0, 't_count'] == len(init_df) * 2
+    assert sql_conn.cache_stats()['invalidations'] == 2
+
+
+def test_sqlite_partitioned(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_partitioned.db'), '', '', 0, SQLConn.SQLITE))
+    load_df = pd.DataFrame({'test': list(range(100)) + [None], 'load': [f'row {x}' for x in range(101)]})
+    sql_conn.append_to_table(table_name='test_partitioned', data_to_append=load_df)
+
+    sql = 'SELECT * FROM test_partitioned'
+    for method in ['range', 'hash']:
+        partitioned_df = sql_conn.get_dataframe_partitioned(sql, 'test', num_partitions=4, method=method)
+        assert sorted(partitioned_df['load'].tolist()) == sorted(load_df['load'].tolist())
+    partitions = list(sql_conn.get_dataframe_partitioned(sql, 'test', num_partitions=4, bounds=(0, 99), stream=True))
+    assert len(partitions) == 4 and sum(len(partition_df) for partition_df in partitions) == len(load_df)
+    # Nulls and values below the bounds go to the first partition
+    assert partitions[0]['test'].isna().sum() == 1
+    with pytest.raises(KeyError):
+        sql_conn.get_dataframe_partitioned(sql, 'test', method='list')
+
+
+def test_sqlite_compact(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_compact.db'), '', '', 0, SQLConn.SQLITE))
+    load_df = pd.DataFrame({'test': range(100), 'status': ['open', 'closed'] * 50, 'whole': [1.0, 2.0] * 50,
+                            'value': [0.5, np.nan] * 50})
+    sql_conn.append_to_table(table_name='test_compact', data_to_append=load_df)
+
+    compact_df = sql_conn.get_dataframe('SELECT * FROM test_compact', compact=True)
+    assert compact_df['test'].dtype == np.int8 and isinstance(compact_df['status'].dtype, pd.CategoricalDtype)
+    # sqlite3 does not type its columns, so whole floats stay floats
+    assert compact_df['whole'].dtype == np.float32 and compact_df['value'].dtype == np.float32
+    assert compact_df['status'].tolist() == load_df['status'].tolist()
+
+    # Only columns the database types as integers become nullable integers
+    float_df = pd.DataFrame({'whole': [1.0, None, 3.0], 'id': [1.0, None, 3.0]})
+    float_df = dfcompact.compact_dataframe(float_df, integer_columns=['id'])
+    assert float_df['whole'].dtype == np.float32 and float_df['id'].dtype == 'Int8'
+
+
+def test_sqlite_params(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_params.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.append_to_table(table_name='test_params', data_to_append=init_df.copy(deep=True))
+
+    sql_conn.execute_sql('UPDATE test_params SET load = :load WHERE test = :test', params={'load': "it's", 'test': 1})
+    params_df = sql_conn.get_dataframe('SELECT load FROM test_params WHERE test = :test', params={'test': 1})
+    assert params_df['load'].tolist() == ["it's"]
+    # The catalog query binds the names, the old columns_sql signature is still there
+    assert sql_conn.sql_bridge.get_column_types('test_params', 'main') == [('test', 'BIGINT'), ('load', 'TEXT'),
+                                                                           ('bulk_c', 'BOOLEAN')]
+    assert 'test_params' in sql_conn.sql_bridge.columns_sql(table_name='test_params', schema_name='main')
+
+
+def test_sqlite_execute_many(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_many.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.execute_sql('CREATE TABLE test_many (id INTEGER PRIMARY KEY, value TEXT)')
+
+    sql_conn.execute_many('INSERT INTO test_many (id, value) VALUES (:id, :value)',
+                          [{'id': x, 'value': str(x)} for x in range(100)])
+    sql_conn.execute_batch(['UPDATE test_many SET value = NULL WHERE id < 10', 'DELETE FROM test_many WHERE id >= 90'])
+    count_sql = 'SELECT count(1) t_count, count(value) v_count FROM test_many'
+    assert sql_conn.get_dataframe(count_sql).iloc[0].tolist() == [90, 80]
+
+    # A failing statement rolls back the whole batch
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        sql_conn.execute_batch(['DELETE FROM test_many', 'INSERT INTO test_many (id) VALUES (1), (1)'])
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        sql_conn.execute_many('INSERT INTO test_many (id, value) VALUES (:id, :value)',
+                              [{'id': 100, 'value': 'new'}, {'id': 0, 'value': 'duplicate'}])
+    assert sql_conn.get_dataframe(count_sql).iloc[0].tolist() == [90, 80]
+
+
+def test_sqlite_metadata_cache(tmp_path):
+    sql_conn = SQLConn(SQLParams('', str(tmp_path / 'test_metadata.db'), '', '', 0, SQLConn.SQLITE))
+    sql_conn.append_to_table(table_name='test_metadata', data_to_append=init_df.copy(deep=True))
+
+    sql_conn.sql_bridge.get_columns('test_metadata', 'main')
+    hits = sql_conn.metadata_cache.stats()['hits']
+    assert sql_conn.sql_bridge.get_columns('test_metadata', 'main') == list(init_df.columns)
+    assert sql_conn.metadata_cache.stats()['hits'] == hits + 1
+
+    # DDL run through the connection invalidates the table
+    sql_conn.execute_sql('ALTER TABLE test_metadata ADD COLUMN added TEXT')
+    assert sql_conn.sql_bridge.get_columns('test_metadata', 'main') == list(init_df.columns) + ['added']
+    # Changes made outside of it are picked up after invalidate_metadata
+    with sqlite3.connect(str(tmp_path / 'test_metadata.db')) as connection:
+        connection.execute('ALTER TABLE test_metadata ADD COLUMN outside TEXT')
+    assert 'outside' not in sql_conn.sql_bridge.get_columns('test_metadata', 'main')
+    sql_conn.invalidate_metadata('main.test_metadata')
+    assert 'outside' in sql_conn.sql_bridge.get_columns('test_metadata', 'main')
+
+
+def test_copy_stream():
+    source = DataFrameSource(init_df.copy(deep=True))
+    with CopyStream(source.iter_chunks(3), lambda chunk_df: chunk_df.to_csv(index=False, header=False).encode(),
+                    max_pending=1) as copy_stream:
+        parts = []
+        while True:
+            part = copy_stream.read(7)
+            if not part:
+                break
+            parts.append(part)
+    assert b''.join(parts) == init_df.to_csv(index=False, header=False).encode()
+
+    # A failing chunk is raised to the reader
+    def serialize(chunk_df):
+        raise ValueError('not serializable')
+    with CopyStream(source.iter_chunks(3), serialize) as copy_stream:
+        with pytest.raises(ValueError):
+            copy_stream.read()
+
+
+def test_pgbinary():
+    binary_df = pd.DataFrame({'id': [1, None], 'value': [0.5, 2.0], 'flag': [True, False], 'load': ['a', None]})
+    binary_df['id'] = binary_df['id'].astype('Int64')
+    encoded = pgbinary.encode_rows(binary_df, ['bigint', 'double precision', 'boolean', 'text'])
+    expected = (struct.pack('>hiqidi?ib', 4, 8, 1, 8, 0.5, 1, True, 1, ord('a')) +
+                struct.pack('>hiid', 4, -1, 8, 2.0) + struct.pack('>i?i', 1, False, -1))
+    assert encoded == expected
+    assert pgbinary.HEADER.startswith(b'PGCOPY\n\xff\r\n\x00') and pgbinary.TRAILER == b'\xff\xff'